@@ -5,11 +5,15 @@ Fixed: Spacing issues, natural voice accent, fast responses
 """
 
 import os
+import re
 import sys
 import importlib.util
 import json
 import time
+import queue
+import struct
 import textwrap
+import threading
 from flask import Flask, request, render_template_string, jsonify
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
@@ -21,7 +25,17 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 rag_file_path = os.path.join(current_dir, "pipeline.py")
 
 rag_pipeline = None
+rag_module = None
 sessions = {}
+active_requests = {}
+
+# Token framing: upstream deltas are batched into fewer socket frames.
+# Pending text is sent at a word boundary once TOKEN_FLUSH_MS has passed, at every
+# sentence end, and never later than TOKEN_MAX_LATENCY_MS (0 = one frame per delta).
+TOKEN_FLUSH_MS = float(os.getenv("TOKEN_FLUSH_MS", "40"))
+TOKEN_MAX_LATENCY_MS = float(os.getenv("TOKEN_MAX_LATENCY_MS", "120"))
+# "json" sends {token, request_id}; "binary" sends a 4-byte request id + UTF-8 text
+TOKEN_FRAME_FORMAT = os.getenv("TOKEN_FRAME_FORMAT", "json")
 
 print("\n" + "="*70)
 print(" ADARSHA AI - GEMINI LIVE-STYLE SERVER v3.0")
@@ -608,7 +622,6 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         },
         
         maxHistory: 50,
-        sentenceEndPattern: /[.!?।]+\s*/,
         
         // Voice preferences (in order of priority)
         preferredVoices: {
@@ -649,7 +662,9 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         requestStartTime: null,
         currentAiMessage: null,
         fullResponse: '',
-        spokenLength: 0,
+        speechFinalPending: false,
+        requestCounter: 0,
+        activeRequestId: null,
         voices: [],
         selectedVoice: null
     };
@@ -746,10 +761,24 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         });
         
         STATE.socket.on('token', function(data) {
+            if (data instanceof ArrayBuffer) data = decodeTokenFrame(data);
+            if (!isActiveRequest(data)) return;
             handleStreamToken(data.token);
         });
         
+        // Voice mode: the server sends each complete, speech-cleaned sentence
+        STATE.socket.on('sentence', function(data) {
+            if (!isActiveRequest(data) || !STATE.isVoiceMode) return;
+            if (data.text) {
+                speakText(data.text, data.final);
+            }
+            if (data.final) {
+                finishSpeech();
+            }
+        });
+        
         STATE.socket.on('stream_end', function(data) {
+            if (!isActiveRequest(data)) return;
             handleStreamEnd(data);
         });
         
@@ -762,6 +791,22 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         });
     }
     
+    // Binary token frame: 4-byte big-endian request id, then UTF-8 text
+    const TOKEN_DECODER = new TextDecoder('utf-8');
+    function decodeTokenFrame(buffer) {
+        const requestId = new DataView(buffer).getUint32(0);
+        return {
+            request_id: requestId === 0xFFFFFFFF ? null : requestId,
+            token: TOKEN_DECODER.decode(new Uint8Array(buffer, 4))
+        };
+    }
+    
+    // Frames from a cancelled or superseded request are dropped
+    function isActiveRequest(data) {
+        return !data || data.request_id === undefined || data.request_id === null ||
+               data.request_id === STATE.activeRequestId;
+    }
+    
     function updateConnectionStatus(connected) {
         if (connected) {
             DOM.statusIndicator.classList.add('connected');
@@ -879,11 +924,17 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
     function interruptAI() {
         console.log('[Barge-in] Interrupting AI');
         
+        // Stop the server generating the rest of the answer
+        if (STATE.activeRequestId !== null && STATE.socket) {
+            STATE.socket.emit('cancel', { request_id: STATE.activeRequestId });
+        }
+        STATE.activeRequestId = null;
+        
         STATE.synth.cancel();
         STATE.utteranceQueue = [];
         STATE.isSpeaking = false;
         STATE.isProcessing = false;
-        STATE.spokenLength = 0;
+        STATE.speechFinalPending = false;
         
         setOrbState('listening');
         DOM.voiceStatus.textContent = 'LISTENING';
@@ -901,7 +952,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         STATE.isProcessing = true;
         STATE.requestStartTime = performance.now();
         STATE.fullResponse = '';
-        STATE.spokenLength = 0;
+        STATE.speechFinalPending = false;
         
         if (isVoice) {
             setOrbState('processing');
@@ -915,11 +966,15 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         DOM.chatContainer.appendChild(STATE.currentAiMessage);
         scrollToBottom();
         
+        STATE.requestCounter += 1;
+        STATE.activeRequestId = STATE.requestCounter;
+        
         const eventName = isVoice ? 'voice_query' : 'text_query';
         STATE.socket.emit(eventName, {
             message: text,
             lang: STATE.currentLang,
-            voice: isVoice
+            voice: isVoice,
+            request_id: STATE.activeRequestId
         });
     }
     
@@ -948,10 +1003,9 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             scrollToBottom();
         }
         
-        // Voice mode: progressive TTS
+        // Voice mode: speech comes from the server's 'sentence' events
         if (STATE.isVoiceMode) {
             DOM.liveTranscript.textContent = STATE.fullResponse.slice(-200);
-            progressiveTTS();
         }
     }
     
@@ -960,12 +1014,9 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             STATE.currentAiMessage.classList.remove('streaming');
         }
         
-        // Speak any remaining text
-        if (STATE.isVoiceMode && STATE.fullResponse) {
-            const remaining = STATE.fullResponse.substring(STATE.spokenLength).trim();
-            if (remaining) {
-                speakText(remaining, true);
-            }
+        // A failed stream sends no final sentence; still hand the mic back
+        if (STATE.isVoiceMode && data && data.success === false) {
+            finishSpeech();
         }
         
         if (!STATE.isVoiceMode) {
@@ -975,21 +1026,34 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
     }
     
     // =====================================================================
-    // PROGRESSIVE TEXT-TO-SPEECH - HUMAN-LIKE VOICE
+    // SENTENCE TEXT-TO-SPEECH - HUMAN-LIKE VOICE
     // =====================================================================
-    function progressiveTTS() {
-        const unspoken = STATE.fullResponse.substring(STATE.spokenLength);
-        const match = unspoken.match(CONFIG.sentenceEndPattern);
+    // No more sentences are coming: go back to listening once the queue drains
+    function finishSpeech() {
+        STATE.speechFinalPending = true;
+        if (STATE.utteranceQueue.length === 0) {
+            completeSpeech();
+        }
+    }
+    
+    function completeSpeech() {
+        STATE.speechFinalPending = false;
+        STATE.isSpeaking = false;
+        STATE.isProcessing = false;
         
-        if (match) {
-            const sentenceEnd = match.index + match[0].length;
-            const sentence = unspoken.substring(0, sentenceEnd).trim();
-            
-            if (sentence) {
-                STATE.spokenLength += sentenceEnd;
-                speakText(sentence, false);
-            }
+        if (STATE.currentAiMessage) {
+            STATE.currentAiMessage.classList.remove('streaming', 'speaking');
         }
+        
+        if (STATE.isVoiceMode) {
+            DOM.liveTranscript.textContent = '';
+            DOM.interruptHint.style.opacity = '0';
+            setOrbState('listening');
+            DOM.voiceStatus.textContent = 'LISTENING';
+            setTimeout(startListening, 200);
+        }
+        
+        STATE.currentAiMessage = null;
     }
     
     function speakText(text, isFinal) {
@@ -1028,23 +1092,8 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         utterance.onend = function() {
             STATE.utteranceQueue = STATE.utteranceQueue.filter(u => u !== utterance);
             
-            if (STATE.utteranceQueue.length === 0 && isFinal) {
-                STATE.isSpeaking = false;
-                STATE.isProcessing = false;
-                
-                if (STATE.currentAiMessage) {
-                    STATE.currentAiMessage.classList.remove('speaking');
-                }
-                
-                if (STATE.isVoiceMode) {
-                    DOM.liveTranscript.textContent = '';
-                    DOM.interruptHint.style.opacity = '0';
-                    setOrbState('listening');
-                    DOM.voiceStatus.textContent = 'LISTENING';
-                    setTimeout(startListening, 200);
-                }
-                
-                STATE.currentAiMessage = null;
+            if (STATE.utteranceQueue.length === 0 && (isFinal || STATE.speechFinalPending)) {
+                completeSpeech();
             }
         };
         
@@ -1136,7 +1185,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         
         STATE.finalTranscript = '';
         STATE.utteranceQueue = [];
-        STATE.spokenLength = 0;
+        STATE.speechFinalPending = false;
     }
     
     function handleOrbClick() {
@@ -1200,6 +1249,172 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
 </body>
 </html>'''
 
+# ==================================================================================
+# TOKEN FRAMING
+# ==================================================================================
+class TokenFrameAggregator:
+    """Batches upstream deltas into fewer socket frames with a bounded delay"""
+    
+    SENTENCE_END = re.compile(r'[.!?।]["\')\]]*\s*$')
+    
+    def __init__(self, flush_ms=TOKEN_FLUSH_MS, max_latency_ms=TOKEN_MAX_LATENCY_MS):
+        self.flush_after = flush_ms / 1000.0
+        self.max_latency = max_latency_ms / 1000.0
+        self._pending = []
+        self._since = None
+        self.tokens = 0
+        self.frames = 0
+    
+    def add(self, token, now=None):
+        """Buffer one delta and return the frames that are ready to send"""
+        now = time.monotonic() if now is None else now
+        self.tokens += 1
+        ready = []
+        # A delta that opens a new word closes the previous one
+        if self._pending and token[:1].isspace() and now - self._since >= self.flush_after:
+            ready.append(self.flush())
+        if not self._pending:
+            self._since = now
+        self._pending.append(token)
+        
+        age = now - self._since
+        if (age >= self.max_latency or self.SENTENCE_END.search(token)
+                or (token[-1:].isspace() and age >= self.flush_after)):
+            ready.append(self.flush())
+        return ready
+    
+    def deadline(self):
+        """Monotonic time by which pending text must go out, or None when idle"""
+        if not self._pending:
+            return None
+        return self._since + self.max_latency
+    
+    def flush(self):
+        if not self._pending:
+            return None
+        text = "".join(self._pending)
+        self._pending = []
+        self._since = None
+        self.frames += 1
+        return text
+
+def encode_frame(text, request_id):
+    if TOKEN_FRAME_FORMAT == "binary":
+        rid = request_id if isinstance(request_id, int) and 0 <= request_id < 0xFFFFFFFF else 0xFFFFFFFF
+        return struct.pack(">I", rid) + text.encode("utf-8")
+    return {'token': text, 'request_id': request_id}
+
+_frame_lock = threading.Lock()
+frame_stats = {"responses": 0, "tokens": 0, "frames": 0, "cpu_ms": 0.0, "cpu_measured": 0}
+
+def record_frames(aggregator, cpu_seconds=None):
+    with _frame_lock:
+        frame_stats["responses"] += 1
+        frame_stats["tokens"] += aggregator.tokens
+        frame_stats["frames"] += aggregator.frames
+        if cpu_seconds is not None:
+            frame_stats["cpu_ms"] += cpu_seconds * 1000
+            frame_stats["cpu_measured"] += 1
+
+def frame_metrics():
+    with _frame_lock:
+        responses = frame_stats["responses"]
+        measured = frame_stats["cpu_measured"]
+        return {
+            "format": TOKEN_FRAME_FORMAT,
+            "flush_ms": TOKEN_FLUSH_MS,
+            "max_latency_ms": TOKEN_MAX_LATENCY_MS,
+            "responses": responses,
+            "tokens_per_response": round(frame_stats["tokens"] / responses, 1) if responses else 0.0,
+            "frames_per_response": round(frame_stats["frames"] / responses, 1) if responses else 0.0,
+            "cpu_ms_per_stream": round(frame_stats["cpu_ms"] / measured, 2) if measured else 0.0,
+        }
+
+def relay_frames(stream, aggregator, send, cancel_token, on_token=None):
+    """Send a token stream as frames; the stream is pumped on a worker thread so
+    pending text still goes out on time while upstream is stalled.
+    Returns (full text, CPU seconds spent on both threads)."""
+    tokens = queue.Queue()
+    end = object()
+    producer_cpu = [0.0]
+    
+    def produce():
+        started = time.thread_time()
+        try:
+            for token in stream:
+                tokens.put(token)
+        except Exception as e:
+            tokens.put(e)
+        finally:
+            stream.close()
+            producer_cpu[0] = time.thread_time() - started
+            tokens.put(end)
+    
+    worker = threading.Thread(target=produce, name="token-pump", daemon=True)
+    worker.start()
+    started = time.thread_time()
+    parts = []
+    try:
+        while True:
+            deadline = aggregator.deadline()
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = tokens.get(timeout=timeout)
+            except queue.Empty:
+                send(aggregator.flush())
+                continue
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if cancel_token.cancelled:
+                break
+            parts.append(item)
+            for frame in aggregator.add(item):
+                send(frame)
+            if on_token is not None:
+                on_token(item)
+        
+        if not cancel_token.cancelled:
+            tail = aggregator.flush()
+            if tail:
+                send(tail)
+    finally:
+        if worker.is_alive():
+            # Leaving early (cancel or a failed send): make sure upstream stops too
+            cancel_token.cancel()
+            worker.join(timeout=1.0)
+    
+    return "".join(parts), (time.thread_time() - started) + producer_cpu[0]
+
+# ==================================================================================
+# VOICE SENTENCES
+# ==================================================================================
+first_sentence_ms = rag_module.Histogram([250, 500, 750, 1000, 1500, 2000, 3000, 5000]) if rag_module else None
+
+class SentenceRelay:
+    """Turns a voice token stream into 'sentence' payloads the page can speak directly"""
+    
+    def __init__(self, request_id, start_time):
+        self.segmenter = rag_module.SentenceSegmenter()
+        self.request_id = request_id
+        self.start_time = start_time
+        self.first_ms = None
+    
+    def feed(self, token):
+        return [self._payload(sentence, False) for sentence in self.segmenter.feed(token)]
+    
+    def finish(self):
+        """Final payload; always sent so the page knows speech is complete"""
+        return self._payload(self.segmenter.finish(), True)
+    
+    def _payload(self, sentence, final):
+        text = rag_module.ResponseCleaner.clean_for_voice(sentence) if sentence else ''
+        if text and self.first_ms is None:
+            self.first_ms = (time.time() - self.start_time) * 1000
+            first_sentence_ms.observe(self.first_ms)
+        return {'text': text, 'index': self.segmenter.count, 'final': final, 'request_id': self.request_id}
+
 # ==================================================================================
 # WEBSOCKET EVENT HANDLERS
 # ==================================================================================
@@ -1211,9 +1426,23 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     print(f'\n\033[91m🔌 Client disconnected: {request.sid}\033[0m')
+    cancel_active_request(request.sid)
     if request.sid in sessions:
         del sessions[request.sid]
 
+@socketio.on('cancel')
+def handle_cancel(data=None):
+    """Barge-in: stop generating the answer nobody is listening to"""
+    if cancel_active_request(request.sid):
+        print(f'\n\033[93m⏹  Stream cancelled by client: {request.sid}\033[0m')
+
+def cancel_active_request(session_id):
+    cancel_token = active_requests.pop(session_id, None)
+    if cancel_token is None:
+        return False
+    cancel_token.cancel()
+    return True
+
 @socketio.on('voice_query')
 def handle_voice_query(data):
     """Handle voice mode queries - AI knows user is speaking"""
@@ -1227,6 +1456,7 @@ def handle_text_query(data):
 def handle_query(data, is_voice):
     user_input = data.get('message', '').strip()
     lang = data.get('lang', 'en-US')
+    request_id = data.get('request_id')
     session_id = request.sid
     
     if not user_input:
@@ -1250,14 +1480,50 @@ def handle_query(data, is_voice):
         if rag_pipeline:
             full_response = ""
             
+            # A new question from the same client supersedes any answer still streaming
+            cancel_active_request(session_id)
+            cancel_token = rag_module.CancellationToken()
+            active_requests[session_id] = cancel_token
+            
             # Pass is_voice to the pipeline for proper formatting
-            for token in rag_pipeline.chat_stream(user_input, is_voice=is_voice, perception_data=perception):
-                full_response += token
-                emit('token', {'token': token})
+            stream = rag_pipeline.chat_stream(user_input, is_voice=is_voice,
+                                              perception_data=perception, cancel_token=cancel_token)
+            aggregator = TokenFrameAggregator()
+            sentences = SentenceRelay(request_id, start_time) if is_voice else None
+            
+            def send(text):
+                emit('token', encode_frame(text, request_id))
                 socketio.sleep(0)
             
+            def speak(token):
+                for payload in sentences.feed(token):
+                    emit('sentence', payload)
+            
+            try:
+                full_response, cpu_seconds = relay_frames(stream, aggregator, send, cancel_token,
+                                                          on_token=speak if sentences else None)
+            finally:
+                if active_requests.get(session_id) is cancel_token:
+                    del active_requests[session_id]
+            record_frames(aggregator, cpu_seconds)
+            
             response_time = int((time.time() - start_time) * 1000)
+            if cancel_token.cancelled:
+                print(f'\n\033[93m⏹  Cancelled after {len(full_response)} chars ({response_time}ms)\033[0m')
+                if session_id in sessions and full_response:
+                    sessions[session_id].append({'role': 'user', 'content': user_input})
+                    sessions[session_id].append({'role': 'assistant', 'content': full_response})
+                emit('stream_end', {'success': True, 'cancelled': True, 'request_id': request_id})
+                return
+            
             print_bubble("AI", full_response, response_time, is_voice=is_voice)
+            print(f'   📦 {aggregator.frames} frames for {aggregator.tokens} tokens, '
+                  f'{cpu_seconds * 1000:.1f}ms CPU')
+            if sentences:
+                emit('sentence', sentences.finish())
+                if sentences.first_ms is not None:
+                    print(f'   🗣  First sentence after {sentences.first_ms:.0f}ms '
+                          f'({sentences.segmenter.count} sentences)')
             
             # Update session history
             sessions[session_id].append({'role': 'user', 'content': user_input})
@@ -1267,7 +1533,7 @@ def handle_query(data, is_voice):
             if len(sessions[session_id]) > 20:
                 sessions[session_id] = sessions[session_id][-20:]
             
-            emit('stream_end', {'success': True})
+            emit('stream_end', {'success': True, 'request_id': request_id})
         else:
             emit('token', {'token': 'Pipeline not loaded. Please check server logs.'})
             emit('stream_end', {'success': False})
@@ -1296,6 +1562,13 @@ def health():
         'version': '3.0'
     })
 
+@app.route('/metrics')
+def metrics():
+    if not rag_pipeline or not hasattr(rag_pipeline, 'get_metrics'):
+        return jsonify({'pipeline': False, 'token_frames': frame_metrics()})
+    return jsonify({**rag_pipeline.get_metrics(), 'token_frames': frame_metrics(),
+                    'first_sentence_ms': first_sentence_ms.snapshot()})
+
 # ==================================================================================
 # MAIN
 # ==================================================================================
@@ -0,0 +1,251 @@
+"""
+ADARSHA AI - ASGI VOICE SERVER
+Same page and socket protocol as app.py, served from one asyncio event loop.
+Groq streams are awaited instead of holding an OS thread each, so the number of
+concurrent sockets is no longer capped by the thread count.
+
+Run: python asgi_app.py   (or: uvicorn asgi_app:app --port 5001)
+"""
+
+import os
+import json
+import time
+import asyncio
+
+import socketio
+import uvicorn
+
+from app import (HTML_TEMPLATE, print_bubble, rag_pipeline, rag_module,
+                 TokenFrameAggregator, encode_frame, record_frames, frame_metrics,
+                 SentenceRelay, first_sentence_ms)
+
+ASGI_HOST = os.getenv("ASGI_HOST", "0.0.0.0")
+ASGI_PORT = int(os.getenv("ASGI_PORT", "5001"))
+
+sio = socketio.AsyncServer(
+    async_mode='asgi',
+    cors_allowed_origins="*",
+    ping_timeout=120,
+    ping_interval=25
+)
+
+sessions = {}
+active_requests = {}
+
+# ==================================================================================
+# WEBSOCKET EVENT HANDLERS
+# ==================================================================================
+@sio.event
+async def connect(sid, environ):
+    print(f'\n\033[92m🔌 Client connected: {sid}\033[0m')
+    sessions[sid] = []
+
+@sio.event
+async def disconnect(sid):
+    print(f'\n\033[91m🔌 Client disconnected: {sid}\033[0m')
+    cancel_active_request(sid)
+    sessions.pop(sid, None)
+
+@sio.on('cancel')
+async def handle_cancel(sid, data=None):
+    """Barge-in: stop generating the answer nobody is listening to"""
+    if cancel_active_request(sid):
+        print(f'\n\033[93m⏹  Stream cancelled by client: {sid}\033[0m')
+
+def cancel_active_request(session_id):
+    active = active_requests.pop(session_id, None)
+    if active is None:
+        return False
+    cancel_token, task = active
+    cancel_token.cancel()
+    # Cancelling the task interrupts an await on the upstream socket right away
+    task.cancel()
+    return True
+
+@sio.on('voice_query')
+async def handle_voice_query(sid, data):
+    """Handle voice mode queries - AI knows user is speaking"""
+    await handle_query(sid, data, is_voice=True)
+
+@sio.on('text_query')
+async def handle_text_query(sid, data):
+    """Handle text mode queries"""
+    await handle_query(sid, data, is_voice=False)
+
+async def handle_query(sid, data, is_voice):
+    user_input = data.get('message', '').strip()
+    lang = data.get('lang', 'en-US')
+    request_id = data.get('request_id')
+
+    if not user_input:
+        await sio.emit('error', {'message': 'Empty input'}, to=sid)
+        return
+
+    print_bubble("USER", user_input, is_voice=is_voice)
+
+    if not rag_pipeline:
+        await sio.emit('token', {'token': 'Pipeline not loaded. Please check server logs.'}, to=sid)
+        await sio.emit('stream_end', {'success': False}, to=sid)
+        return
+
+    history = sessions.setdefault(sid, [])
+    perception = {
+        'language': lang,
+        'history': history[-10:],
+        'is_voice_mode': is_voice
+    }
+
+    start_time = time.time()
+    parts = []
+    aggregator = TokenFrameAggregator()
+    sentences = SentenceRelay(request_id, start_time) if is_voice else None
+
+    async def send(text):
+        await sio.emit('token', encode_frame(text, request_id), to=sid)
+
+    async def relay():
+        stream = rag_pipeline.chat_stream_async(user_input, is_voice=is_voice,
+                                                perception_data=perception, cancel_token=cancel_token)
+        tokens = stream.__aiter__()
+        pending = None
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(tokens.__anext__())
+                # Wait for the next delta, but no longer than the frame latency bound
+                deadline = aggregator.deadline()
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    await send(aggregator.flush())
+                    continue
+                try:
+                    token = pending.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    pending = None
+                if cancel_token.cancelled:
+                    break
+                parts.append(token)
+                for frame in aggregator.add(token):
+                    await send(frame)
+                if sentences:
+                    for payload in sentences.feed(token):
+                        await sio.emit('sentence', payload, to=sid)
+            if not cancel_token.cancelled:
+                tail = aggregator.flush()
+                if tail:
+                    await send(tail)
+        finally:
+            if pending is not None:
+                pending.cancel()
+                try:
+                    await pending
+                except BaseException:
+                    pass
+            await stream.aclose()
+
+    # A new question from the same client supersedes any answer still streaming
+    cancel_active_request(sid)
+    cancel_token = rag_module.CancellationToken()
+    task = asyncio.ensure_future(relay())
+    active_requests[sid] = (cancel_token, task)
+
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        print(f'\n\033[91m❌ Error: {e}\033[0m')
+        await sio.emit('error', {'message': str(e)}, to=sid)
+        await sio.emit('stream_end', {'success': False}, to=sid)
+        return
+    finally:
+        if active_requests.get(sid, (None, None))[1] is task:
+            del active_requests[sid]
+
+    record_frames(aggregator)
+    full_response = "".join(parts)
+    response_time = int((time.time() - start_time) * 1000)
+    if cancel_token.cancelled:
+        print(f'\n\033[93m⏹  Cancelled after {len(full_response)} chars ({response_time}ms)\033[0m')
+        if sid in sessions and full_response:
+            sessions[sid].append({'role': 'user', 'content': user_input})
+            sessions[sid].append({'role': 'assistant', 'content': full_response})
+        await sio.emit('stream_end', {'success': True, 'cancelled': True, 'request_id': request_id}, to=sid)
+        return
+
+    print_bubble("AI", full_response, response_time, is_voice=is_voice)
+    if sentences:
+        await sio.emit('sentence', sentences.finish(), to=sid)
+        if sentences.first_ms is not None:
+            print(f'   🗣  First sentence after {sentences.first_ms:.0f}ms '
+                  f'({sentences.segmenter.count} sentences)')
+
+    if sid in sessions:
+        sessions[sid].append({'role': 'user', 'content': user_input})
+        sessions[sid].append({'role': 'assistant', 'content': full_response})
+        if len(sessions[sid]) > 20:
+            sessions[sid] = sessions[sid][-20:]
+
+    await sio.emit('stream_end', {'success': True, 'request_id': request_id}, to=sid)
+
+# ==================================================================================
+# HTTP ROUTES
+# ==================================================================================
+async def send_response(send, status, body, content_type):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def http_app(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    path = scope['path']
+    if path == '/':
+        await send_response(send, 200, HTML_TEMPLATE.encode('utf-8'), 'text/html; charset=utf-8')
+    elif path == '/health':
+        body = {
+            'status': 'healthy',
+            'pipeline': rag_pipeline is not None,
+            'websocket': True,
+            'sessions': len(sessions),
+            'server': 'asgi',
+            'version': '3.0'
+        }
+        await send_response(send, 200, json.dumps(body).encode(), 'application/json')
+    elif path == '/metrics':
+        body = rag_pipeline.get_metrics() if rag_pipeline else {'pipeline': False}
+        body['token_frames'] = frame_metrics()
+        if first_sentence_ms is not None:
+            body['first_sentence_ms'] = first_sentence_ms.snapshot()
+        await send_response(send, 200, json.dumps(body).encode(), 'application/json')
+    else:
+        await send_response(send, 404, b'Not Found', 'text/plain')
+
+async def on_startup():
+    if rag_pipeline and rag_module.GROQ_PREWARM and rag_pipeline.llm.api_keys:
+        await rag_pipeline.llm.async_pool.prewarm_async()
+
+async def on_shutdown():
+    if rag_pipeline:
+        await rag_pipeline.llm.async_pool.aclose()
+
+app = socketio.ASGIApp(sio, other_asgi_app=http_app,
+                       on_startup=on_startup, on_shutdown=on_shutdown)
+
+# ==================================================================================
+# MAIN
+# ==================================================================================
+if __name__ == '__main__':
+    print("\n" + "="*50)
+    print(f" 🚀 Server: http://localhost:{ASGI_PORT}")
+    print(" 🔌 WebSocket: Enabled (ASGI)")
+    print(" ✅ Pipeline:", "Loaded" if rag_pipeline else "Not Found")
+    print("="*50 + "\n")
+
+    uvicorn.run(app, host=ASGI_HOST, port=ASGI_PORT, log_level="warning")
@@ -0,0 +1,364 @@
+"""
+ADARSHA AI - CHUNKER CHECK & BENCHMARK
+1. Golden: data/chunker_golden.json holds the chunks the original chunker produced for
+   alldata.txt; chunk_with_semantic_preservation and the streaming path
+   (read_source_lines -> iter_chunks) must both reproduce it exactly.
+2. Parity: random documents built from boundary lines, entity labels, keywords and
+   case-folding oddities must chunk exactly as the original implementation does.
+3. Throughput: original vs current chunker on alldata.txt, and each internal piece
+   (boundary test per line, entity/keyword extraction per chunk) on its own.
+4. Memory (--memory GB): builds corpora of 1/16, 1/4 and all of GB from tagged copies
+   of alldata.txt and chunks each in a fresh process, streaming and (for the smallest)
+   the old read-everything way, reporting peak RSS. Streaming should stay flat.
+
+Usage: python bench_chunker.py [cases] [seed] [--memory GB] [--keep]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+from pathlib import Path
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+GOLDEN_PATH = DATA_DIR / "chunker_golden.json"
+SOURCE_PATH = DATA_DIR / "data_for_vectordb" / "alldata.txt"
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+
+
+def comparable(chunk):
+    # The original chunker ordered keywords by set iteration, so compare membership only
+    return dict(chunk, keywords=sorted(chunk["keywords"]))
+
+
+class LegacyTextChunker:
+    """The chunker as it was before the compiled boundary regex and the automaton,
+    kept for parity and timing"""
+    def __init__(self, chunk_size=1500, overlap=300):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.major_section_patterns = [r'^={50,}', r'^SECTION\s+\d+:', r'^\[METADATA\]']
+        self.sub_section_patterns = [
+            r'^-{30,}', r'^\d+\.\d+\s+[A-Z]', r'^[A-Z][A-Z\s]{8,}:?\s*$',
+            r'^ZONE\s+[A-D]:', r'^#+\s+', r'^\*\*[^*]+\*\*\s*$',
+        ]
+        self.entity_patterns = {
+            'person': r'(Name:|Lead|Developer|Teacher|Principal|Student):?\s*([^\n]+)',
+            'location': r'(Location|Address|District|Municipality):?\s*([^\n]+)',
+            'date': r'(Established|Founded|Date):?\s*([^\n]+)',
+            'contact': r'(Phone|Email|Website):?\s*([^\n]+)',
+        }
+
+    def is_major_boundary(self, line):
+        line = line.strip()
+        return any(re.match(pattern, line) for pattern in self.major_section_patterns)
+
+    def is_sub_boundary(self, line):
+        line = line.strip()
+        return any(re.match(pattern, line) for pattern in self.sub_section_patterns)
+
+    def extract_entities(self, text):
+        entities = {}
+        for entity_type, pattern in self.entity_patterns.items():
+            matches = re.findall(pattern, text, re.IGNORECASE)
+            if matches:
+                entities[entity_type] = [match[1].strip() for match in matches if match[1].strip()]
+        return entities
+
+    def extract_keywords(self, text):
+        keywords = set()
+        important_terms = [
+            'Adarsha', 'School', 'Thimi', 'Bhaktapur', 'Technical', 'CTEVT', 'NEB',
+            'Sangam Gautam', 'AI', 'Chatbot', 'Developer', 'Project', 'Science',
+            'Renewable Energy', 'Exhibition', 'Student', 'Teacher', 'Principal',
+            'Admission', 'Examination', 'SEE', 'TSLC', 'Computer Engineering'
+        ]
+        text_lower = text.lower()
+        for term in important_terms:
+            if term.lower() in text_lower:
+                keywords.add(term)
+        return list(keywords)
+
+    def extract_section_hierarchy(self, line):
+        line = line.strip()
+        line = re.sub(r'^={3,}\s*', '', line)
+        line = re.sub(r'^-{3,}\s*', '', line)
+        line = re.sub(r'^#+\s*', '', line)
+        line = re.sub(r'^\*\*|\*\*$', '', line)
+        line = re.sub(r'^SECTION\s+\d+:\s*', '', line, flags=re.IGNORECASE)
+        return line[:150] if line else "General"
+
+    def _record(self, chunk_text, major, sub, context, index, line_start, line_end):
+        return {
+            'text': chunk_text, 'major_section': major, 'sub_section': sub,
+            'section_path': ' > '.join(context) if context else major,
+            'entities': self.extract_entities(chunk_text), 'keywords': self.extract_keywords(chunk_text),
+            'index': index, 'line_start': line_start, 'line_end': line_end,
+            'char_count': len(chunk_text), 'word_count': len(chunk_text.split())
+        }
+
+    def chunk_with_semantic_preservation(self, text):
+        if not text or not text.strip():
+            return []
+        lines = re.sub(r'\r\n', '\n', text).split('\n')
+        chunks, current, major, sub, length, start, context = [], [], "Document Root", "General", 0, 0, []
+        for i, line in enumerate(lines):
+            if self.is_major_boundary(line):
+                if current:
+                    chunk_text = '\n'.join(current).strip()
+                    if len(chunk_text) > 100:
+                        chunks.append(self._record(chunk_text, major, sub, context, len(chunks), start, i - 1))
+                new_major = self.extract_section_hierarchy(line)
+                if new_major:
+                    major, context, sub = new_major, [new_major], "General"
+                current, length, start = [line], len(line), i
+                continue
+            if self.is_sub_boundary(line):
+                new_sub = self.extract_section_hierarchy(line)
+                if new_sub:
+                    sub = new_sub
+                    if len(context) < 2:
+                        context.append(new_sub)
+                    else:
+                        context[-1] = new_sub
+            current.append(line)
+            length += len(line) + 1
+            if length >= self.chunk_size:
+                chunk_text = '\n'.join(current).strip()
+                if len(chunk_text) > 100:
+                    chunks.append(self._record(chunk_text, major, sub, context, len(chunks), start, i))
+                overlap_lines, overlap_length = [], 0
+                for ol in reversed(current):
+                    if overlap_length + len(ol) + 1 <= self.overlap:
+                        overlap_lines.insert(0, ol)
+                        overlap_length += len(ol) + 1
+                    else:
+                        break
+                current, length = overlap_lines, overlap_length
+                start = max(0, i - len(overlap_lines) + 1)
+        if current:
+            chunk_text = '\n'.join(current).strip()
+            if len(chunk_text) > 100:
+                chunks.append(self._record(chunk_text, major, sub, context, len(chunks), start, len(lines) - 1))
+        return chunks
+
+
+# Lines and fragments that hit every boundary pattern, entity label and keyword, plus
+# the characters str.lower() and re.IGNORECASE fold differently
+BOUNDARY_LINES = [
+    "=" * 60, "=" * 49, "SECTION 4: FACILITIES", "  SECTION 12:", "[METADATA]", "-" * 40, "-" * 29,
+    "4.4 RELIGION", "2.10 Staff", "IMPORTANT NOTICE:", "ADMISSION RULES   ", "ZONE B: Energy",
+    "## Heading", "#NoSpace", "**Bold title**", "**Bold** trailing", "", "   ",
+]
+FRAGMENTS = [
+    "Name:", "name:", "Lead", "leadership", "Developer", "TEACHER", "Principal:", "Student",
+    "Location", "Address:", "District", "Municipality", "Established", "founded", "Date:", "update",
+    "Phone", "Email:", "WEBSITE", "Adarsha", "Thimi", "AI", "chatbot", "SEE", "seed", "tslc",
+    "Sangam Gautam", "sangam  gautam", "Renewable Energy", "computer engineering", "NEB", "ctevt",
+    "Ram Sharma", "2065 B.S.", "Bhaktapur", "the", "school", "and", "project", ":", "::", " ",
+    "  ", "\t", "\n", "\n\n", "नमस्ते", "K",
+]
+# Rare, so most chunks still go through the automaton rather than the regex fallback
+FOLD_FRAGMENTS = ["\u0130", "\u0131", "\u017f", "Addreſs", "Dıstrict", "SECTİON"]
+
+
+def random_document(rng):
+    lines = []
+    for _ in range(rng.randint(0, 120)):
+        if rng.random() < 0.15:
+            lines.append(rng.choice(BOUNDARY_LINES))
+        else:
+            lines.append(" ".join(rng.choice(FOLD_FRAGMENTS if rng.random() < 0.002 else FRAGMENTS)
+                                  for _ in range(rng.randint(0, 40))))
+    return "\n".join(lines) + rng.choice(["", "\n", "\r\n", " Lead", " Name:", " Date:\n\n"])
+
+
+def check_golden(cvdb):
+    golden = json.loads(GOLDEN_PATH.read_text(encoding="utf-8"))
+    chunker = cvdb.EnhancedTextChunker()
+    content = SOURCE_PATH.read_text(encoding="utf-8")
+
+    whole = [comparable(chunk) for chunk in chunker.chunk_with_semantic_preservation(content)]
+    totals = {}
+    streamed = [comparable(chunk) for chunk in chunker.iter_chunks(cvdb.read_source_lines(SOURCE_PATH, totals))]
+
+    ok = True
+    for label, chunks in (("whole-file", whole), ("streaming", streamed)):
+        same = sum(1 for a, b in zip(chunks, golden) if a == b)
+        if same != len(golden) or len(chunks) != len(golden):
+            ok = False
+        print(f"  golden {label:<11} {same}/{len(golden)} chunks identical ({len(chunks)} produced)")
+
+    with open(SOURCE_PATH, "r", encoding="utf-8") as f:
+        text = f.read()
+    expected = {"total_lines": len(text.split("\n")), "total_words": len(text.split()), "total_chars": len(text)}
+    if totals != expected:
+        ok = False
+        print(f"  TOTALS MISMATCH streamed={totals} expected={expected}")
+    else:
+        print(f"  totals identical: {totals['total_lines']:,} lines, {totals['total_words']:,} words")
+    return ok
+
+
+def check_parity(cvdb, cases, seed):
+    rng = random.Random(seed)
+    legacy = LegacyTextChunker()
+    failures = 0
+    for _ in range(cases):
+        text = random_document(rng)
+        chunk_size, overlap = rng.choice([(1500, 300), (400, 120), (200, 0)])
+        legacy.chunk_size, legacy.overlap = chunk_size, overlap
+        expected = [comparable(chunk) for chunk in legacy.chunk_with_semantic_preservation(text)]
+        got = [comparable(chunk) for chunk in
+               cvdb.EnhancedTextChunker(chunk_size, overlap).chunk_with_semantic_preservation(text)]
+        if got != expected:
+            failures += 1
+            if failures <= 3:
+                diff = next((i for i, (a, b) in enumerate(zip(got, expected)) if a != b), min(len(got), len(expected)))
+                print(f"  MISMATCH at chunk {diff} of {len(expected)} (got {len(got)}), text={text[:160]!r}")
+    print(f"  parity: {cases - failures}/{cases} random documents chunked identically")
+    return failures == 0
+
+
+def timed(fn, rounds):
+    fn()  # warm-up
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds
+
+
+def throughput(cvdb, rounds):
+    content = SOURCE_PATH.read_text(encoding="utf-8")
+    legacy, current = LegacyTextChunker(), cvdb.EnhancedTextChunker()
+    lines = content.split("\n")
+    texts = [chunk["text"] for chunk in current.chunk_with_semantic_preservation(content)]
+    megabytes = len(content.encode("utf-8")) / 1e6
+
+    print(f"\n  {SOURCE_PATH.name}: {megabytes:.2f} MB, {len(lines):,} lines, {len(texts)} chunks, {rounds} rounds")
+    rows = [
+        ("whole chunker", lambda c: c.chunk_with_semantic_preservation(content), megabytes, "MB/s"),
+        ("boundary tests", lambda c: [c.is_major_boundary(line) or c.is_sub_boundary(line) for line in lines],
+         len(lines), "lines/s"),
+        ("entities + keywords", lambda c: [(c.extract_entities(text), c.extract_keywords(text)) for text in texts],
+         len(texts), "chunks/s"),
+    ]
+    print(f"  {'':<22} {'original':>14} {'current':>14}  speedup")
+    for label, fn, amount, unit in rows:
+        before = timed(lambda: fn(legacy), rounds)
+        # One combined pass answers both, so time it the way the chunker calls it
+        if label == "entities + keywords":
+            after = timed(lambda: [current.extract_entities_and_keywords(text) for text in texts], rounds)
+        else:
+            after = timed(lambda: fn(current), rounds)
+        print(f"  {label:<22} {amount / before:>10,.1f} {unit:<3} {amount / after:>10,.1f} {unit:<3}"
+              f"  {before / after:5.1f}x")
+
+
+def write_corpus(path, target_bytes):
+    """Tagged copies of alldata.txt until the file reaches target_bytes"""
+    lines = SOURCE_PATH.read_text(encoding="utf-8").split("\n")
+    written, copy = 0, 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target_bytes:
+            # Tag long lines only, so the section markers the chunker looks for stay intact
+            part = "\n".join(f"{line} (copy {copy})" if len(line) > 40 else line for line in lines) + "\n"
+            f.write(part)
+            written += len(part.encode("utf-8"))
+            copy += 1
+    return written
+
+
+def measure(mode, path):
+    """Child process: chunk one file and print one JSON line with the figures"""
+    import create_vector_db as cvdb
+    chunker = cvdb.EnhancedTextChunker()
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    chunks = 0
+    if mode == "stream":
+        for _ in chunker.iter_chunks(cvdb.read_source_lines(Path(path), {})):
+            chunks += 1
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            chunks = len(chunker.chunk_with_semantic_preservation(f.read()))
+    print(json.dumps({"chunks": chunks, "seconds": time.perf_counter() - started,
+                      "baseline_mb": baseline, "peak_mb": peak_rss_mb()}))
+
+
+def run_child(mode, path):
+    output = subprocess.run([sys.executable, __file__, "--measure", mode, str(path)],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def memory(gigabytes, keep):
+    root = Path(tempfile.mkdtemp(prefix="bench_chunker_"))
+    try:
+        sizes = [gigabytes / 16, gigabytes / 4, gigabytes]
+        print(f"\n  {'mode':<8} {'corpus':>10} {'chunks':>12} {'seconds':>9} {'MB/s':>7} "
+              f"{'peak RSS':>10} {'above import':>13}")
+        for position, size in enumerate(sizes):
+            path = root / f"corpus_{position}.txt"
+            written = write_corpus(path, int(size * 1e9))
+            modes = ["stream", "whole"] if position == 0 else ["stream"]
+            for mode in modes:
+                result = run_child(mode, path)
+                rate = written / 1e6 / result["seconds"] if result["seconds"] else 0.0
+                print(f"  {mode:<8} {written / 1e9:>8.2f}GB {result['chunks']:>12,} {result['seconds']:>9.1f} "
+                      f"{rate:>7.1f} {result['peak_mb']:>8.0f}MB {result['peak_mb'] - result['baseline_mb']:>11.0f}MB")
+            if not keep:
+                os.remove(path)
+    finally:
+        if keep:
+            print(f"\n  corpora kept in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3])
+        return 0
+
+    args = sys.argv[1:]
+    gigabytes = None
+    if "--memory" in args:
+        position = args.index("--memory")
+        gigabytes = float(args[position + 1])
+        del args[position:position + 2]
+    keep = "--keep" in args
+    args = [arg for arg in args if not arg.startswith("--")]
+    cases = int(args[0]) if args else 2000
+    seed = int(args[1]) if len(args) > 1 else 0
+
+    import create_vector_db as cvdb
+
+    print("\n" + "=" * 72)
+    print(" CHUNKER")
+    print("=" * 72)
+    ok = check_golden(cvdb)
+    ok = check_parity(cvdb, cases, seed) and ok
+    throughput(cvdb, rounds=5)
+    if gigabytes:
+        memory(gigabytes, keep)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+ADARSHA AI - RESPONSE CLEANER CHECK & BENCHMARK
+1. Golden: data/cleaner_golden.json holds answers with the output recorded from the
+   original chain of re.sub calls; the compiled engine must match it byte for byte.
+2. Parity: random markdown-ish answers, split into random token sizes, must come out
+   of VoiceStreamCleaner exactly as ResponseCleaner.clean_for_voice(full_text).
+3. Throughput: the original regex chain vs the compiled engine, and the per-token
+   chain vs the incremental cleaner.
+
+Usage: python bench_cleaner.py [cases] [seed]
+"""
+
+import re
+import sys
+import json
+import time
+import random
+from pathlib import Path
+
+from pipeline import ResponseCleaner, VoiceStreamCleaner
+
+GOLDEN_PATH = Path(__file__).resolve().parent.parent / "data" / "cleaner_golden.json"
+
+# Fragments that exercise every clean_for_voice pass, alone and across token splits
+FRAGMENTS = [
+    "**", "*", "***", "_", "__", "`", "```", "#", "## ", "\n", "\n\n", "- ", "• ", "* ",
+    "1. ", "12. ", "Er. ", "Mr.", "Ms. ", "Dr.", "B.S.", "A.D.", "AD", " ", "  ", "\t",
+    ".", ",", "!", "?", "|", "@", "$", "~", "[x]", "{", "3.5", "e.g.", "। ",
+    "word", "Hello", "the", "school", "Ram", "Thimi", "a", "Z", "नमस्ते",
+    " *bold* ", "_italic_", "`code`", "| col | col |",
+]
+
+ANSWER = (
+    "## Our Principal\n"
+    "The principal of Adarsha Secondary School is **Er. Ram Sharma**. He joined in 2065 B.S. "
+    "and has led the school since.\n\n"
+    "- Grade 11 offers *Science* and _Management_\n"
+    "- Grade 12 runs the `C programming` lab\n"
+    "1. Morning assembly starts at 10 AM\n"
+    "2. Classes end at 4 PM\n\n"
+    "Feel free to ask me anything else about the school! "
+)
+
+
+def legacy_clean_for_voice(text):
+    """clean_for_voice as it was before the compiled engine, kept for timing"""
+    if not text:
+        return ""
+    text = re.sub(r'#{1,6}\s*', '', text)
+    text = re.sub(r'\*{1,3}([^*]+)\*{1,3}', r'\1', text)
+    text = re.sub(r'_{1,3}([^_]+)_{1,3}', r'\1', text)
+    text = re.sub(r'\*+', '', text)
+    text = re.sub(r'^[\s]*[-•*]\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'^[\s]*\d+\.\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'```[^`]*```', '', text, flags=re.DOTALL)
+    text = re.sub(r'`([^`]+)`', r'\1', text)
+    text = re.sub(r'[~><|\\/@#$%^&+=\[\]{}]', '', text)
+    text = re.sub(r'\|[^\n]*\|', '', text)
+    text = re.sub(r'\bEr\.\s*', 'Engineer ', text)
+    text = re.sub(r'\bMr\.\s*', 'Mister ', text)
+    text = re.sub(r'\bMs\.\s*', 'Miss ', text)
+    text = re.sub(r'\bDr\.\s*', 'Doctor ', text)
+    text = re.sub(r'\bB\.S\.', 'B S', text)
+    text = re.sub(r'\bA\.D\.', 'A D', text)
+    text = re.sub(r'\bAD\b', 'A D', text)
+    text = re.sub(r'\n+', ' ', text)
+    text = re.sub(r'  +', ' ', text)
+    text = re.sub(r'\s+([.,!?])', r'\1', text)
+    text = re.sub(r'([.,!?])([A-Za-z])', r'\1 \2', text)
+    return text.strip()
+
+
+def check_golden():
+    cases = json.loads(GOLDEN_PATH.read_text(encoding="utf-8"))
+    failures = 0
+    for case in cases:
+        if (ResponseCleaner.clean_for_voice(case["input"]) != case["voice"]
+                or ResponseCleaner.clean_for_text(case["input"]) != case["text"]):
+            failures += 1
+            if failures <= 3:
+                print(f"  GOLDEN MISMATCH input={case['input'][:120]!r}")
+    print(f"  golden: {len(cases) - failures}/{len(cases)} recorded answers identical")
+    return cases, failures == 0
+
+
+def random_text(rng):
+    return "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 60)))
+
+
+def split_tokens(text, rng, max_size=8):
+    tokens, i = [], 0
+    while i < len(text):
+        size = rng.randint(1, max_size)
+        tokens.append(text[i:i + size])
+        i += size
+    return tokens
+
+
+def stream_clean(tokens):
+    cleaner = VoiceStreamCleaner()
+    parts = [cleaner.feed(token) for token in tokens]
+    parts.append(cleaner.finish())
+    return "".join(parts)
+
+
+def check_parity(cases, seed):
+    rng = random.Random(seed)
+    failures = 0
+    for _ in range(cases):
+        text = random_text(rng)
+        expected = ResponseCleaner.clean_for_voice(text)
+        for max_size in (1, 4, 16):
+            got = stream_clean(split_tokens(text, rng, max_size))
+            if got != expected:
+                failures += 1
+                if failures <= 3:
+                    print(f"  MISMATCH text={text!r}")
+                    print(f"           expected={expected!r}")
+                    print(f"           got     ={got!r}")
+                break
+    print(f"  parity: {cases - failures}/{cases} random answers identical")
+    return failures == 0
+
+
+def throughput(label, fn, items, rounds, per="answer"):
+    size = sum(len(t) for t in items)
+    fn(items)  # warm-up
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn(items)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<28} {size * rounds / elapsed / 1e6:8.2f} MB/s   "
+          f"{elapsed / rounds * 1e6:8.1f} us/{per}")
+    return elapsed
+
+
+def main():
+    cases = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    print("\n" + "=" * 60)
+    print(" RESPONSE CLEANER")
+    print("=" * 60)
+    golden, ok = check_golden()
+    ok = check_parity(cases, seed) and ok
+
+    inputs = [case["input"] for case in golden]
+    rounds = 20
+    print(f"\n  clean_for_voice over {len(inputs)} golden answers, {rounds} rounds")
+    legacy = throughput("original re.sub chain", lambda xs: [legacy_clean_for_voice(x) for x in xs],
+                        inputs, rounds, per="corpus")
+    compiled = throughput("compiled engine", lambda xs: [ResponseCleaner.clean_for_voice(x) for x in xs],
+                          inputs, rounds, per="corpus")
+    print(f"  speedup {legacy / compiled:.1f}x")
+
+    answer = ANSWER * 8
+    tokens = split_tokens(answer, random.Random(seed), 6)
+    rounds = 200
+    print(f"\n  {len(answer)} chars in {len(tokens)} tokens, {rounds} rounds")
+    throughput("per-token regex chain", lambda ts: [ResponseCleaner.clean_token_for_voice(t) for t in ts],
+               tokens, rounds)
+    throughput("incremental cleaner", stream_clean, tokens, rounds)
+    throughput("clean_for_voice (once)", lambda ts: ResponseCleaner.clean_for_voice("".join(ts)),
+               tokens, rounds)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
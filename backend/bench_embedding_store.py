@@ -0,0 +1,150 @@
+"""
+ADARSHA AI - EMBEDDING STORE CHECK & BENCHMARK
+Runs against a throwaway store with synthetic vectors (each text's vector is derived from
+the text, so any reader can tell whether what it read is right):
+1. Throughput: batched puts and gets, single-text gets.
+2. Concurrency: reader processes look up random known texts while a writer keeps adding
+   rows under a small size limit, forcing eviction and compaction. The writer keeps a hot
+   quarter of the rows recently used, so those survive every compaction and get moved.
+   Every vector a reader gets must be the right one; misses are fine (evicted rows).
+3. Limits: the array files stay under the limit and a fresh handle reads the survivors.
+
+Usage: python bench_embedding_store.py [rows] [readers] [seconds]
+"""
+
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, text_hash
+
+MODEL = "bench-model"
+DIM = 384
+
+
+def vector_for(text):
+    seed = int(text_hash(text)[:8], 16)
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+def texts_for(start, count):
+    return [f"chunk text number {i}" for i in range(start, start + count)]
+
+
+def throughput(root, rows):
+    store = EmbeddingStore(root, MODEL, max_mb=0)
+    texts = texts_for(0, rows)
+    vectors = np.stack([vector_for(text) for text in texts])
+
+    started = time.perf_counter()
+    for start in range(0, rows, 64):
+        store.put_many(texts[start:start + 64], vectors[start:start + 64])
+    put_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for start in range(0, rows, 64):
+        found = store.get_many(texts[start:start + 64])
+    batch_seconds = time.perf_counter() - started
+    assert all(np.array_equal(v, vectors[-len(found) + i]) for i, v in enumerate(found))
+
+    sample = texts[:2000]
+    started = time.perf_counter()
+    for text in sample:
+        store.get(text)
+    single_us = (time.perf_counter() - started) / len(sample) * 1e6
+
+    print(f"  put   {rows / put_seconds:>10,.0f} vectors/s   (batches of 64)")
+    print(f"  get   {rows / batch_seconds:>10,.0f} vectors/s   (batches of 64)")
+    print(f"  get   {single_us:>10.1f} us/text    (one at a time)")
+    print(f"  size  {store.size_bytes() / 1e6:>10.1f} MB for {rows:,} x {DIM} float32")
+    return store
+
+
+def reader(root, known, seconds, results):
+    store = EmbeddingStore(root, MODEL)
+    rng = np.random.default_rng()
+    reads = wrong = misses = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        # Half the lookups hit the hot rows the writer keeps alive
+        span = known // 4 if rng.random() < 0.5 else known
+        texts = texts_for(int(rng.integers(0, span - 32)), 32)
+        for text, vector in zip(texts, store.get_many(texts)):
+            reads += 1
+            if vector is None:
+                misses += 1
+            elif not np.array_equal(vector, vector_for(text)):
+                wrong += 1
+    results.put((reads, misses, wrong))
+
+
+def writer(root, start, seconds, max_mb, results):
+    store = EmbeddingStore(root, MODEL, max_mb=max_mb)
+    hot = texts_for(0, start // 4)
+    hot_vectors = np.stack([vector_for(text) for text in hot])
+    written = start
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        # Storing the hot rows again only marks them recently used
+        store.put_many(hot, hot_vectors)
+        texts = texts_for(written, 256)
+        store.put_many(texts, np.stack([vector_for(text) for text in texts]))
+        written += 256
+    results.put(("writer", written - start, store.compactions, store.evicted))
+
+
+def concurrency(root, rows, readers, seconds):
+    # Room for about half the rows, so eviction and compaction keep happening
+    max_mb = rows * DIM * 4 / 2 / (1024 * 1024)
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=reader, args=(root, rows, seconds, results)) for _ in range(readers)]
+    procs.append(multiprocessing.Process(target=writer, args=(root, rows, seconds, max_mb, results)))
+    for proc in procs:
+        proc.start()
+    outcomes = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    written, compactions, evicted = next(o[1:] for o in outcomes if o[0] == "writer")
+    reads = sum(o[0] for o in outcomes if o[0] != "writer")
+    misses = sum(o[1] for o in outcomes if o[0] != "writer")
+    wrong = sum(o[2] for o in outcomes if o[0] != "writer")
+    print(f"\n  {readers} readers + 1 writer for {seconds:.0f}s, limit {max_mb * 1.048576:.1f} MB")
+    print(f"  writer  {written:,} rows added, {compactions} compactions, {evicted:,} evicted")
+    print(f"  readers {reads:,} lookups ({reads / seconds:,.0f}/s), {misses:,} evicted misses, {wrong} wrong vectors")
+
+    store = EmbeddingStore(root, MODEL, max_mb=max_mb)
+    size = store.size_bytes()
+    survivors = store.stats()["rows"]
+    texts = texts_for(0, rows + written)
+    found = [v for v in store.get_many(texts) if v is not None]
+    print(f"  after   {size / 1e6:.1f} MB on disk (limit {store.max_bytes / 1e6:.1f} MB), "
+          f"{survivors:,} rows, {len(found):,} readable")
+    return wrong == 0 and size <= store.max_bytes and len(found) == survivors
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    print("\n" + "=" * 60)
+    print(f" EMBEDDING STORE ({rows:,} rows of {DIM} dims)")
+    print("=" * 60)
+    root = Path(tempfile.mkdtemp(prefix="bench_store_"))
+    try:
+        throughput(root, rows)
+        ok = concurrency(root, rows, readers, seconds)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print(f"\n  {'OK' if ok else 'FAILED'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+ADARSHA AI - INGESTION THROUGHPUT BENCHMARK
+Builds a synthetic corpus from N copies of alldata.txt (every copy's lines tagged so
+its chunks hash differently) and indexes it into a throwaway Chroma collection:
+  serial    - the old loop: chunk everything, then encode 50 and add 50 at a time
+  pipeline  - IngestionPipeline with the given batch size and encoder processes
+
+Usage: python bench_ingest.py [copies] [config ...]
+  config = serial | b<batch>w<workers>[x<write batch>], e.g. b64w0 b128w4x1000
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+from pathlib import Path
+
+import create_vector_db as cvdb
+
+DEFAULT_CONFIGS = ["serial", "b64w0", "b128w0", "b64w2", "b64w4"]
+
+
+def synthetic_corpus(copies):
+    source = cvdb.DATA_PATH.read_text(encoding="utf-8").replace("\r\n", "\n")
+    lines = source.split("\n")
+    parts = []
+    for copy in range(copies):
+        # Tag long lines only, so the section markers the chunker looks for stay intact
+        parts.append("\n".join(f"{line} (copy {copy})" if len(line) > 40 else line for line in lines))
+    return "\n".join(parts)
+
+
+def fresh_collection(root, name):
+    client = cvdb.chromadb.PersistentClient(path=str(root / name),
+                                            settings=cvdb.ChromaSettings(anonymized_telemetry=False))
+    return client.get_or_create_collection(name="bench", metadata={"hnsw:space": "cosine"})
+
+
+def run_serial(creator, collection, content):
+    model = creator.load_embedding_model()
+    started = time.perf_counter()
+    records = list(creator.build_records(creator.chunker.chunk_with_semantic_preservation(content)))
+    for batch_start in range(0, len(records), 50):
+        batch = records[batch_start:batch_start + 50]
+        embeddings = model.encode([r["text"] for r in batch], show_progress_bar=False).tolist()
+        collection.add(ids=[r["id"] for r in batch], documents=[r["text"] for r in batch],
+                       metadatas=[r["metadata"] for r in batch], embeddings=embeddings)
+    return len(records), time.perf_counter() - started, None
+
+
+def run_pipeline(creator, collection, content, batch, workers, write_batch):
+    pipeline = cvdb.IngestionPipeline(collection, creator.load_embedding_model, batch_size=batch,
+                                      workers=workers, write_batch=write_batch)
+
+    def operations():
+        # Chunk inside the generator so the chunking time lands in the pipeline's chunk stage
+        for record in creator.build_records(creator.chunker.chunk_with_semantic_preservation(content)):
+            yield "embed", record
+
+    stats = pipeline.run(operations())
+    return stats["embedded"], stats["seconds"], stats
+
+
+def main():
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    configs = sys.argv[2:] or DEFAULT_CONFIGS
+
+    content = synthetic_corpus(copies)
+    creator = cvdb.EnhancedVectorDBCreator()
+    if "serial" in configs or any(re.fullmatch(r"b\d+w0(x\d+)?", c) for c in configs):
+        creator.load_embedding_model()
+
+    print("\n" + "=" * 72)
+    print(f" INGESTION: {copies} x {cvdb.DATA_PATH.name} = {len(content) / 1e6:.1f} MB")
+    # Encoding dominates, so the figures only compare across runs on the same model and CPUs
+    print(f" model {cvdb.EMBEDDING_MODEL_NAME}, {os.cpu_count()} CPUs")
+    print("=" * 72)
+    print(f"  {'config':<14} {'chunks':>8} {'seconds':>9} {'chunks/s':>10}   stage busy / stalled (s)")
+
+    root = Path(tempfile.mkdtemp(prefix="bench_ingest_"))
+    baseline = None
+    try:
+        for config in configs:
+            collection = fresh_collection(root, config)
+            if config == "serial":
+                chunks, seconds, stats = run_serial(creator, collection, content)
+            else:
+                match = re.fullmatch(r"b(\d+)w(\d+)(?:x(\d+))?", config)
+                if not match:
+                    print(f"  {config:<14} unrecognised config")
+                    continue
+                batch, workers = int(match.group(1)), int(match.group(2))
+                write_batch = int(match.group(3) or cvdb.WRITE_BATCH_SIZE)
+                chunks, seconds, stats = run_pipeline(creator, collection, content, batch, workers, write_batch)
+
+            rate = chunks / seconds if seconds else 0.0
+            baseline = baseline or rate
+            detail = ""
+            if stats:
+                busy, stalled = stats["busy"], stats["stalled"]
+                detail = (f"chunk {busy['chunk']:.1f}/{stalled['chunk']:.1f}  "
+                          f"embed {busy['embed']:.1f}/{stalled['embed']:.1f}  write {busy['write']:.1f}")
+            print(f"  {config:<14} {chunks:>8,} {seconds:>9.1f} {rate:>10.1f}   "
+                  f"{rate / baseline:4.2f}x  {detail}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+ADARSHA AI - SEARCH LATENCY BENCHMARK
+Compares the in-memory NumPy exact search against the ChromaDB query path.
+
+Usage: python bench_search.py [iterations]
+"""
+
+import sys
+import time
+
+import pipeline
+from pipeline import VectorStore, NumpySearchIndex, embed_query
+
+QUERIES = [
+    "who is the principal",
+    "who made you",
+    "who is ganesh sapkota",
+    "when was the school established",
+    "tell me about the eco industrial project",
+    "how many students are in grade 11",
+    "what is the daily schedule",
+    "who teaches c programming",
+    "head of computer department",
+    "renewable energy generation zone",
+]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(label, search_fn, embeddings, iterations):
+    for embedding in embeddings:
+        search_fn(embedding)  # warm-up
+
+    samples = []
+    for _ in range(iterations):
+        for embedding in embeddings:
+            start = time.perf_counter()
+            search_fn(embedding)
+            samples.append((time.perf_counter() - start) * 1000)
+
+    print(f"  {label:<8} p50={percentile(samples, 50):8.3f} ms   "
+          f"p99={percentile(samples, 99):8.3f} ms   n={len(samples)}")
+    return samples
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    store = VectorStore()
+    store.backend = "chroma"
+    if not store.initialize():
+        print("[Bench] Could not open the vector database")
+        return
+
+    index = NumpySearchIndex()
+    if not index.load(store.collection):
+        print("[Bench] Collection is empty - nothing to benchmark")
+        return
+
+    embeddings = [embed_query(q) for q in QUERIES]
+
+    print("\n" + "=" * 60)
+    print(f" SEARCH LATENCY ({index.size} vectors, {iterations} rounds)")
+    print("=" * 60)
+    chroma = run("chroma", lambda e: store._search_chroma(e, 3), embeddings, iterations)
+    numpy_ = run("numpy", lambda e: index.search(e, 3), embeddings, iterations)
+    print(f"  speedup  p50={percentile(chroma, 50) / percentile(numpy_, 50):.1f}x   "
+          f"p99={percentile(chroma, 99) / percentile(numpy_, 99):.1f}x")
+
+    mismatches = sum(
+        1 for e in embeddings
+        if store._search_chroma(e, 3) != index.search(e, 3)
+    )
+    print(f"  result mismatches vs chroma: {mismatches}/{len(embeddings)}")
+    print(f"  default backend: {pipeline.SEARCH_BACKEND}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,11 +8,16 @@ ADARSHA CHATBOT - ENHANCED VECTOR DATABASE CREATOR V2.0
 import os
 import sys
 import re
+import time
+import queue
 import hashlib
 import json
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 import warnings
 
 warnings.filterwarnings("ignore")
@@ -27,6 +32,28 @@ PROJECT_ROOT = Path(r"C:\Users\USER\Desktop\Adaplex\Professional-Adarsha-and-Mad
 VECTORDB_PATH = Path(os.getenv("VECTORDB_PATH", str(PROJECT_ROOT / "data" / "chroma_db_enhanced")))
 DATA_PATH = Path(os.getenv("DATA_PATH", str(PROJECT_ROOT / "data" / "data_for_vectordb" / "alldata.txt")))
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "adarsha_knowledge_enhanced")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+MANIFEST_PATH = VECTORDB_PATH / f"{COLLECTION_NAME}_manifest.json"
+
+# Bump when chunking output changes for the same input and parameters
+CHUNKER_VERSION = "2.0"
+
+# Ingestion pipeline: chunks per encode call, encoder processes (0 = encode in a thread of
+# this process), chunks per collection write, and how many batches each queue may hold
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "0"))
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+# Texts per forward pass within one encode call. sentence-transformers sorts each call by
+# length before splitting it, so larger EMBED_BATCH_SIZE batches pad less instead of more
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "32"))
+
+# Vectors already computed for a text (by any earlier build, or the server) are read from
+# the shared embedding store instead of being encoded again
+EMBEDDING_STORE_ENABLED = os.getenv("EMBEDDING_STORE_ENABLED", "1") == "1"
+# The default is <repo>/data/embedding_store, the same directory pipeline.py uses
+EMBEDDING_STORE_PATH = Path(os.getenv("EMBEDDING_STORE_PATH",
+                                      str(Path(__file__).resolve().parent.parent / "data" / "embedding_store")))
 
 VECTORDB_PATH.mkdir(parents=True, exist_ok=True)
 
@@ -42,6 +69,7 @@ try:
     import chromadb
     from chromadb.config import Settings as ChromaSettings
     from sentence_transformers import SentenceTransformer
+    from embedding_store import EmbeddingStore
     print("[System] All dependencies loaded!")
 except ImportError as e:
     print(f"\nMissing dependency: {e}")
@@ -52,6 +80,27 @@ except ImportError as e:
 def calculate_hash(text: str) -> str:
     return hashlib.md5(text.encode('utf-8')).hexdigest()
 
+def read_source_lines(file_path: Path, totals: Dict[str, int]) -> Iterator[str]:
+    """
+    The file's lines without their newline, read one at a time. Yields exactly what
+    reading the whole file and splitting it on newlines would, and counts lines, words
+    and characters into totals as it goes (complete once the iterator is exhausted).
+    """
+    totals.update(total_lines=1, total_words=0, total_chars=0)
+    ends_with_newline = True
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for raw in f:
+            totals["total_chars"] += len(raw)
+            totals["total_words"] += len(raw.split())
+            ends_with_newline = raw.endswith('\n')
+            if ends_with_newline:
+                totals["total_lines"] += 1
+                raw = raw[:-1]
+            yield raw
+    # Splitting leaves an empty last line after a trailing newline (or an empty file)
+    if ends_with_newline:
+        yield ""
+
 def print_status(message: str):
     timestamp = datetime.now().strftime('%H:%M:%S')
     print(f"[{timestamp}] {message}")
@@ -62,10 +111,78 @@ def print_section(title: str):
     print("-" * 70)
 
 
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over lowercased terms: one pass over a lowercased text reports
+    every occurrence of every term, overlapping ones included
+    """
+    def __init__(self, terms: Iterable[str]):
+        self.terms = list(dict.fromkeys(term.lower() for term in terms))
+        self.lengths = [len(term) for term in self.terms]
+
+        goto, fail, output = [{}], [0], [[]]
+        for term_id, term in enumerate(self.terms):
+            state = 0
+            for ch in term:
+                if ch not in goto[state]:
+                    goto.append({})
+                    fail.append(0)
+                    output.append([])
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            output[state].append(term_id)
+
+        # Breadth-first, so every state's failure target is finished before the state itself.
+        # Folding the failure links into the transitions leaves one dict lookup per character.
+        alphabet = {ch for term in self.terms for ch in term}
+        delta = [dict(goto[0])]
+        delta.extend({} for _ in range(len(goto) - 1))
+        order = deque(goto[0].values())
+        while order:
+            state = order.popleft()
+            output[state] = output[state] + output[fail[state]]
+            for ch in alphabet:
+                child = goto[state].get(ch)
+                if child is None:
+                    target = delta[fail[state]].get(ch, 0)
+                    if target:
+                        delta[state][ch] = target
+                else:
+                    fail[child] = delta[fail[state]].get(ch, 0)
+                    delta[state][ch] = child
+                    order.append(child)
+        self.delta = delta
+        self.output = [tuple(terms) for terms in output]
+
+    def scan(self, text_lower: str) -> List[Tuple[int, int]]:
+        """(start, term id) for every occurrence, ordered by where each one ends"""
+        delta, output, lengths = self.delta, self.output, self.lengths
+        hits = []
+        state = 0
+        for end, ch in enumerate(text_lower, 1):
+            state = delta[state].get(ch, 0)
+            if output[state]:
+                for term_id in output[state]:
+                    hits.append((end - lengths[term_id], term_id))
+        return hits
+
+
 class EnhancedTextChunker:
     """
     Enhanced chunking with semantic boundary preservation
     """
+    # Characters that re.IGNORECASE and str.lower() fold differently for ASCII letters
+    # (dotted/dotless i, long s); a chunk containing one takes the regex path instead
+    FOLD_MISMATCH_RE = re.compile('[\u0130\u0131\u017f]')
+    ENTITY_VALUE_RE = re.compile(r':?\s*([^\n]+)')
+    HIERARCHY_PREFIX_RES = [
+        re.compile(r'^={3,}\s*'),
+        re.compile(r'^-{3,}\s*'),
+        re.compile(r'^#+\s*'),
+        re.compile(r'^\*\*|\*\*$'),
+        re.compile(r'^SECTION\s+\d+:\s*', re.IGNORECASE),
+    ]
+
     def __init__(self, chunk_size: int = 1500, overlap: int = 300):
         self.chunk_size = chunk_size
         self.overlap = overlap
@@ -85,54 +202,125 @@ class EnhancedTextChunker:
             r'^\*\*[^*]+\*\*\s*$',
         ]
 
+        self.entity_terms = {
+            'person': ['Name:', 'Lead', 'Developer', 'Teacher', 'Principal', 'Student'],
+            'location': ['Location', 'Address', 'District', 'Municipality'],
+            'date': ['Established', 'Founded', 'Date'],
+            'contact': ['Phone', 'Email', 'Website'],
+        }
         self.entity_patterns = {
-            'person': r'(Name:|Lead|Developer|Teacher|Principal|Student):?\s*([^\n]+)',
-            'location': r'(Location|Address|District|Municipality):?\s*([^\n]+)',
-            'date': r'(Established|Founded|Date):?\s*([^\n]+)',
-            'contact': r'(Phone|Email|Website):?\s*([^\n]+)',
+            entity_type: rf"({'|'.join(re.escape(term) for term in terms)}):?\s*([^\n]+)"
+            for entity_type, terms in self.entity_terms.items()
         }
 
+        self.important_terms = [
+            'Adarsha', 'School', 'Thimi', 'Bhaktapur', 'Technical', 'CTEVT', 'NEB',
+            'Sangam Gautam', 'AI', 'Chatbot', 'Developer', 'Project', 'Science',
+            'Renewable Energy', 'Exhibition', 'Student', 'Teacher', 'Principal',
+            'Admission', 'Examination', 'SEE', 'TSLC', 'Computer Engineering'
+        ]
+
+        self.compile()
+
+    def compile(self):
+        """Build the matchers from the pattern and term lists; call again after editing them"""
+        # One alternation per boundary kind: a single C-level match per line instead of a
+        # Python loop over re.match calls
+        self.major_boundary_re = re.compile('|'.join(f'(?:{p})' for p in self.major_section_patterns))
+        self.sub_boundary_re = re.compile('|'.join(f'(?:{p})' for p in self.sub_section_patterns))
+        self.entity_res = {entity_type: re.compile(pattern, re.IGNORECASE)
+                           for entity_type, pattern in self.entity_patterns.items()}
+
+        # Entity terms and keywords share one automaton. Each term id maps to the entity
+        # types it opens (with its position in that type's alternation) and, if it is an
+        # important term, to the keyword it reports.
+        entity_roles, keyword_roles = [], []
+        for entity_type, terms in self.entity_terms.items():
+            for rank, term in enumerate(terms):
+                entity_roles.append((term.lower(), entity_type, rank))
+        for term in self.important_terms:
+            keyword_roles.append((term.lower(), term))
+        self.automaton = KeywordAutomaton([role[0] for role in entity_roles + keyword_roles])
+        ids = {term: term_id for term_id, term in enumerate(self.automaton.terms)}
+        self.term_entities = [[] for _ in self.automaton.terms]
+        for term, entity_type, rank in entity_roles:
+            self.term_entities[ids[term]].append((entity_type, rank))
+        self.term_keywords = [[] for _ in self.automaton.terms]
+        for term, keyword in keyword_roles:
+            if keyword not in self.term_keywords[ids[term]]:
+                self.term_keywords[ids[term]].append(keyword)
+        self.keyword_rank = {term: rank for rank, term in enumerate(self.important_terms)}
+        # The automaton works on str.lower() offsets, which only line up with
+        # re.IGNORECASE for ASCII terms
+        self.single_pass = all(term.isascii() for term in self.automaton.terms)
+
     def is_major_boundary(self, line: str) -> bool:
-        line = line.strip()
-        return any(re.match(pattern, line) for pattern in self.major_section_patterns)
+        return self.major_boundary_re.match(line.strip()) is not None
 
     def is_sub_boundary(self, line: str) -> bool:
-        line = line.strip()
-        return any(re.match(pattern, line) for pattern in self.sub_section_patterns)
+        return self.sub_boundary_re.match(line.strip()) is not None
 
     def extract_entities(self, text: str) -> Dict[str, List[str]]:
-        entities = {}
-        for entity_type, pattern in self.entity_patterns.items():
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            if matches:
-                entities[entity_type] = [match[1].strip() for match in matches if match[1].strip()]
-        return entities
+        return self.extract_entities_and_keywords(text)[0]
 
     def extract_keywords(self, text: str) -> List[str]:
-        keywords = set()
-
-        important_terms = [
-            'Adarsha', 'School', 'Thimi', 'Bhaktapur', 'Technical', 'CTEVT', 'NEB',
-            'Sangam Gautam', 'AI', 'Chatbot', 'Developer', 'Project', 'Science',
-            'Renewable Energy', 'Exhibition', 'Student', 'Teacher', 'Principal',
-            'Admission', 'Examination', 'SEE', 'TSLC', 'Computer Engineering'
-        ]
+        return self.extract_entities_and_keywords(text)[1]
 
+    def _extract_with_regex(self, text: str) -> Tuple[Dict[str, List[str]], List[str]]:
+        entities = {}
+        for entity_type, pattern in self.entity_res.items():
+            matches = pattern.findall(text)
+            if matches:
+                entities[entity_type] = [match[1].strip() for match in matches if match[1].strip()]
+        text_lower = text.lower()
+        keywords = [term for term in dict.fromkeys(self.important_terms) if term.lower() in text_lower]
+        return entities, keywords
+
+    def extract_entities_and_keywords(self, text: str) -> Tuple[Dict[str, List[str]], List[str]]:
+        """
+        Entities and important terms from one automaton pass. Gives what re.findall with
+        each entity pattern and a substring test per term would; keywords come back in
+        important_terms order.
+        """
         text_lower = text.lower()
-        for term in important_terms:
-            if term.lower() in text_lower:
-                keywords.add(term)
+        if (not self.single_pass or len(text_lower) != len(text)
+                or self.FOLD_MISMATCH_RE.search(text)):
+            return self._extract_with_regex(text)
+
+        hits = self.automaton.scan(text_lower)
+        found = set()
+        candidates = []
+        for start, term_id in hits:
+            found.update(self.term_keywords[term_id])
+            for entity_type, rank in self.term_entities[term_id]:
+                candidates.append((start, rank, entity_type, start + self.automaton.lengths[term_id]))
+
+        # Replay findall: leftmost match first, earlier alternatives first at the same
+        # position, and no match may start inside the previous one of its type
+        captures = {}
+        resume = {}
+        value_re = self.ENTITY_VALUE_RE
+        for start, rank, entity_type, term_end in sorted(candidates):
+            if start < resume.get(entity_type, 0):
+                continue
+            match = value_re.match(text, term_end)
+            if match is None:
+                continue
+            captures.setdefault(entity_type, []).append(match.group(1))
+            resume[entity_type] = match.end()
 
-        return list(keywords)
+        entities = {}
+        for entity_type in self.entity_terms:
+            if entity_type in captures:
+                entities[entity_type] = [value.strip() for value in captures[entity_type] if value.strip()]
+        keywords = sorted(found, key=self.keyword_rank.__getitem__)
+        return entities, keywords
 
     def extract_section_hierarchy(self, line: str) -> str:
         line = line.strip()
 
-        line = re.sub(r'^={3,}\s*', '', line)
-        line = re.sub(r'^-{3,}\s*', '', line)
-        line = re.sub(r'^#+\s*', '', line)
-        line = re.sub(r'^\*\*|\*\*$', '', line)
-        line = re.sub(r'^SECTION\s+\d+:\s*', '', line, flags=re.IGNORECASE)
+        for prefix_re in self.HIERARCHY_PREFIX_RES:
+            line = prefix_re.sub('', line)
 
         return line[:150] if line else "General"
 
@@ -141,38 +329,56 @@ class EnhancedTextChunker:
             return []
 
         text = re.sub(r'\r\n', '\n', text)
-        lines = text.split('\n')
-        total_lines = len(lines)
+        return list(self.iter_chunks(text.split('\n')))
+
+    def _chunk_record(self, chunk_text: str, major_section: str, sub_section: str,
+                      section_context: List[str], index: int, line_start: int, line_end: int) -> Dict[str, Any]:
+        entities, keywords = self.extract_entities_and_keywords(chunk_text)
+        return {
+            'text': chunk_text,
+            'major_section': major_section,
+            'sub_section': sub_section,
+            'section_path': ' > '.join(section_context) if section_context else major_section,
+            'entities': entities,
+            'keywords': keywords,
+            'index': index,
+            'line_start': line_start,
+            'line_end': line_end,
+            'char_count': len(chunk_text),
+            'word_count': len(chunk_text.split())
+        }
 
-        chunks = []
+    def iter_chunks(self, lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """
+        Same chunks as chunk_with_semantic_preservation, yielded as each one closes.
+        Only the open chunk's lines are held, so a file can be fed line by line
+        (read_source_lines) in constant memory whatever its size.
+        """
+        index = 0
         current_chunk_lines = []
         current_major_section = "Document Root"
         current_sub_section = "General"
         current_length = 0
         chunk_start_line = 0
         section_context = []
+        # Trailing lines of the open chunk that fit in the overlap, kept up to date as
+        # lines arrive so closing a chunk never rescans it
+        window = deque()
+        window_length = 0
+        overlap = self.overlap
+        major_match = self.major_boundary_re.match
+        sub_match = self.sub_boundary_re.match
+        i = -1
 
         for i, line in enumerate(lines):
-            if self.is_major_boundary(line):
+            stripped = line.strip()
+            if major_match(stripped):
                 if current_chunk_lines:
                     chunk_text = '\n'.join(current_chunk_lines).strip()
                     if len(chunk_text) > 100:
-                        entities = self.extract_entities(chunk_text)
-                        keywords = self.extract_keywords(chunk_text)
-
-                        chunks.append({
-                            'text': chunk_text,
-                            'major_section': current_major_section,
-                            'sub_section': current_sub_section,
-                            'section_path': ' > '.join(section_context) if section_context else current_major_section,
-                            'entities': entities,
-                            'keywords': keywords,
-                            'index': len(chunks),
-                            'line_start': chunk_start_line,
-                            'line_end': i - 1,
-                            'char_count': len(chunk_text),
-                            'word_count': len(chunk_text.split())
-                        })
+                        yield self._chunk_record(chunk_text, current_major_section, current_sub_section,
+                                                 section_context, index, chunk_start_line, i - 1)
+                        index += 1
 
                 new_major = self.extract_section_hierarchy(line)
                 if new_major:
@@ -183,9 +389,14 @@ class EnhancedTextChunker:
                 current_chunk_lines = [line]
                 current_length = len(line)
                 chunk_start_line = i
+                window.clear()
+                window_length = 0
+                if len(line) + 1 <= overlap:
+                    window.append(line)
+                    window_length = len(line) + 1
                 continue
 
-            if self.is_sub_boundary(line):
+            if sub_match(stripped):
                 new_sub = self.extract_section_hierarchy(line)
                 if new_sub:
                     current_sub_section = new_sub
@@ -196,61 +407,279 @@ class EnhancedTextChunker:
 
             current_chunk_lines.append(line)
             current_length += len(line) + 1
+            window.append(line)
+            window_length += len(line) + 1
+            while window_length > overlap:
+                window_length -= len(window.popleft()) + 1
 
             if current_length >= self.chunk_size:
                 chunk_text = '\n'.join(current_chunk_lines).strip()
                 if len(chunk_text) > 100:
-                    entities = self.extract_entities(chunk_text)
-                    keywords = self.extract_keywords(chunk_text)
-
-                    chunks.append({
-                        'text': chunk_text,
-                        'major_section': current_major_section,
-                        'sub_section': current_sub_section,
-                        'section_path': ' > '.join(section_context) if section_context else current_major_section,
-                        'entities': entities,
-                        'keywords': keywords,
-                        'index': len(chunks),
-                        'line_start': chunk_start_line,
-                        'line_end': i,
-                        'char_count': len(chunk_text),
-                        'word_count': len(chunk_text.split())
-                    })
-
-                overlap_lines = []
-                overlap_length = 0
-                for ol in reversed(current_chunk_lines):
-                    if overlap_length + len(ol) + 1 <= self.overlap:
-                        overlap_lines.insert(0, ol)
-                        overlap_length += len(ol) + 1
-                    else:
-                        break
+                    yield self._chunk_record(chunk_text, current_major_section, current_sub_section,
+                                             section_context, index, chunk_start_line, i)
+                    index += 1
 
-                current_chunk_lines = overlap_lines
-                current_length = overlap_length
-                chunk_start_line = max(0, i - len(overlap_lines) + 1)
+                current_chunk_lines = list(window)
+                current_length = window_length
+                chunk_start_line = max(0, i - len(window) + 1)
 
         if current_chunk_lines:
             chunk_text = '\n'.join(current_chunk_lines).strip()
             if len(chunk_text) > 100:
-                entities = self.extract_entities(chunk_text)
-                keywords = self.extract_keywords(chunk_text)
-
-                chunks.append({
-                    'text': chunk_text,
-                    'major_section': current_major_section,
-                    'sub_section': current_sub_section,
-                    'section_path': ' > '.join(section_context) if section_context else current_major_section,
-                    'entities': entities,
-                    'keywords': keywords,
-                    'index': len(chunks),
-                    'line_start': chunk_start_line,
-                    'line_end': total_lines - 1,
-                    'char_count': len(chunk_text),
-                    'word_count': len(chunk_text.split())
-                })
-
-        return chunks
+                # i is the last line's index, i.e. total_lines - 1
+                yield self._chunk_record(chunk_text, current_major_section, current_sub_section,
+                                         section_context, index, chunk_start_line, i)
+
+
+# Worker-process side of IngestionPipeline: each process loads its own model once
+_worker_model = None
+
+def _init_embed_worker(model_name: str, threads: int):
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except Exception:
+        pass
+    _worker_model = SentenceTransformer(model_name)
+
+def _embed_in_worker(texts: List[str]) -> List[List[float]]:
+    return _worker_model.encode(texts, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=False).tolist()
+
+
+class PipelineAborted(Exception):
+    """Another stage failed; this one stops instead of blocking on its queue"""
+
+
+class IngestionPipeline:
+    """
+    Chunk -> embed -> write stages joined by bounded queues, so chunking, encoding and
+    sqlite writes overlap and a slow stage holds back the one feeding it
+    """
+    DONE = object()
+
+    def __init__(self, collection, model_loader, batch_size: int = EMBED_BATCH_SIZE,
+                 workers: int = EMBED_WORKERS, write_batch: int = WRITE_BATCH_SIZE,
+                 queue_size: int = PIPELINE_QUEUE_SIZE, store: Optional[EmbeddingStore] = None):
+        self.collection = collection
+        self.model_loader = model_loader
+        self.store = store
+        self.batch_size = max(1, batch_size)
+        self.workers = max(0, workers)
+        self.write_batch = max(1, write_batch)
+        self.embed_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.failed = threading.Event()
+        self.errors = []
+        self.busy = {"chunk": 0.0, "embed": 0.0, "write": 0.0}
+        # Time a stage spent blocked because the next one was behind
+        self.stalled = {"chunk": 0.0, "embed": 0.0}
+        self.counts = {"embedded": 0, "encoded": 0, "reused": 0, "written": 0, "updated": 0,
+                       "deleted": 0, "adds": 0}
+
+    def _put(self, target: queue.Queue, item, stage: str):
+        started = time.perf_counter()
+        while True:
+            if self.failed.is_set():
+                raise PipelineAborted()
+            try:
+                target.put(item, timeout=0.2)
+                break
+            except queue.Full:
+                continue
+        self.stalled[stage] += time.perf_counter() - started
+
+    def _get(self, source: queue.Queue):
+        while True:
+            if self.failed.is_set():
+                raise PipelineAborted()
+            try:
+                return source.get(timeout=0.2)
+            except queue.Empty:
+                continue
+
+    def _stage(self, name: str, target, *args):
+        try:
+            target(*args)
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            self.errors.append((name, e))
+            self.failed.set()
+
+    def _chunk_stage(self, operations: Iterator[Tuple[str, Any]]):
+        batch = []
+        started = time.perf_counter()
+        for kind, payload in operations:
+            if kind == "embed":
+                batch.append(payload)
+                if len(batch) < self.batch_size:
+                    continue
+                item, batch = ("embed", batch), []
+            else:
+                item = (kind, payload)
+            self.busy["chunk"] += time.perf_counter() - started
+            self._put(self.embed_queue, item, "chunk")
+            started = time.perf_counter()
+        self.busy["chunk"] += time.perf_counter() - started
+        if batch:
+            self._put(self.embed_queue, ("embed", batch), "chunk")
+        self._put(self.embed_queue, self.DONE, "chunk")
+
+    def _stored(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Vectors the embedding store already has for these texts (None where it has none)"""
+        if self.store is not None:
+            try:
+                return [None if vector is None else vector.tolist()
+                        for vector in self.store.get_many(texts, touch=True)]
+            except Exception as e:
+                print_status(f"WARNING: Embedding store unavailable, encoding everything ({e})")
+                self.store = None
+        return [None] * len(texts)
+
+    def _embed_stage(self):
+        pool = None
+        if self.workers:
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_embed_worker,
+                                       initargs=(EMBEDDING_MODEL_NAME, threads))
+        # Loaded on the first store miss, so a rebuild of unchanged text never loads it
+        model = None
+        # Batches handed to worker processes, oldest first
+        in_flight = deque()
+
+        def finish(records, embeddings, missing, encoded):
+            for position, vector in zip(missing, encoded):
+                embeddings[position] = vector
+            if missing and self.store is not None:
+                try:
+                    self.store.put_many([records[position]["text"] for position in missing], encoded)
+                except Exception as e:
+                    print_status(f"WARNING: Could not save to the embedding store ({e})")
+                    self.store = None
+            self.counts["embedded"] += len(records)
+            self._put(self.write_queue, ("write", records, embeddings), "embed")
+
+        def forward(records, embeddings, missing, future):
+            started = time.perf_counter()
+            encoded = future.result()
+            self.busy["embed"] += time.perf_counter() - started
+            finish(records, embeddings, missing, encoded)
+
+        try:
+            while True:
+                item = self._get(self.embed_queue)
+                if item is self.DONE:
+                    break
+                if item[0] != "embed":
+                    self._put(self.write_queue, item, "embed")
+                    continue
+                records = item[1]
+                embeddings = self._stored([record["text"] for record in records])
+                missing = [position for position, vector in enumerate(embeddings) if vector is None]
+                self.counts["reused"] += len(records) - len(missing)
+                self.counts["encoded"] += len(missing)
+                texts = [records[position]["text"] for position in missing]
+                if not missing:
+                    finish(records, embeddings, [], [])
+                    continue
+                if pool is None:
+                    if model is None:
+                        model = self.model_loader()
+                    started = time.perf_counter()
+                    encoded = model.encode(texts, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=False).tolist()
+                    self.busy["embed"] += time.perf_counter() - started
+                    finish(records, embeddings, missing, encoded)
+                    continue
+                in_flight.append((records, embeddings, missing, pool.submit(_embed_in_worker, texts)))
+                while len(in_flight) > self.workers * 2 or (in_flight and in_flight[0][3].done()):
+                    forward(*in_flight.popleft())
+            while in_flight:
+                forward(*in_flight.popleft())
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._put(self.write_queue, self.DONE, "embed")
+
+    def _write_stage(self):
+        pending = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        updates = []
+
+        def flush_adds():
+            if not pending["ids"]:
+                return
+            started = time.perf_counter()
+            self.collection.upsert(**pending)
+            self.busy["write"] += time.perf_counter() - started
+            self.counts["written"] += len(pending["ids"])
+            self.counts["adds"] += 1
+            for values in pending.values():
+                values.clear()
+
+        def flush_updates():
+            if not updates:
+                return
+            started = time.perf_counter()
+            self.collection.update(ids=[r["id"] for r in updates], metadatas=[r["metadata"] for r in updates])
+            self.busy["write"] += time.perf_counter() - started
+            self.counts["updated"] += len(updates)
+            updates.clear()
+
+        while True:
+            item = self._get(self.write_queue)
+            if item is self.DONE:
+                break
+            kind = item[0]
+            if kind == "write":
+                _, records, embeddings = item
+                pending["ids"].extend(r["id"] for r in records)
+                pending["documents"].extend(r["text"] for r in records)
+                pending["metadatas"].extend(r["metadata"] for r in records)
+                pending["embeddings"].extend(embeddings)
+                if len(pending["ids"]) >= self.write_batch:
+                    flush_adds()
+                    print_status(f"Stored {self.counts['written']:,} chunks")
+            elif kind == "update":
+                updates.append(item[1])
+                if len(updates) >= self.write_batch:
+                    flush_updates()
+            elif kind == "delete":
+                started = time.perf_counter()
+                for batch_start in range(0, len(item[1]), self.write_batch):
+                    self.collection.delete(ids=item[1][batch_start:batch_start + self.write_batch])
+                self.busy["write"] += time.perf_counter() - started
+                self.counts["deleted"] += len(item[1])
+        flush_adds()
+        flush_updates()
+
+    def run(self, operations: Iterator[Tuple[str, Any]]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=self._stage, args=("chunk", self._chunk_stage, operations), daemon=True),
+            threading.Thread(target=self._stage, args=("embed", self._embed_stage), daemon=True),
+            threading.Thread(target=self._stage, args=("write", self._write_stage), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+
+        if self.errors:
+            stage, error = self.errors[0]
+            raise RuntimeError(f"Ingestion {stage} stage failed: {error}") from error
+
+        return {
+            "seconds": seconds,
+            "embedded": self.counts["embedded"],
+            "chunks_per_second": self.counts["embedded"] / seconds if seconds else 0.0,
+            "batch_size": self.batch_size,
+            "workers": self.workers,
+            "write_batch": self.write_batch,
+            "busy": {stage: round(value, 3) for stage, value in self.busy.items()},
+            "stalled": {stage: round(value, 3) for stage, value in self.stalled.items()},
+            "counts": dict(self.counts),
+        }
 
 
 class EnhancedVectorDBCreator:
@@ -260,6 +689,7 @@ class EnhancedVectorDBCreator:
         self.client = None
         self.collection = None
         self.embedding_model = None
+        self.embedding_store = None
         self.chunker = EnhancedTextChunker()
 
     def initialize(self):
@@ -273,13 +703,82 @@ class EnhancedVectorDBCreator:
         )
         print_status(f"Database path: {self.db_path}")
 
+        if EMBEDDING_STORE_ENABLED:
+            try:
+                self.embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH, EMBEDDING_MODEL_NAME)
+                stats = self.embedding_store.stats()
+                print_status(f"Embedding store: {EMBEDDING_STORE_PATH} ({stats['rows']:,} vectors)")
+            except Exception as e:
+                print_status(f"WARNING: Embedding store unavailable, every chunk will be encoded ({e})")
+
     def load_embedding_model(self):
         if self.embedding_model is None:
-            print_status("Loading embedding model (all-MiniLM-L6-v2)...")
-            self.embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+            print_status(f"Loading embedding model ({EMBEDDING_MODEL_NAME})...")
+            self.embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
             print_status("Embedding model loaded!")
         return self.embedding_model
 
+    def index_params(self) -> Dict[str, Any]:
+        """Everything that changes the stored vectors; a difference forces a full rebuild"""
+        return {
+            "collection": self.collection_name,
+            "model": EMBEDDING_MODEL_NAME,
+            "chunk_size": self.chunker.chunk_size,
+            "overlap": self.chunker.overlap,
+            "chunker_version": CHUNKER_VERSION,
+            "ids": "content-hash",
+        }
+
+    def load_manifest(self) -> Dict[str, Any]:
+        if not MANIFEST_PATH.exists():
+            return {}
+        try:
+            return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+        except Exception as e:
+            print_status(f"Could not read manifest {MANIFEST_PATH.name}: {e}")
+            return {}
+
+    def save_manifest(self, result: Dict[str, Any]):
+        manifest = {
+            "params": self.index_params(),
+            "source": str(DATA_PATH),
+            "updated": datetime.now().isoformat(),
+            "chunks": result["total_chunks"],
+            "embed_seconds_per_chunk": result["embed_seconds_per_chunk"],
+        }
+        tmp_path = MANIFEST_PATH.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.replace(tmp_path, MANIFEST_PATH)
+
+    def build_records(self, chunks: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """One record per chunk, its ID the hash of its text so unchanged chunks keep their ID"""
+        seen = {}
+        for chunk in chunks:
+            chunk_id = f"chunk_{calculate_hash(chunk['text'])}"
+            # The same text twice (e.g. a repeated notice) still needs two distinct IDs
+            seen[chunk_id] = seen.get(chunk_id, 0) + 1
+            if seen[chunk_id] > 1:
+                chunk_id = f"{chunk_id}_{seen[chunk_id] - 1}"
+
+            metadata = {
+                "type": "content",
+                "major_section": chunk['major_section'][:200],
+                "sub_section": chunk['sub_section'][:200],
+                "section_path": chunk['section_path'][:300],
+                "index": chunk['index'],
+                "word_count": chunk['word_count'],
+                "char_count": chunk['char_count'],
+                # Sorted, so the stored value never depends on extraction order and an
+                # incremental run compares equal for unchanged chunks
+                "keywords": json.dumps(sorted(chunk['keywords'])),
+            }
+
+            for entity_type, values in chunk['entities'].items():
+                if values:
+                    metadata[f"entity_{entity_type}"] = json.dumps(values[:5])
+
+            yield {"id": chunk_id, "text": chunk['text'], "metadata": metadata}
+
     def create_collection(self, reset: bool = True):
         if reset:
             try:
@@ -298,102 +797,119 @@ class EnhancedVectorDBCreator:
         )
         print_status(f"Collection created: {self.collection_name}")
 
-    def process_and_store(self, file_path: Path) -> Dict[str, Any]:
+    def plan_operations(self, chunks: Iterable[Dict[str, Any]], existing: Dict[str, Dict],
+                        incremental: bool, summary: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+        """Turn chunks into writer operations as they arrive: ("embed", record) for new or
+        changed text, ("update", record) for moved text, then the deletes and __metadata__"""
+        wanted = set()
+        sections = summary["sections"]
+        for record in self.build_records(chunks):
+            wanted.add(record["id"])
+            section = record["metadata"]["section_path"][:50]
+            sections[section] = sections.get(section, 0) + 1
+            stored = existing.get(record["id"])
+            if stored is None:
+                summary["embedded"] += 1
+                yield "embed", record
+            elif stored != record["metadata"]:
+                # Same text, new position or section: fix the metadata without re-embedding
+                summary["metadata_updated"] += 1
+                yield "update", record
+            else:
+                summary["unchanged"] += 1
+        summary["total_chunks"] = len(wanted)
+
+        stale_ids = [chunk_id for chunk_id in existing if chunk_id not in wanted]
+        summary["deleted"] = len(stale_ids)
+        if stale_ids:
+            yield "delete", stale_ids
+
+        # Only rewritten when something changed, so the server's collection fingerprint
+        # (and its response cache) survives a no-op run
+        if stale_ids or summary["embedded"] or summary["metadata_updated"] or not incremental:
+            yield "embed", {
+                "id": "__metadata__",
+                "text": f"METADATA|file:{summary['file_name']}|lines:{summary['total_lines']}|words:{summary['total_words']}",
+                "metadata": {
+                    "type": "metadata",
+                    "file_name": summary['file_name'],
+                    "total_lines": summary['total_lines'],
+                    "total_words": summary['total_words'],
+                    "total_chunks": summary['total_chunks'],
+                    "created": datetime.now().isoformat(),
+                    "version": "2.0_enhanced"
+                },
+            }
+
+    def process_and_store(self, file_path: Path, incremental: bool = False,
+                          previous_seconds_per_chunk: float = None) -> Dict[str, Any]:
         print_section("READING DATA FILE")
 
         if not file_path.exists():
             raise FileNotFoundError(f"Data file not found: {file_path}")
 
-        print_status(f"Reading: {file_path.name}")
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        print_status(f"Streaming: {file_path.name} ({file_path.stat().st_size / 1e6:.1f} MB)")
+
+        existing = {}
+        if incremental:
+            stored = self.collection.get(include=["metadatas"])
+            existing = dict(zip(stored["ids"], stored["metadatas"]))
+            existing.pop("__metadata__", None)
+            print_status(f"Stored chunks: {len(existing):,}")
 
-        total_lines = len(content.split('\n'))
-        total_words = len(content.split())
-        total_chars = len(content)
+        print_section("CHUNKING, EMBEDDING AND STORING")
+        summary = {
+            "file_name": file_path.name,
+            "total_lines": 0,
+            "total_words": 0,
+            "total_chars": 0,
+            "total_chunks": 0,
+            "sections": {},
+            "unchanged": 0,
+            "embedded": 0,
+            "metadata_updated": 0,
+            "deleted": 0,
+        }
+        # The file is read, chunked and embedded as one stream; line/word totals fill in
+        # as it is read and are final by the time the __metadata__ record is planned
+        chunks = self.chunker.iter_chunks(read_source_lines(file_path, summary))
+        pipeline = IngestionPipeline(self.collection, self.load_embedding_model, store=self.embedding_store)
+        stats = pipeline.run(self.plan_operations(chunks, existing, incremental, summary))
+        total_lines, total_words = summary["total_lines"], summary["total_words"]
 
         print_status(f"Total lines: {total_lines:,}")
         print_status(f"Total words: {total_words:,}")
-        print_status(f"Total characters: {total_chars:,}")
-
-        print_section("SEMANTIC CHUNKING")
-        chunks = self.chunker.chunk_with_semantic_preservation(content)
-        print_status(f"Created {len(chunks)} semantic chunks")
-
-        sections = {}
-        for chunk in chunks:
-            section = chunk['section_path'][:50]
-            sections[section] = sections.get(section, 0) + 1
+        print_status(f"Total characters: {summary['total_chars']:,}")
 
+        sections = summary["sections"]
+        print_status(f"Created {summary['total_chunks']} semantic chunks")
         print_status("Chunk distribution by section:")
         for section, count in list(sections.items())[:15]:
             print(f"      • {section}: {count} chunks")
 
-        print_section("GENERATING EMBEDDINGS WITH RICH METADATA")
-        model = self.load_embedding_model()
-
-        ids = ["__metadata__"]
-        documents = [f"METADATA|file:{file_path.name}|lines:{total_lines}|words:{total_words}"]
-        metadatas = [{
-            "type": "metadata",
-            "file_name": file_path.name,
-            "total_lines": total_lines,
-            "total_words": total_words,
-            "total_chunks": len(chunks),
-            "created": datetime.now().isoformat(),
-            "version": "2.0_enhanced"
-        }]
-
-        for chunk in chunks:
-            chunk_id = f"chunk_{chunk['index']:05d}"
-            ids.append(chunk_id)
-            documents.append(chunk['text'])
-
-            metadata = {
-                "type": "content",
-                "major_section": chunk['major_section'][:200],
-                "sub_section": chunk['sub_section'][:200],
-                "section_path": chunk['section_path'][:300],
-                "index": chunk['index'],
-                "word_count": chunk['word_count'],
-                "char_count": chunk['char_count'],
-                "keywords": json.dumps(chunk['keywords']),
-            }
-
-            for entity_type, values in chunk['entities'].items():
-                if values:
-                    metadata[f"entity_{entity_type}"] = json.dumps(values[:5])
-
-            metadatas.append(metadata)
-
-        print_section("STORING TO DATABASE WITH VALIDATION")
-        batch_size = 50
-        total_docs = len(documents)
-        stored_count = 0
-
-        for batch_start in range(0, total_docs, batch_size):
-            batch_end = min(batch_start + batch_size, total_docs)
-
-            batch_docs = documents[batch_start:batch_end]
-            batch_ids = ids[batch_start:batch_end]
-            batch_meta = metadatas[batch_start:batch_end]
-
-            embeddings = model.encode(batch_docs, show_progress_bar=False).tolist()
-
-            self.collection.add(
-                ids=batch_ids,
-                documents=batch_docs,
-                metadatas=batch_meta,
-                embeddings=embeddings
-            )
-
-            stored_count += len(batch_docs)
-            progress = (stored_count / total_docs) * 100
-            print_status(f"Progress: {stored_count}/{total_docs} ({progress:.1f}%)")
+        print_status(f"Unchanged chunks: {summary['unchanged']}")
+        print_status(f"Metadata-only updates: {summary['metadata_updated']}")
+        print_status(f"New or changed chunks embedded: {summary['embedded']}")
+        print_status(f"Vectors read from the embedding store: {stats['counts']['reused']}, "
+                     f"encoded: {stats['counts']['encoded']}")
+        print_status(f"Stale chunks deleted: {summary['deleted']}")
+        print_status(f"Pipeline: {stats['chunks_per_second']:.1f} chunks/s over {stats['seconds']:.1f}s "
+                     f"(busy: chunk {stats['busy']['chunk']:.1f}s, embed {stats['busy']['embed']:.1f}s, "
+                     f"write {stats['busy']['write']:.1f}s)")
+
+        embed_seconds = stats["busy"]["embed"]
+        skipped = summary["unchanged"] + summary["metadata_updated"]
+        reused = stats["counts"]["reused"]
+        if stats["counts"]["encoded"]:
+            seconds_per_chunk = embed_seconds / stats["counts"]["encoded"]
+        else:
+            seconds_per_chunk = previous_seconds_per_chunk or 0.0
+        time_saved = (skipped + reused) * seconds_per_chunk
 
+        expected_docs = summary["total_chunks"] + 1
         actual_count = self.collection.count()
-        if actual_count != total_docs:
-            print_status(f"WARNING: Expected {total_docs}, stored {actual_count}")
+        if actual_count != expected_docs:
+            print_status(f"WARNING: Expected {expected_docs}, stored {actual_count}")
         else:
             print_status(f"VERIFIED: All {actual_count} documents stored successfully")
 
@@ -401,10 +917,19 @@ class EnhancedVectorDBCreator:
             "success": True,
             "total_lines": total_lines,
             "total_words": total_words,
-            "total_chunks": len(chunks),
+            "total_chunks": summary["total_chunks"],
             "total_documents": actual_count,
             "sections": len(sections),
-            "accuracy_verified": actual_count == total_docs
+            "accuracy_verified": actual_count == expected_docs,
+            "skipped": skipped,
+            "embedded": summary["embedded"],
+            "reused": reused,
+            "metadata_updated": summary["metadata_updated"],
+            "deleted": summary["deleted"],
+            "embed_seconds": embed_seconds,
+            "embed_seconds_per_chunk": seconds_per_chunk,
+            "time_saved": time_saved,
+            "pipeline": stats,
         }
 
     def verify_database(self):
@@ -462,10 +987,27 @@ def main():
 
     creator = EnhancedVectorDBCreator()
     creator.initialize()
-    creator.create_collection(reset=True)
+
+    # Incremental by default; a missing manifest or any parameter change means a full rebuild
+    manifest = creator.load_manifest()
+    if "--full" in sys.argv:
+        incremental, reason = False, "--full requested"
+    elif not manifest:
+        incremental, reason = False, "no manifest from a previous build"
+    elif manifest.get("params") != creator.index_params():
+        incremental, reason = False, "model or chunker parameters changed"
+    else:
+        incremental, reason = True, f"manifest from {manifest.get('updated', 'an earlier build')}"
+    print_status(f"Mode: {'INCREMENTAL' if incremental else 'FULL REBUILD'} ({reason})")
+
+    creator.create_collection(reset=not incremental)
 
     try:
-        result = creator.process_and_store(DATA_PATH)
+        started = time.perf_counter()
+        result = creator.process_and_store(DATA_PATH, incremental=incremental,
+                                           previous_seconds_per_chunk=manifest.get("embed_seconds_per_chunk"))
+        creator.save_manifest(result)
+        elapsed = time.perf_counter() - started
 
         if result['success']:
             verification_passed = creator.verify_database()
@@ -486,6 +1028,13 @@ Statistics:
      • Documents: {result['total_documents']:,}
      • Sections: {result['sections']}
      • Storage Verified: {result['accuracy_verified']}
+Index Update ({'incremental' if incremental else 'full rebuild'}, {elapsed:.1f}s):
+     • Skipped (unchanged): {result['skipped']:,}
+     • Embedded: {result['embedded']:,}
+     • Vectors reused from the embedding store: {result['reused']:,}
+     • Metadata updated: {result['metadata_updated']:,}
+     • Deleted (stale): {result['deleted']:,}
+     • Embedding time: {result['embed_seconds']:.1f}s (~{result['time_saved']:.1f}s saved by skipping and reuse)
 
 Ready to use with chatbot!
 """)
@@ -0,0 +1,317 @@
+"""
+ADARSHA AI - PERSISTENT EMBEDDING STORE
+Content-addressed vectors shared by the indexer and the server. A vector is kept once
+per (model, text hash) as a row of a float32 array file that readers memory-map, with
+a sqlite index in WAL mode mapping keys to rows. Any number of threads and processes
+can read while one writes; writers take turns through sqlite's write lock.
+
+Layout of the store directory:
+  index.sqlite                 (model, hash) -> (dim, slot, last_used); current generation
+  vectors_g<gen>_d<dim>.f32    rows of <dim> float32 values, one file per dimension
+
+Compaction copies the live rows into the next generation's files and switches the index
+over in one transaction, so a reader sees either the old rows or the new ones, never a mix.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Size limit for the array files; past it the least recently used rows are evicted and
+# the store is compacted down to EMBEDDING_STORE_LOW_WATER of the limit (0 = no limit)
+EMBEDDING_STORE_MAX_MB = float(os.getenv("EMBEDDING_STORE_MAX_MB", "512"))
+EMBEDDING_STORE_LOW_WATER = float(os.getenv("EMBEDDING_STORE_LOW_WATER", "0.8"))
+
+# Keeps IN (...) lists under sqlite's bound-parameter limit
+_QUERY_BATCH = 500
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS vectors (
+        model TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        dim INTEGER NOT NULL,
+        slot INTEGER NOT NULL,
+        last_used REAL NOT NULL,
+        PRIMARY KEY (model, hash)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)",
+]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """On-disk vectors for one embedding model, keyed by the hash of the text they encode"""
+
+    def __init__(self, path, model: str, max_mb: float = EMBEDDING_STORE_MAX_MB,
+                 low_water: float = EMBEDDING_STORE_LOW_WATER):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.path / "index.sqlite"
+        self.model = model
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.low_water = min(max(low_water, 0.0), 1.0)
+
+        self._local = threading.local()
+        self._maps: Dict[Tuple[int, int], np.memmap] = {}
+        self._maps_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.written = 0
+        self.evicted = 0
+        self.compactions = 0
+
+        # WAL lets readers keep their snapshot while a writer commits
+        self._conn().execute("PRAGMA journal_mode=WAL")
+        with self._transaction("IMMEDIATE") as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+
+    # ------------------------------------------------------------------ plumbing
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; sqlite connections must not be shared"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.index_path), timeout=60, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self, mode: str = "DEFERRED"):
+        """DEFERRED reads one consistent snapshot; IMMEDIATE takes the write lock up front,
+        so two writers never pick the same slots"""
+        conn = self._conn()
+        conn.execute(f"BEGIN {mode}")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _file(self, generation: int, dim: int) -> Path:
+        return self.path / f"vectors_g{generation}_d{dim}.f32"
+
+    @staticmethod
+    def _generation(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def _lookup(self, conn: sqlite3.Connection, hashes: Sequence[str]) -> Dict[str, Tuple[int, int]]:
+        found = {}
+        for start in range(0, len(hashes), _QUERY_BATCH):
+            batch = hashes[start:start + _QUERY_BATCH]
+            rows = conn.execute(
+                f"SELECT hash, dim, slot FROM vectors WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                (self.model, *batch),
+            )
+            for digest, dim, slot in rows:
+                found[digest] = (dim, slot)
+        return found
+
+    def _map(self, generation: int, dim: int, rows_needed: int) -> np.memmap:
+        """Read-only map of one array file, remapped when it has grown past the cached view"""
+        key = (generation, dim)
+        with self._maps_lock:
+            mapped = self._maps.get(key)
+            if mapped is not None and mapped.shape[0] >= rows_needed:
+                return mapped
+            rows = os.path.getsize(self._file(generation, dim)) // (dim * 4)
+            if rows < rows_needed:
+                raise OSError(f"{self._file(generation, dim).name} holds {rows} rows, index expects {rows_needed}")
+            mapped = np.memmap(self._file(generation, dim), dtype=np.float32, mode="r", shape=(rows, dim))
+            # Views of older generations go, so compaction can delete their files
+            for old in [k for k in self._maps if k[0] < generation]:
+                del self._maps[old]
+            self._maps[key] = mapped
+            return mapped
+
+    # ------------------------------------------------------------------ reads
+    def get_many(self, texts: Sequence[str], touch: bool = False) -> List[Optional[np.ndarray]]:
+        """Stored vector for each text, or None; touch marks hits as recently used"""
+        hashes = [text_hash(text) for text in texts]
+        unique = list(dict.fromkeys(hashes))
+        for attempt in range(2):
+            # Generation and slots from one snapshot, so they always describe the same files
+            with self._transaction() as conn:
+                generation = self._generation(conn)
+                found = self._lookup(conn, unique)
+            try:
+                vectors = self._read_rows(generation, found)
+                break
+            except (OSError, ValueError):
+                # A compaction replaced the files between the snapshot and the read
+                if attempt:
+                    raise
+                with self._maps_lock:
+                    self._maps.clear()
+
+        if touch and found:
+            self._touch(list(found))
+        with self._stats_lock:
+            self.hits += sum(1 for digest in hashes if digest in vectors)
+            self.misses += sum(1 for digest in hashes if digest not in vectors)
+        return [vectors.get(digest) for digest in hashes]
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        return self.get_many([text])[0]
+
+    def _read_rows(self, generation: int, found: Dict[str, Tuple[int, int]]) -> Dict[str, np.ndarray]:
+        by_dim: Dict[int, List[Tuple[str, int]]] = {}
+        for digest, (dim, slot) in found.items():
+            by_dim.setdefault(dim, []).append((digest, slot))
+        vectors = {}
+        for dim, entries in by_dim.items():
+            slots = np.fromiter((slot for _, slot in entries), dtype=np.int64, count=len(entries))
+            mapped = self._map(generation, dim, int(slots.max()) + 1)
+            # Fancy indexing copies the rows out of the map
+            rows = mapped[slots]
+            for (digest, _), row in zip(entries, rows):
+                vectors[digest] = row
+        return vectors
+
+    def _touch(self, hashes: Sequence[str]):
+        now = time.time()
+        with self._transaction("IMMEDIATE") as conn:
+            for start in range(0, len(hashes), _QUERY_BATCH):
+                batch = hashes[start:start + _QUERY_BATCH]
+                conn.execute(
+                    f"UPDATE vectors SET last_used = ? WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    (now, self.model, *batch),
+                )
+
+    # ------------------------------------------------------------------ writes
+    def put_many(self, texts: Sequence[str], vectors) -> int:
+        """Store vectors for texts not yet stored (already stored ones are touched); returns rows added"""
+        if not len(texts):
+            return 0
+        matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1))
+        dim = matrix.shape[1]
+        rows = {}
+        for text, row in zip(texts, matrix):
+            rows.setdefault(text_hash(text), row)
+
+        now = time.time()
+        with self._transaction("IMMEDIATE") as conn:
+            generation = self._generation(conn)
+            stored = self._lookup(conn, list(rows))
+            new = [digest for digest in rows if digest not in stored]
+            if new:
+                path = self._file(generation, dim)
+                size = path.stat().st_size if path.exists() else 0
+                # Rounding up skips any partial row left by a writer that died mid-append
+                first = -(-size // (dim * 4))
+                with open(path, "r+b" if path.exists() else "w+b") as f:
+                    f.seek(first * dim * 4)
+                    f.write(np.stack([rows[digest] for digest in new]).tobytes())
+                    f.flush()
+                # Rows are on disk before the index points at them
+                conn.executemany(
+                    "INSERT INTO vectors (model, hash, dim, slot, last_used) VALUES (?, ?, ?, ?, ?)",
+                    [(self.model, digest, dim, first + i, now) for i, digest in enumerate(new)],
+                )
+            if stored:
+                conn.executemany(
+                    "UPDATE vectors SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, self.model, digest) for digest in stored],
+                )
+        with self._stats_lock:
+            self.written += len(new)
+
+        if self.max_bytes and new and self.size_bytes() > self.max_bytes:
+            self.compact()
+        return len(new)
+
+    def size_bytes(self) -> int:
+        """Bytes in the current generation's array files"""
+        with self._transaction() as conn:
+            generation = self._generation(conn)
+        return sum(path.stat().st_size for path in self.path.glob(f"vectors_g{generation}_d*.f32"))
+
+    def compact(self, max_bytes: Optional[int] = None) -> Dict[str, int]:
+        """
+        Evict least recently used rows until the live data fits low_water of the limit,
+        then copy the live rows into fresh files. Readers keep using the previous
+        generation's files until they next look up the index.
+        """
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        with self._transaction("IMMEDIATE") as conn:
+            generation = self._generation(conn)
+            live = conn.execute("SELECT COALESCE(SUM(dim), 0) * 4 FROM vectors").fetchone()[0]
+
+            evicted = 0
+            if limit and live > limit * self.low_water:
+                excess = live - int(limit * self.low_water)
+                victims = []
+                for model, digest, dim in conn.execute(
+                        "SELECT model, hash, dim FROM vectors ORDER BY last_used, hash"):
+                    if excess <= 0:
+                        break
+                    victims.append((model, digest))
+                    excess -= dim * 4
+                conn.executemany("DELETE FROM vectors WHERE model = ? AND hash = ?", victims)
+                evicted = len(victims)
+
+            target = generation + 1
+            for (dim,) in conn.execute("SELECT DISTINCT dim FROM vectors").fetchall():
+                entries = conn.execute(
+                    "SELECT model, hash, slot FROM vectors WHERE dim = ? ORDER BY slot", (dim,)
+                ).fetchall()
+                source = np.memmap(self._file(generation, dim), dtype=np.float32, mode="r")
+                source = source[:source.shape[0] // dim * dim].reshape(-1, dim)
+                with open(self._file(target, dim), "wb") as f:
+                    for start in range(0, len(entries), 4096):
+                        block = entries[start:start + 4096]
+                        f.write(np.ascontiguousarray(source[[slot for _, _, slot in block]]).tobytes())
+                del source
+                conn.executemany(
+                    "UPDATE vectors SET slot = ? WHERE model = ? AND hash = ?",
+                    [(slot, model, digest) for slot, (model, digest, _) in enumerate(entries)],
+                )
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (target,))
+
+        # The generation just replaced stays for readers still holding its slots
+        for path in self.path.glob("vectors_g*_d*.f32"):
+            try:
+                if int(path.name.split("_")[1][1:]) < generation:
+                    path.unlink()
+            except (OSError, ValueError):
+                pass
+        with self._stats_lock:
+            self.evicted += evicted
+            self.compactions += 1
+        return {"generation": target, "evicted": evicted, "bytes": self.size_bytes()}
+
+    # ------------------------------------------------------------------ metrics
+    def stats(self) -> Dict:
+        with self._transaction() as conn:
+            generation = self._generation(conn)
+            rows = conn.execute("SELECT COUNT(*) FROM vectors WHERE model = ?", (self.model,)).fetchone()[0]
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": str(self.path),
+                "model": self.model,
+                "rows": rows,
+                "bytes": self.size_bytes(),
+                "max_bytes": self.max_bytes,
+                "generation": generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "written": self.written,
+                "evicted": self.evicted,
+                "compactions": self.compactions,
+            }
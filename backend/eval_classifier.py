@@ -0,0 +1,103 @@
+"""
+ADARSHA AI - INTENT CLASSIFIER EVALUATION
+Classifies a held-out set of labeled visitor questions (paraphrases, not the
+centroid examples) with the regex patterns alone and with the embedding
+classifier, and prints a confusion matrix, accuracy and latency for each.
+
+Usage: python eval_classifier.py [margin]
+"""
+
+import sys
+import time
+
+from pipeline import QueryClassifier, encode_normalized, INTENT_MARGIN
+
+EVAL_SET = {
+    "greeting": [
+        "hello!", "hey there", "hi adarsha", "good afternoon", "namaskar!", "hello, how are you doing?",
+        "hey ai", "hi, good to see you", "नमस्कार", "good morning everyone", "yo", "howdy",
+    ],
+    "simple": [
+        "who's the principal?", "who is the principal of this school", "who is your vice principal",
+        "what's your name?", "when did the school start", "what year was adarsha established",
+        "where is adarsha secondary school", "how many students study here", "who created you",
+        "what time is lunch", "how many teachers are there", "who is the head of the computer department",
+    ],
+    "detailed": [
+        "can you explain the eco industrial project in detail", "tell me about your teachers",
+        "describe the school's daily routine", "give me the full staff list",
+        "explain the enrollment numbers for every grade", "what is the ai project and who worked on it",
+        "how does the renewable energy zone of the project work", "tell me about ganesh sapkota",
+        "describe the environmental conservation zone", "what subjects does the technical stream cover",
+        "give me a complete overview of the school", "explain the history of adarsha",
+    ],
+    "general": [
+        "what is gravity", "can you write a poem", "what is 12 times 8", "who is the prime minister of nepal",
+        "how do plants make food", "tell me something funny", "what is machine learning",
+        "how can i improve my handwriting", "what is the tallest mountain", "recommend a good book",
+        "how does the internet work", "what day is it today",
+    ],
+}
+
+
+def confusion_matrix(labels, pairs):
+    matrix = {actual: {predicted: 0 for predicted in labels} for actual in labels}
+    for actual, predicted in pairs:
+        matrix[actual][predicted] += 1
+    return matrix
+
+
+def print_report(title, labels, pairs, latency_us):
+    matrix = confusion_matrix(labels, pairs)
+    correct = sum(1 for actual, predicted in pairs if actual == predicted)
+    print(f"\n  {title}")
+    print("  " + "actual \\ predicted".ljust(20) + "".join(label[:9].rjust(10) for label in labels))
+    for actual in labels:
+        print("  " + actual.ljust(20) + "".join(str(matrix[actual][p]).rjust(10) for p in labels))
+    print(f"  accuracy {correct}/{len(pairs)} = {correct / len(pairs):.1%}   "
+          f"mean latency {sum(latency_us) / len(latency_us):.1f} us")
+    return correct
+
+
+def main():
+    margin = float(sys.argv[1]) if len(sys.argv) > 1 else INTENT_MARGIN
+    classifier = QueryClassifier(mode="embedding", margin=margin)
+    classifier.prepare()
+    labels = list(QueryClassifier.CLASSES)
+
+    queries = [(label, query) for label, items in EVAL_SET.items() for query in items]
+    embeddings = encode_normalized([query for _, query in queries])
+
+    print("\n" + "=" * 60)
+    print(f" INTENT CLASSIFIER ({len(queries)} held-out queries, margin {margin})")
+    print("=" * 60)
+
+    regex_pairs, regex_us = [], []
+    for actual, query in queries:
+        started = time.perf_counter()
+        predicted = QueryClassifier.match_patterns(query)
+        regex_us.append((time.perf_counter() - started) * 1e6)
+        regex_pairs.append((actual, predicted))
+
+    embedding_pairs, embedding_us = [], []
+    for (actual, query), embedding in zip(queries, embeddings):
+        started = time.perf_counter()
+        predicted = classifier.classify(query, embedding)["type"]
+        embedding_us.append((time.perf_counter() - started) * 1e6)
+        embedding_pairs.append((actual, predicted))
+
+    print_report("regex patterns", labels, regex_pairs, regex_us)
+    print_report("embedding centroids + regex tiebreak", labels, embedding_pairs, embedding_us)
+    print(f"\n  decided by: {classifier.stats()['sources']}")
+
+    misses = [(actual, predicted, query) for (actual, predicted), (_, query)
+              in zip(embedding_pairs, queries) if actual != predicted]
+    if misses:
+        print("\n  misclassified:")
+        for actual, predicted, query in misses:
+            print(f"    {actual:>9} -> {predicted:<9} {query!r}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+ADARSHA AI - CONCURRENT STREAM LOAD TEST
+Opens N socket clients at once, each asking one question, and reports how many
+streams finish and how fast at each concurrency level. Run it against app.py
+(threading) and asgi_app.py (asyncio) to compare their capacity.
+
+A mock Groq upstream keeps the test free of real API calls and rate limits:
+
+  python load_test.py mock --port 8900 --tokens 150 --token-ms 20
+  GROQ_BASE_URL=http://localhost:8900 GROQ_PREWARM=0 RESPONSE_CACHE_ENABLED=0 \\
+      COALESCE_ENABLED=0 python app.py          # :5000
+  GROQ_BASE_URL=http://localhost:8900 GROQ_PREWARM=0 RESPONSE_CACHE_ENABLED=0 \\
+      COALESCE_ENABLED=0 python asgi_app.py     # :5001
+  python load_test.py run --url http://localhost:5000,http://localhost:5001 --levels 50,100,200,400
+
+Start a server with TOKEN_MAX_LATENCY_MS=0 for the one-frame-per-delta baseline.
+The server's /metrics reports frames per response and CPU per stream under token_frames.
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+import socketio
+from aiohttp import web
+
+QUESTIONS = [
+    "who is the principal",
+    "when was the school established",
+    "tell me about the eco industrial project",
+    "what is the daily schedule",
+    "who teaches c programming",
+]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# =============================================================================
+# MOCK GROQ UPSTREAM
+# =============================================================================
+def make_mock_app(tokens, token_ms):
+    async def completions(request):
+        body = await request.json()
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i in range(tokens):
+            chunk = {
+                "id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": f"word{i} "}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(token_ms / 1000.0)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def models(request):
+        return web.json_response({"object": "list", "data": []})
+
+    mock = web.Application()
+    mock.router.add_post("/openai/v1/chat/completions", completions)
+    mock.router.add_get("/openai/v1/models", models)
+    return mock
+
+
+# =============================================================================
+# LOAD CLIENTS
+# =============================================================================
+async def one_stream(url, index, timeout):
+    """Connect, ask one question, wait for stream_end; returns (ttft_ms, total_ms, frames) or None"""
+    client = socketio.AsyncClient(reconnection=False)
+    done = asyncio.Event()
+    result = {"first": None, "ok": False, "frames": 0}
+
+    @client.on("token")
+    async def on_token(data):
+        result["frames"] += 1
+        if result["first"] is None:
+            result["first"] = time.perf_counter()
+
+    @client.on("stream_end")
+    async def on_end(data):
+        result["ok"] = bool(data.get("success"))
+        done.set()
+
+    try:
+        await client.connect(url, transports=["websocket"], wait_timeout=timeout)
+        # A distinct question per client so neither caching nor coalescing kicks in
+        question = f"{QUESTIONS[index % len(QUESTIONS)]} (visitor {index})"
+        started = time.perf_counter()
+        await client.emit("text_query", {"message": question, "request_id": index})
+        await asyncio.wait_for(done.wait(), timeout)
+        if not result["ok"] or result["first"] is None:
+            return None
+        return ((result["first"] - started) * 1000, (time.perf_counter() - started) * 1000, result["frames"])
+    except Exception:
+        return None
+    finally:
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+
+
+async def run_level(url, level, timeout):
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one_stream(url, i, timeout) for i in range(level)))
+    wall = time.perf_counter() - started
+    ok = [r for r in results if r is not None]
+    ttft = [r[0] for r in ok]
+    total = [r[1] for r in ok]
+    frames = [r[2] for r in ok]
+    print(f"  {level:>5}  {len(ok):>5}/{level:<5} "
+          f"ttft p50={percentile(ttft, 50):8.0f} p99={percentile(ttft, 99):8.0f} ms   "
+          f"total p50={percentile(total, 50):8.0f} ms   frames/stream={percentile(frames, 50):5.0f}   "
+          f"wall={wall:6.1f} s")
+    return len(ok), percentile(ttft, 99)
+
+
+async def run(urls, levels, timeout, max_p99_ms):
+    capacity = {}
+    for url in urls:
+        print("\n" + "=" * 60)
+        print(f" {url}")
+        print("=" * 60)
+        capacity[url] = 0
+        for level in levels:
+            completed, p99 = await run_level(url, level, timeout)
+            if completed < level * 0.99 or p99 > max_p99_ms:
+                break
+            capacity[url] = level
+            await asyncio.sleep(2)
+
+    print("\n" + "=" * 60)
+    print(f" CAPACITY (>=99% complete, ttft p99 <= {max_p99_ms:.0f} ms)")
+    print("=" * 60)
+    for url, level in capacity.items():
+        print(f"  {url:<32} {level} concurrent streams")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    mock = sub.add_parser("mock", help="serve a fake streaming Groq endpoint")
+    mock.add_argument("--port", type=int, default=8900)
+    mock.add_argument("--tokens", type=int, default=150)
+    mock.add_argument("--token-ms", type=float, default=20)
+
+    load = sub.add_parser("run", help="ramp concurrent streams against one or more servers")
+    load.add_argument("--url", default="http://localhost:5000,http://localhost:5001")
+    load.add_argument("--levels", default="25,50,100,200,400,800")
+    load.add_argument("--timeout", type=float, default=120)
+    load.add_argument("--max-p99-ms", type=float, default=3000)
+
+    args = parser.parse_args()
+    if args.command == "mock":
+        print(f"[Mock] Groq upstream on :{args.port} ({args.tokens} tokens, {args.token_ms} ms apart)")
+        web.run_app(make_mock_app(args.tokens, args.token_ms), port=args.port, print=None)
+        return
+
+    urls = [u.strip() for u in args.url.split(",") if u.strip()]
+    levels = [int(x) for x in args.levels.split(",")]
+    asyncio.run(run(urls, levels, args.timeout, args.max_p99_ms))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
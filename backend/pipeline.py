@@ -6,9 +6,20 @@ Fixed: Token spacing, voice mode cleaning, streaming stability, fast responses
 
 import os
 import sys
+import asyncio
 import re
+import json
+import time
+import atexit
+import hashlib
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Generator, Optional
+from types import MappingProxyType
+from typing import AsyncGenerator, Dict, List, Generator, Optional, Tuple
 from dotenv import load_dotenv
 
 # =============================================================================
@@ -22,6 +33,90 @@ VECTORDB_PATH = Path(os.getenv("VECTORDB_PATH", str(PROJECT_ROOT / "data" / "chr
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "adarsha_madhyapur_knowledge")
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
 
+# Search backend: "numpy" answers top-k from an in-memory matrix, "chroma" queries the DB
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "numpy").strip().lower()
+
+# Query embedding cache
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "3600"))
+
+# Persistent embedding store shared with create_vector_db.py (see embedding_store.py):
+# canonical questions, directive sections and classifier examples are encoded once, ever.
+# CANONICAL_QUERIES_PATH optionally adds questions from a file, one per line
+EMBEDDING_STORE_ENABLED = os.getenv("EMBEDDING_STORE_ENABLED", "1") == "1"
+# The default is <repo>/data/embedding_store, the same directory create_vector_db.py uses
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", str(PROJECT_ROOT.parent / "data" / "embedding_store"))
+CANONICAL_QUERIES_PATH = os.getenv("CANONICAL_QUERIES_PATH", "")
+
+# Cross-session embedding micro-batching (window 0 disables batching)
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "3"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "16"))
+
+# Semantic response cache (empty path keeps the cache in memory only)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92"))
+RESPONSE_CACHE_REPLAY_MS = float(os.getenv("RESPONSE_CACHE_REPLAY_MS", "15"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
+COLLECTION_CHECK_INTERVAL = float(os.getenv("COLLECTION_CHECK_INTERVAL", "30"))
+
+# Single-flight: identical in-flight questions share one upstream generation
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1") == "1"
+
+# Greetings and fixed-fact questions answered from templates, skipping embedding and Groq
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+
+# Knowledge injection: "sections" sends only relevant CORE_DIRECTIVE sections, "full" the whole block
+KNOWLEDGE_INJECTION = os.getenv("KNOWLEDGE_INJECTION", "sections").strip().lower()
+KNOWLEDGE_TOKEN_BUDGET = int(os.getenv("KNOWLEDGE_TOKEN_BUDGET", "900"))
+
+# Intent classifier: "embedding" compares the retrieval vector with class centroids and
+# falls back to the patterns when the two nearest are within INTENT_MARGIN; "regex" skips it
+INTENT_CLASSIFIER = os.getenv("INTENT_CLASSIFIER", "embedding").strip().lower()
+INTENT_MARGIN = float(os.getenv("INTENT_MARGIN", "0.04"))
+
+# Groq HTTP client pool
+GROQ_POOL_MAX_CONNECTIONS = int(os.getenv("GROQ_POOL_MAX_CONNECTIONS", "20"))
+GROQ_POOL_MAX_KEEPALIVE = int(os.getenv("GROQ_POOL_MAX_KEEPALIVE", "10"))
+GROQ_POOL_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_POOL_KEEPALIVE_EXPIRY", "120"))
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "30"))
+GROQ_PREWARM = os.getenv("GROQ_PREWARM", "1") == "1"
+# Override the API endpoint, e.g. to point the load test at a mock upstream
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "") or None
+
+# Async (ASGI) path: one connection per open stream, so the cap is much higher
+GROQ_ASYNC_MAX_CONNECTIONS = int(os.getenv("GROQ_ASYNC_MAX_CONNECTIONS", "500"))
+ASYNC_EXECUTOR_WORKERS = int(os.getenv("ASYNC_EXECUTOR_WORKERS", "16"))
+
+# Adaptive max_tokens: the TOKEN_BUDGET_PERCENTILE of recent answer lengths per (class, mode),
+# times TOKEN_BUDGET_HEADROOM; the fixed per-class values apply until MIN_SAMPLES are seen
+TOKEN_BUDGET_ENABLED = os.getenv("TOKEN_BUDGET_ENABLED", "1") == "1"
+TOKEN_BUDGET_PERCENTILE = float(os.getenv("TOKEN_BUDGET_PERCENTILE", "95"))
+TOKEN_BUDGET_HEADROOM = float(os.getenv("TOKEN_BUDGET_HEADROOM", "1.2"))
+TOKEN_BUDGET_WINDOW = int(os.getenv("TOKEN_BUDGET_WINDOW", "200"))
+TOKEN_BUDGET_MIN_SAMPLES = int(os.getenv("TOKEN_BUDGET_MIN_SAMPLES", "20"))
+TOKEN_BUDGET_MIN = int(os.getenv("TOKEN_BUDGET_MIN", "64"))
+TOKEN_BUDGET_MAX = int(os.getenv("TOKEN_BUDGET_MAX", "1200"))
+TOKEN_BUDGET_PATH = os.getenv("TOKEN_BUDGET_PATH", str(PROJECT_ROOT / "data" / "token_budgets.json"))
+# Voice mode: stop generating after this many spoken sentences (0 = no limit)
+VOICE_MAX_SENTENCES = int(os.getenv("VOICE_MAX_SENTENCES", "0"))
+
+# Stage-parallel chat_stream: pick and warm a Groq client during embedding, and run
+# retrieval alongside classification and knowledge selection
+STAGE_PARALLEL = os.getenv("STAGE_PARALLEL", "1") == "1"
+STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", "8"))
+
+# Key scheduler: seconds a key rests after a 429 without a Retry-After hint
+GROQ_KEY_COOLDOWN = float(os.getenv("GROQ_KEY_COOLDOWN", "30"))
+
+# Request hedging: a second stream on another key when the first token is late
+# (GROQ_HEDGE_AFTER_MS=0 follows the live p95 time-to-first-token)
+GROQ_HEDGE_ENABLED = os.getenv("GROQ_HEDGE_ENABLED", "0") == "1"
+GROQ_HEDGE_AFTER_MS = float(os.getenv("GROQ_HEDGE_AFTER_MS", "0"))
+GROQ_HEDGE_MIN_MS = float(os.getenv("GROQ_HEDGE_MIN_MS", "250"))
+GROQ_HEDGE_MAX_RATE = float(os.getenv("GROQ_HEDGE_MAX_RATE", "0.1"))
+
 # Collect API keys
 API_KEYS = []
 primary_key = os.getenv("GROQ_API_KEY", "")
@@ -44,15 +139,25 @@ print(" Voice-Optimized Response Engine - Fixed Spacing")
 print("=" * 60)
 
 try:
+    import numpy as np
+    import httpx
     import chromadb
     from chromadb.config import Settings as ChromaSettings
     from sentence_transformers import SentenceTransformer
-    from groq import Groq
+    from groq import Groq, AsyncGroq
+    from embedding_store import EmbeddingStore
     print("[System] ✅ All core systems operational!")
 except ImportError as e:
     print(f"❌ Missing dependency: {e}")
     sys.exit(1)
 
+# Optional: exact-ish token counts for prompt budgeting
+try:
+    import tiktoken
+    _token_encoder = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _token_encoder = None
+
 # =============================================================================
 # COMPLETE SCHOOL KNOWLEDGE BASE - FORMATTED
 # =============================================================================
@@ -309,6 +414,66 @@ You are currently in VOICE CONVERSATION mode. The user is speaking to you and wi
 - Role: AI Project Mentor"
 """
 
+# =============================================================================
+# PRECOMPUTED SYSTEM PROMPTS
+# =============================================================================
+LANGUAGE_INSTRUCTIONS = {
+    "english": "\n\n## LANGUAGE: Respond in ENGLISH only. Ensure proper spacing between all words.",
+    "nepali": "\n\n## LANGUAGE: Respond in NEPALI only.",
+}
+
+def count_tokens(text: str) -> int:
+    """Count prompt tokens with tiktoken when installed, else a word/punctuation estimate"""
+    if _token_encoder is not None:
+        return len(_token_encoder.encode(text))
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+@dataclass(frozen=True)
+class SystemPrompt:
+    """Immutable system prompt for one (mode, language) pair"""
+    mode: str
+    language: str
+    content: str
+    token_count: int
+    
+    @property
+    def message(self) -> Dict:
+        # Fresh dict each time; the large content string itself is shared, never copied
+        return {"role": "system", "content": self.content}
+
+# Shared by every variant and placed first so upstream prefix caching can hit
+SYSTEM_PROMPT_PREFIX = SYSTEM_PROMPT_BASE + f"\n\n## SCHOOL DATABASE\n{CORE_DIRECTIVE}"
+
+def _build_system_prompts(prefix: str) -> "MappingProxyType":
+    prompts = {}
+    for is_voice in (False, True):
+        for language, instruction in LANGUAGE_INSTRUCTIONS.items():
+            content = prefix + (VOICE_MODE_ADDITIONS if is_voice else "") + instruction
+            prompts[(is_voice, language)] = SystemPrompt(
+                mode="voice" if is_voice else "text",
+                language=language,
+                content=content,
+                token_count=count_tokens(content),
+            )
+    return MappingProxyType(prompts)
+
+# Full variants embed the whole knowledge block; compact ones leave it to a per-request message
+SYSTEM_PROMPTS = _build_system_prompts(SYSTEM_PROMPT_PREFIX)
+COMPACT_SYSTEM_PROMPTS = _build_system_prompts(SYSTEM_PROMPT_BASE)
+SYSTEM_PROMPT_PREFIX_TOKENS = count_tokens(SYSTEM_PROMPT_PREFIX)
+
+def get_system_prompt(is_voice: bool, language: str, full_knowledge: bool = True) -> SystemPrompt:
+    prompts = SYSTEM_PROMPTS if full_knowledge else COMPACT_SYSTEM_PROMPTS
+    return prompts.get((is_voice, language)) or prompts[(is_voice, "english")]
+
+def system_prompt_stats() -> Dict:
+    return {
+        "prefix_tokens": SYSTEM_PROMPT_PREFIX_TOKENS,
+        "token_counter": "tiktoken" if _token_encoder is not None else "estimate",
+        "variants": {f"{p.mode}/{p.language}": p.token_count for p in SYSTEM_PROMPTS.values()},
+        "compact_variants": {f"{p.mode}/{p.language}": p.token_count for p in COMPACT_SYSTEM_PROMPTS.values()},
+    }
+
 # =============================================================================
 # LANGUAGE DETECTOR
 # =============================================================================
@@ -324,6 +489,39 @@ class LanguageDetector:
     def get_language(cls, text: str) -> str:
         return "nepali" if cls.is_nepali(text) else "english"
 
+# =============================================================================
+# METRICS
+# =============================================================================
+class Histogram:
+    """Fixed-bucket histogram safe to update from several threads"""
+    
+    def __init__(self, buckets: List[float]):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+            self.count += 1
+            self.total += value
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            labels = [f"<={b:g}" for b in self.buckets] + [f">{self.buckets[-1]:g}"]
+            return {
+                "count": self.count,
+                "mean": round(self.total / self.count, 3) if self.count else 0.0,
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
 # =============================================================================
 # EMBEDDING MODEL (CACHED)
 # =============================================================================
@@ -333,16 +531,299 @@ def get_embedding_model():
     global _embedding_model
     if _embedding_model is None:
         print("[Embeddings] Initializing neural encoder...")
-        _embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+        _embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
         print("[Embeddings] ✅ Encoder ready!")
     return _embedding_model
 
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace so trivially different queries share a key"""
+    return " ".join(query.lower().split())
+
+class EmbeddingCache:
+    """Thread-safe LRU cache of query embeddings with a time-to-live"""
+    
+    def __init__(self, max_size: int = EMBEDDING_CACHE_SIZE, ttl: float = EMBEDDING_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key: Tuple[str, str]) -> Optional["np.ndarray"]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, embedding = entry
+            if self.ttl > 0 and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+    
+    def put(self, key: Tuple[str, str], embedding: "np.ndarray"):
+        if self.max_size <= 0:
+            return
+        embedding.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+def encode_vectors(texts: List[str]) -> "np.ndarray":
+    """Raw encoder output as float32 rows, the form the embedding store keeps"""
+    vectors = get_embedding_model().encode(
+        texts, batch_size=max(1, len(texts)), show_progress_bar=False
+    )
+    return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+def normalize_rows(vectors: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def encode_normalized(texts: List[str]) -> "np.ndarray":
+    """Encode a batch of texts into unit-length float32 rows"""
+    return normalize_rows(encode_vectors(texts))
+
+class EmbeddingDispatcher:
+    """Collects concurrent single-query encodes and runs them as one batch"""
+    
+    def __init__(self, window_ms: float = EMBED_BATCH_WINDOW_MS, max_batch: int = EMBED_BATCH_MAX):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.queue_wait_ms = Histogram([0.5, 1, 2, 3, 5, 10, 25, 50])
+        self.encode_ms = Histogram([5, 10, 20, 40, 80, 160, 320])
+    
+    def encode(self, text: str) -> "np.ndarray":
+        if self.window <= 0 or self.max_batch == 1:
+            start = time.perf_counter()
+            vector = encode_normalized([text])[0]
+            self.batch_sizes.observe(1)
+            self.encode_ms.observe((time.perf_counter() - start) * 1000)
+            return vector
+        
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((text, time.perf_counter(), future))
+        return future.result()
+    
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._start_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="embedding-dispatcher", daemon=True
+                )
+                self._worker.start()
+    
+    def _collect(self) -> List[Tuple[str, float, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            dispatched = time.perf_counter()
+            for _, enqueued, _ in batch:
+                self.queue_wait_ms.observe((dispatched - enqueued) * 1000)
+            
+            # Identical questions arriving together are encoded once
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            self.batch_sizes.observe(len(texts))
+            try:
+                vectors = encode_normalized(texts)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.encode_ms.observe((time.perf_counter() - dispatched) * 1000)
+            
+            rows = {text: vectors[i].copy() for i, text in enumerate(texts)}
+            for text, _, future in batch:
+                future.set_result(rows[text])
+    
+    def stats(self) -> Dict:
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            "encode_ms": self.encode_ms.snapshot(),
+        }
+
+embedding_cache = EmbeddingCache()
+embedding_dispatcher = EmbeddingDispatcher()
+
+embedding_store: Optional["EmbeddingStore"] = None
+
+def open_embedding_store() -> Optional["EmbeddingStore"]:
+    """Open the shared store on first use (AdarshaChatbot.initialize), so importing this
+    module creates no files; until then encode_stored just encodes"""
+    global embedding_store
+    if embedding_store is None and EMBEDDING_STORE_ENABLED:
+        try:
+            embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH, EMBEDDING_MODEL_NAME)
+            print(f"[EmbeddingStore] ✅ {embedding_store.stats()['rows']:,} vectors at {EMBEDDING_STORE_PATH}")
+        except Exception as e:
+            print(f"[EmbeddingStore] ⚠️ Unavailable, fixed texts will be encoded at startup: {e}")
+    return embedding_store
+
+def encode_stored(texts: List[str]) -> "np.ndarray":
+    """encode_normalized for fixed texts: vectors already in the store are read, the rest
+    encoded once and saved for every later start (and for the indexer)"""
+    if embedding_store is None or not texts:
+        return encode_normalized(texts)
+    try:
+        found = embedding_store.get_many(texts, touch=True)
+    except Exception as e:
+        print(f"[EmbeddingStore] ⚠️ Read failed, encoding instead: {e}")
+        return encode_normalized(texts)
+    
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, found) if vector is None))
+    if missing:
+        encoded = encode_vectors(missing)
+        try:
+            embedding_store.put_many(missing, encoded)
+        except Exception as e:
+            print(f"[EmbeddingStore] ⚠️ Could not save {len(missing)} vectors: {e}")
+        fresh = dict(zip(missing, encoded))
+        found = [fresh[text] if vector is None else vector for text, vector in zip(texts, found)]
+    return normalize_rows(np.stack(found))
+
+# Questions visitors ask again and again. Their vectors are precomputed through the
+# embedding store at startup, so asking one never waits on the encoder.
+CANONICAL_QUERIES = [
+    "tell me about the school", "tell me about adarsha secondary school",
+    "where is the school located", "what facilities does the school have",
+    "what is the admission process", "how can i get admission",
+    "what subjects are taught", "what is the technical stream",
+    "tell me about computer engineering", "who teaches c programming",
+    "head of computer department", "who made you", "who created you",
+    "who is sangam gautam", "tell me about the ai project",
+    "what is the eco industrial project", "tell me about the eco industrial project",
+    "renewable energy generation zone", "what is the daily schedule",
+    "what time does school start", "how many students are in grade 11",
+    "how many students are there", "how many teachers are there",
+    "tell me about the teachers", "tell me about madhyapur thimi",
+    "what is madhyapur thimi known for", "what is the see exam", "what is tslc",
+    "what is ctevt", "what clubs and activities are there", "does the school have a library",
+    "does the school have a computer lab", "what is the contact number",
+    "tell me about the science exhibition", "who is ganesh sapkota", "who is kamal tamrakar",
+    "what can you do",
+]
+
+class CanonicalQueries:
+    """Precomputed query embeddings, looked up by normalized question text"""
+    
+    @staticmethod
+    def key(text: str) -> str:
+        # "Who teaches C programming?" and "who teaches c programming" are the same question
+        return normalize_query(text).rstrip("?.! ")
+    
+    def __init__(self, queries: List[str] = CANONICAL_QUERIES, path: str = CANONICAL_QUERIES_PATH):
+        self.queries = list(queries)
+        self.path = path
+        self.vectors: Dict[str, "np.ndarray"] = {}
+        self.hits = 0
+    
+    def load(self):
+        queries = list(self.queries)
+        if self.path and os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                queries.extend(line for line in f if line.strip())
+        texts = list(dict.fromkeys(self.key(query) for query in queries))
+        vectors = encode_stored(texts)
+        loaded = {}
+        for text, vector in zip(texts, vectors):
+            vector.setflags(write=False)
+            loaded[text] = vector
+        self.vectors = loaded
+        print(f"[Embeddings] ✅ {len(loaded)} canonical queries precomputed")
+    
+    def get(self, text: str) -> Optional["np.ndarray"]:
+        vector = self.vectors.get(self.key(text))
+        if vector is not None:
+            self.hits += 1
+        return vector
+    
+    def stats(self) -> Dict:
+        return {
+            "queries": len(self.vectors),
+            "hits": self.hits,
+            "store": embedding_store.stats() if embedding_store is not None else None,
+        }
+
+canonical_queries = CanonicalQueries()
+
+def embed_query(query: str) -> "np.ndarray":
+    """Encode a query into a unit-length float32 vector, served from cache when possible"""
+    text = normalize_query(query)
+    key = (EMBEDDING_MODEL_NAME, text)
+    cached = embedding_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    embedding = canonical_queries.get(text)
+    if embedding is None:
+        embedding = embedding_dispatcher.encode(text)
+    embedding_cache.put(key, embedding)
+    return embedding
+
 # =============================================================================
 # QUERY CLASSIFIER - OPTIMIZED FOR SPEED
 # =============================================================================
 class QueryClassifier:
     """Classifies queries for optimal token allocation"""
     
+    CLASSES = {
+        "greeting": {"max_tokens": 100, "temperature": 0.7},
+        "simple": {"max_tokens": 200, "temperature": 0.5},
+        "detailed": {"max_tokens": 800, "temperature": 0.6},
+        "general": {"max_tokens": 500, "temperature": 0.7},
+    }
+    
     GREETING_PATTERNS = [
         r'^(hi|hello|hey|namaste|namaskar|good\s*(morning|afternoon|evening|night))[\s!?.]*$',
     ]
@@ -366,82 +847,230 @@ class QueryClassifier:
         r'(history|established|founded)',
     ]
     
+    # One search in the old priority order: the anchored greeting and simple patterns
+    # can only match at position 0, where they are tried before the detailed ones
+    PATTERN_RE = re.compile(
+        "|".join(f"(?P<{label}>{'|'.join(patterns)})" for label, patterns in (
+            ("greeting", GREETING_PATTERNS),
+            ("simple", SIMPLE_PATTERNS),
+            ("detailed", DETAILED_PATTERNS),
+        )),
+        re.IGNORECASE
+    )
+    
+    # Labeled queries whose mean embedding is each class centroid
+    EXAMPLES = {
+        "greeting": [
+            "hi", "hello there", "hey", "good morning", "good evening", "namaste", "namaskar",
+            "hello adarsha ai", "hey, how are you?", "hi there, nice to meet you", "नमस्ते", "greetings",
+        ],
+        "simple": [
+            "who is the principal", "who is the vice principal", "what is your name",
+            "when was the school established", "when was adarsha founded", "where is the school located",
+            "how many students are there", "what time does the first period start", "who made you",
+            "which class is sangam in", "how many staff members are there", "when is the lunch break",
+        ],
+        "detailed": [
+            "tell me about the eco industrial project", "explain the daily schedule", "list all the teachers",
+            "describe the technical department", "give me complete details about enrollment",
+            "tell me everything about the ai project team", "explain how you were built",
+            "what does each zone of the eco industrial project do", "describe the history of the school",
+            "which teachers teach grade 10 and what subjects", "give me an overview of the computer department",
+            "what are the benefits and applications of the project",
+        ],
+        "general": [
+            "what is photosynthesis", "can you help me with my homework", "what is the capital of nepal",
+            "tell me a joke", "how do i prepare for the see exam", "what is artificial intelligence",
+            "what is the weather like today", "how do computers work", "give me some study tips",
+            "what is renewable energy", "who won the world cup", "what should i eat for lunch",
+        ],
+    }
+    
+    def __init__(self, mode: str = INTENT_CLASSIFIER, margin: float = INTENT_MARGIN):
+        self.mode = mode
+        self.margin = margin
+        self.labels = list(self.EXAMPLES)
+        self.centroids = None
+        self._lock = threading.Lock()
+        self.classified = {label: 0 for label in self.CLASSES}
+        self.sources = {"centroid": 0, "tiebreak": 0, "regex": 0}
+        self.latency_us = Histogram([5, 10, 25, 50, 100, 250, 1000])
+    
+    def prepare(self):
+        """Embed the labeled examples once and average them into unit-length centroids"""
+        if self.centroids is not None:
+            return
+        with self._lock:
+            if self.centroids is None:
+                rows = []
+                for label in self.labels:
+                    centroid = encode_stored(self.EXAMPLES[label]).mean(axis=0)
+                    rows.append(centroid / (np.linalg.norm(centroid) or 1.0))
+                self.centroids = np.stack(rows).astype(np.float32)
+                print(f"[Classifier] ✅ {len(self.labels)} intent centroids ready")
+    
     @classmethod
-    def classify(cls, query: str) -> Dict:
-        query_lower = query.lower().strip()
-        
-        # Short greetings
-        for pattern in cls.GREETING_PATTERNS:
-            if re.match(pattern, query_lower, re.IGNORECASE):
-                return {"type": "greeting", "max_tokens": 100, "temperature": 0.7}
-        
-        # Simple questions
-        for pattern in cls.SIMPLE_PATTERNS:
-            if re.match(pattern, query_lower, re.IGNORECASE):
-                return {"type": "simple", "max_tokens": 200, "temperature": 0.5}
-        
-        # Detailed questions need more tokens
-        for pattern in cls.DETAILED_PATTERNS:
-            if re.search(pattern, query_lower, re.IGNORECASE):
-                return {"type": "detailed", "max_tokens": 800, "temperature": 0.6}
+    def match_patterns(cls, query: str) -> str:
+        """Class from the regexes alone ("general" when none match)"""
+        match = cls.PATTERN_RE.search(query.lower().strip())
+        return match.lastgroup if match else "general"
+    
+    def _label(self, query: str, embedding: Optional["np.ndarray"]) -> Tuple[str, str]:
+        pattern_label = self.match_patterns(query)
+        if embedding is None or self.mode != "embedding":
+            return pattern_label, "regex"
+        try:
+            self.prepare()
+        except Exception as e:
+            print(f"[Classifier] Centroids unavailable, using patterns: {e}")
+            self.mode = "regex"
+            return pattern_label, "regex"
         
-        # Default: moderate response
-        return {"type": "general", "max_tokens": 500, "temperature": 0.7}
+        scores = self.centroids @ embedding
+        first, second = np.argsort(-scores)[:2]
+        if scores[first] - scores[second] >= self.margin:
+            return self.labels[first], "centroid"
+        # Too close to call: the patterns pick between the two nearest classes
+        if pattern_label == self.labels[second]:
+            return pattern_label, "tiebreak"
+        return self.labels[first], "tiebreak"
+    
+    def classify(self, query: str, embedding: Optional["np.ndarray"] = None) -> Dict:
+        """Intent and generation settings; pass the retrieval embedding to use the centroids"""
+        started = time.perf_counter()
+        label, source = self._label(query, embedding)
+        self.latency_us.observe((time.perf_counter() - started) * 1e6)
+        with self._lock:
+            self.classified[label] += 1
+            self.sources[source] += 1
+        return {"type": label, **self.CLASSES[label]}
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            classified = dict(self.classified)
+            sources = dict(self.sources)
+        return {
+            "mode": self.mode,
+            "margin": self.margin,
+            "examples": sum(len(v) for v in self.EXAMPLES.values()),
+            "classified": classified,
+            "sources": sources,
+            "latency_us": self.latency_us.snapshot(),
+        }
+
+query_classifier = QueryClassifier()
 
 # =============================================================================
 # RESPONSE CLEANER - FIXED FOR PROPER SPACING
 # =============================================================================
+def _regex_step(pattern: str, replacement: str, trigger=None, flags: int = 0):
+    """Compiled substitution, skipped when none of the trigger substrings occur"""
+    compiled = re.compile(pattern, flags)
+    if trigger is None:
+        return lambda text: compiled.sub(replacement, text)
+    return lambda text: compiled.sub(replacement, text) if any(c in text for c in trigger) else text
+
+def _delete_step(chars: str):
+    """Delete every occurrence of chars"""
+    if len(chars) == 1:
+        return lambda text: text.replace(chars, "")
+    # translate only has a fast path for ASCII strings; a character class wins otherwise
+    table = str.maketrans("", "", chars)
+    compiled = re.compile("[" + re.escape(chars) + "]")
+    return lambda text: text.translate(table) if text.isascii() else compiled.sub("", text)
+
+# Spoken forms as (abbreviation, what may follow it, expansion), in the order the
+# expansions used to run one after another; each starts on a word boundary
+ABBREVIATIONS = [
+    ("Er.", r'\s*', 'Engineer '),
+    ("Mr.", r'\s*', 'Mister '),
+    ("Ms.", r'\s*', 'Miss '),
+    ("Dr.", r'\s*', 'Doctor '),
+    ("B.S.", '', 'B S'),
+    ("A.D.", '', 'A D'),
+    ("AD", r'\b', 'A D'),
+]
+
+def _compile_abbreviations():
+    # Leading with a character class lets the regex engine skip ahead quickly;
+    # group i + 1 matches abbreviation i
+    initials = "".join(sorted({abbreviation[0] for abbreviation, _, _ in ABBREVIATIONS}))
+    branches = "|".join(
+        f"(?<={re.escape(abbreviation[0])})({re.escape(abbreviation[1:])}{follow})"
+        for abbreviation, follow, _ in ABBREVIATIONS
+    )
+    return re.compile(f"[{initials}](?<=\\b[{initials}])(?:{branches})")
+
+_ABBREVIATION_RE = _compile_abbreviations()
+_ABBREVIATION_TABLE = [spoken for _, _, spoken in ABBREVIATIONS]
+
+def _expand_abbreviations(text: str) -> str:
+    """All expansions in one alternation pass"""
+    # Run one after another, a later pattern never matched right after an expansion
+    # ending in a letter ("B S", "A D") because its \b was gone by then
+    previous = [-1, 0]
+    
+    def expand(match):
+        index = match.lastindex - 1
+        end, last = previous
+        if match.start() == end and index > last and _ABBREVIATION_TABLE[last][-1].isalpha():
+            previous[0] = -1
+            return match.group(0)
+        previous[0], previous[1] = match.end(), index
+        return _ABBREVIATION_TABLE[index]
+    
+    return _ABBREVIATION_RE.sub(expand, text)
+
 class ResponseCleaner:
     """Cleans AI responses for text and voice output - FIXED SPACING"""
     
-    @staticmethod
-    def clean_for_voice(text: str) -> str:
-        """Clean complete text for TTS - maintains proper spacing"""
-        if not text:
-            return ""
-        
+    # clean_for_voice steps in order, each paired with a marker that must not be left
+    # unpaired when VoiceStreamCleaner cuts the stream after that step
+    VOICE_PASSES = [
         # Remove markdown headers
-        text = re.sub(r'#{1,6}\s*', '', text)
+        (_regex_step(r'#{1,6}\s*', '', trigger='#'), None),
         
         # Remove bold/italic markers but keep content with spaces
-        text = re.sub(r'\*{1,3}([^*]+)\*{1,3}', r'\1', text)
-        text = re.sub(r'_{1,3}([^_]+)_{1,3}', r'\1', text)
+        (_regex_step(r'\*{1,3}([^*]+)\*{1,3}', r'\1', trigger='*'), '*'),
+        (_regex_step(r'_{1,3}([^_]+)_{1,3}', r'\1', trigger='_'), '_'),
         
         # Remove remaining asterisks
-        text = re.sub(r'\*+', '', text)
+        (_delete_step('*'), None),
         
         # Remove bullet points and list markers
-        text = re.sub(r'^[\s]*[-•*]\s*', '', text, flags=re.MULTILINE)
-        text = re.sub(r'^[\s]*\d+\.\s*', '', text, flags=re.MULTILINE)
+        (_regex_step(r'^[\s]*[-•*]\s*', '', trigger='-•', flags=re.MULTILINE), None),
+        (_regex_step(r'^[\s]*\d+\.\s*', '', trigger='0123456789', flags=re.MULTILINE), None),
         
         # Remove code blocks and inline code
-        text = re.sub(r'```[^`]*```', '', text, flags=re.DOTALL)
-        text = re.sub(r'`([^`]+)`', r'\1', text)
+        (_regex_step(r'```[^`]*```', '', trigger='`', flags=re.DOTALL), None),
+        (_regex_step(r'`([^`]+)`', r'\1', trigger='`'), '`'),
         
-        # Remove special characters that sound bad in TTS
-        text = re.sub(r'[~><|\\/@#$%^&+=\[\]{}]', '', text)
-        
-        # Remove table formatting
-        text = re.sub(r'\|[^\n]*\|', '', text)
+        # Remove special characters that sound bad in TTS (this also removes every
+        # "|", so markdown tables need no pass of their own)
+        (_delete_step('~><|\\/@#$%^&+=[]{}'), None),
         
         # Convert common abbreviations for speech
-        text = re.sub(r'\bEr\.\s*', 'Engineer ', text)
-        text = re.sub(r'\bMr\.\s*', 'Mister ', text)
-        text = re.sub(r'\bMs\.\s*', 'Miss ', text)
-        text = re.sub(r'\bDr\.\s*', 'Doctor ', text)
-        text = re.sub(r'\bB\.S\.', 'B S', text)
-        text = re.sub(r'\bA\.D\.', 'A D', text)
-        text = re.sub(r'\bAD\b', 'A D', text)
-        
-        # Replace newlines with proper spacing
-        text = re.sub(r'\n+', ' ', text)
+        (_expand_abbreviations, None),
         
-        # Fix multiple spaces but preserve single spaces
-        text = re.sub(r'  +', ' ', text)
+        # Newlines and runs of spaces become a single space
+        (_regex_step(r'[ \n]{2,}|\n', ' ', trigger=('\n', '  ')), None),
         
         # Clean up punctuation spacing
-        text = re.sub(r'\s+([.,!?])', r'\1', text)
-        text = re.sub(r'([.,!?])([A-Za-z])', r'\1 \2', text)
+        (_regex_step(r'\s+([.,!?])', r'\1', trigger='.,!?'), None),
+        (_regex_step(r'([.,!?])([A-Za-z])', r'\1 \2', trigger='.,!?'), None),
+    ]
+    
+    TEXT_EMPHASIS = re.compile(r'\*{3,}')
+    TEXT_BLANK_LINES = re.compile(r'\n{3,}')
+    
+    @staticmethod
+    def clean_for_voice(text: str) -> str:
+        """Clean complete text for TTS - maintains proper spacing"""
+        if not text:
+            return ""
+        
+        for step, _ in ResponseCleaner.VOICE_PASSES:
+            text = step(text)
         
         return text.strip()
     
@@ -462,21 +1091,396 @@ class ResponseCleaner:
     @staticmethod
     def clean_for_text(text: str) -> str:
         """Light cleaning for text display"""
-        text = re.sub(r'\*{3,}', '**', text)
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        text = ResponseCleaner.TEXT_EMPHASIS.sub('**', text)
+        text = ResponseCleaner.TEXT_BLANK_LINES.sub('\n\n', text)
         return text.strip()
 
+# =============================================================================
+# STREAMING VOICE CLEANER
+# =============================================================================
+class VoiceStreamCleaner:
+    """Incremental clean_for_voice: the concatenated output equals clean_for_voice(full text)"""
+    
+    # Text is only cut between whitespace and an ASCII letter. No pass can match across
+    # such a cut as long as the head still ends in whitespace after every pass and keeps
+    # no unpaired *, _ or ` markers, so the head is cleaned on its own and emitted.
+    CUT = re.compile(r'(?<=[ \t\n\r\f\v])(?=[A-Za-z])')
+    WHITESPACE = " \t\n\r\f\v"
+    # Cleaning a head costs every pass, so wait for a few words before cutting
+    MIN_CUT_CHARS = 16
+    
+    def __init__(self):
+        self._buffer = ""
+        self._scan = 0
+        self._held = ""
+        self._started = False
+    
+    def feed(self, text: str) -> str:
+        """Add streamed text and return the cleaned output that is now final"""
+        self._buffer += text
+        cut = None
+        for match in self.CUT.finditer(self._buffer, self._scan):
+            cut = match.start()
+        self._scan = len(self._buffer)
+        if cut is None or cut < self.MIN_CUT_CHARS:
+            return ""
+        
+        head = self._clean_head(self._buffer[:cut])
+        if head is None:
+            return ""
+        self._buffer = self._buffer[cut:]
+        self._scan = len(self._buffer)
+        return self._emit(head)
+    
+    def finish(self) -> str:
+        """Clean whatever is still held back once the stream ends"""
+        rest = self._buffer
+        for step, _ in ResponseCleaner.VOICE_PASSES:
+            rest = step(rest)
+        out = self._emit(rest)
+        self._buffer = ""
+        self._scan = 0
+        self._held = ""
+        return out
+    
+    def _clean_head(self, text: str) -> Optional[str]:
+        """Run every pass on the head, or None if some pass could reach past the cut"""
+        for step, marker in ResponseCleaner.VOICE_PASSES:
+            text = step(text)
+            if text and text[-1] not in self.WHITESPACE:
+                return None
+            if marker and marker in text:
+                return None
+        return text
+    
+    def _emit(self, text: str) -> str:
+        # clean_for_voice strips the whole answer: drop leading whitespace and hold
+        # trailing whitespace until more text follows it
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._started = True
+        core = text.rstrip()
+        if not core:
+            self._held += text
+            return ""
+        out = self._held + core
+        self._held = text[len(core):]
+        return out
+
+# =============================================================================
+# SENTENCE SEGMENTATION
+# =============================================================================
+class SentenceSegmenter:
+    """Splits a streamed answer into speakable sentences as soon as each one completes"""
+    
+    # A terminator followed by whitespace, or a line break on its own
+    BOUNDARY = re.compile(r'(?P<end>[.!?।]+["\'”)\]]*)\s+|\n+')
+    # Characters at the end of the buffer that a later token could turn into a boundary
+    OPEN_TAIL = re.compile(r'[.!?।"\'”)\]]*$')
+    WORD_BEFORE = re.compile(r'(\S+)$')
+    
+    # Titles that precede a name (the ones ResponseCleaner expands for speech)
+    TITLES = {"er", "mr", "mrs", "ms", "dr", "prof", "st"}
+    # Dotted abbreviations that never end a sentence
+    INNER = {"e.g", "i.e"}
+    # Eras end a sentence only when the next word is capitalised ("2081 B.S. The ...")
+    ERAS = {"b.s", "a.d", "b.c"}
+    
+    def __init__(self):
+        self._buffer = ""
+        self._scan = 0
+        self._offset = 0
+        self.count = 0
+        # Offset in the whole stream just past each sentence's terminator
+        self.ends = []
+    
+    def feed(self, text: str) -> List[str]:
+        """Add streamed text and return the sentences it completed"""
+        self._buffer += text
+        sentences = []
+        while True:
+            match = self.BOUNDARY.search(self._buffer, self._scan)
+            if match is None:
+                self._scan = max(self._scan, self.OPEN_TAIL.search(self._buffer).start())
+                return sentences
+            
+            verdict = self._is_boundary(match)
+            if verdict is None:
+                # Need the next word to decide
+                self._scan = match.start()
+                return sentences
+            if not verdict:
+                self._scan = match.end()
+                continue
+            
+            end = match.end("end") if match.group("end") else match.start()
+            sentence = self._buffer[:end].strip()
+            self._buffer = self._buffer[match.end():]
+            self._scan = 0
+            if sentence:
+                self.count += 1
+                self.ends.append(self._offset + end)
+                sentences.append(sentence)
+            self._offset += match.end()
+    
+    def _is_boundary(self, match) -> Optional[bool]:
+        terminator = match.group("end")
+        if not terminator or set(terminator.rstrip("\"'”)]")) != {"."}:
+            return True  # a line break, "!", "?" or "।"
+        
+        word = self.WORD_BEFORE.search(self._buffer, max(0, match.start() - 24), match.start())
+        if word is None:
+            return True
+        core = word.group(1).lstrip("\"'“(").rstrip(".").lower()
+        
+        if len(core) == 1 and core.isalpha():
+            return False  # an initial: "R. K. Sharma"
+        if core in self.TITLES or core in self.INNER:
+            return False
+        if core in self.ERAS:
+            if match.end() >= len(self._buffer):
+                return None
+            return self._buffer[match.end()].isupper()
+        return True
+    
+    def finish(self) -> Optional[str]:
+        """Whatever is left once the stream ends"""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        self._scan = 0
+        if rest:
+            self.count += 1
+            return rest
+        return None
+
+# =============================================================================
+# FAST PATH ANSWERS
+# =============================================================================
+NEPALI_DIGITS = str.maketrans("0123456789", "०१२३४५६७८९")
+
+def parse_school_facts(directive: str = CORE_DIRECTIVE) -> Dict:
+    """Pull the fixed facts (leadership, founding, staff roles) out of CORE_DIRECTIVE"""
+    def field(pattern: str) -> Optional[str]:
+        match = re.search(pattern, directive, re.MULTILINE)
+        return match.group(1).strip() if match else None
+    
+    facts = {
+        "name": field(r'^- Name:\s*(.+)$'),
+        "location": field(r'^- Location:\s*(.+)$'),
+        "established": field(r'^- Established:\s*(.+)$'),
+        "principal": field(r'^- Principal:\s*(.+)$'),
+        "vice_principal": field(r'^- Vice Principal:\s*(.+)$'),
+        "developer": field(r'^\*\*Lead Developer:\*\*\s*(.+)$'),
+        "total_students": field(r'^\*\*Total Students:\*\*\s*(.+)$'),
+        "staff": {},
+    }
+    
+    years = re.match(r'(\d{4})\s*B\.S\.\s*\((\d{4})\s*AD\)', facts["established"] or "")
+    facts["established_bs"], facts["established_ad"] = years.groups() if years else (None, None)
+    
+    directory = re.search(r'^### COMPLETE STAFF DIRECTORY \((\d+) Members\)\n(.*?)(?=^### )',
+                          directive, re.MULTILINE | re.DOTALL)
+    if directory:
+        facts["staff_count"] = int(directory.group(1))
+        entry = None
+        for line in directory.group(2).splitlines():
+            member = re.match(r'^\d+\.\s+(.+?)\s+-\s+(.+)$', line)
+            if member:
+                name, role = member.groups()
+                # "- Note: ..." after the grades means the entry needs more than its role
+                notes = " - Note:" in role
+                role = role.split(" - Note:")[0].strip()
+                entry = {"name": name, "role": role, "notes": notes}
+                facts["staff"][FastPathResponder.name_key(name)] = entry
+            elif entry and line.startswith("    - "):
+                entry["notes"] = True
+    return facts
+
+class FastPathResponder:
+    """Answers greetings and fixed-fact questions from templates, with no embedding or LLM call"""
+    
+    NAME_TITLES = re.compile(r'^(?:er|mr|mrs|ms|dr|sir|miss|madam)\.?\s+')
+    
+    GREETINGS = re.compile(
+        r'^(?:(?P<hello>hi|hello|hey)|(?P<namaste>namaste|namaskar|नमस्ते|नमस्कार)'
+        r'|good\s*(?P<time>morning|afternoon|evening))(?:\s+(?:there|adarsha(?:\s+ai)?|ai))?$')
+    
+    # Anchored on the whole question, so anything longer falls back to the LLM
+    INTENTS = [
+        ("principal", re.compile(r'^(?:who\s+is|who\'?s)\s+(?:the\s+)?(?:school\s+)?principal(?:\s+of\s+(?:the|this|adarsha)\s+school)?$'
+                                 r'|^प्रधानाध्यापक\s+को\s+(?:हुनुहुन्छ|हो)$')),
+        ("vice_principal", re.compile(r'^(?:who\s+is|who\'?s)\s+(?:the\s+)?vice\s*principal(?:\s+of\s+(?:the|this|adarsha)\s+school)?$'
+                                      r'|^उपप्रधानाध्यापक\s+को\s+(?:हुनुहुन्छ|हो)$')),
+        ("established", re.compile(r'^when\s+was\s+(?:the|this|adarsha)(?:\s+secondary)?\s+school\s+(?:established|founded|started)$'
+                                   r'|^(?:विद्यालय|स्कूल)\s+कहिले\s+स्थापना\s+भएको\s+हो$')),
+        ("name", re.compile(r'^(?:what\s+is\s+your\s+name|who\s+are\s+you)$')),
+        ("staff", re.compile(r'^(?:who\s+is|who\'?s|what\s+does)\s+(?P<who>[a-z. ]+?)(?:\s+teach)?$')),
+    ]
+    
+    TEMPLATES = {
+        ("greeting", "english"): "{salutation}! I'm **Adarsha AI**, the assistant of {school}. "
+                                 "Ask me about our teachers, classes, daily schedule or the Eco Industrial Project.",
+        ("greeting", "nepali"): "नमस्ते! म **आदर्श AI** हुँ, आदर्श माध्यमिक विद्यालयको सहायक। "
+                                "शिक्षक, कक्षा, दैनिक तालिका वा इको इन्डस्ट्रियल प्रोजेक्टबारे सोध्नुहोस्।",
+        ("principal", "english"): "The principal of {school} is **{principal}**.",
+        ("principal", "nepali"): "आदर्श माध्यमिक विद्यालयका प्रधानाध्यापक **{principal}** हुनुहुन्छ।",
+        ("vice_principal", "english"): "The vice principal of {school} is **{vice_principal}**.",
+        ("vice_principal", "nepali"): "आदर्श माध्यमिक विद्यालयका उपप्रधानाध्यापक **{vice_principal}** हुनुहुन्छ।",
+        ("established", "english"): "{school} was established in **{established_bs} B.S. ({established_ad} AD)** "
+                                    "in {location}.",
+        ("established", "nepali"): "आदर्श माध्यमिक विद्यालय **वि.सं. {established_bs_ne} (सन् {established_ad_ne})** "
+                                   "मा स्थापना भएको हो।",
+        ("name", "english"): "I'm **Adarsha AI**, the AI assistant of {school}, built by {developer}.",
+        ("staff", "english"): "**{member}** is on the staff of {school}: {role}.",
+    }
+    
+    def __init__(self, directive: str = CORE_DIRECTIVE):
+        self.facts = parse_school_facts(directive)
+        self.values = {
+            "school": self.facts["name"],
+            "principal": self.facts["principal"],
+            "vice_principal": self.facts["vice_principal"],
+            "established_bs": self.facts["established_bs"],
+            "established_ad": self.facts["established_ad"],
+            "established_bs_ne": (self.facts["established_bs"] or "").translate(NEPALI_DIGITS),
+            "established_ad_ne": (self.facts["established_ad"] or "").translate(NEPALI_DIGITS),
+            "location": self.facts["location"],
+            "developer": self.facts["developer"],
+        }
+        self.answers: Dict[str, int] = {}
+        self.fallbacks = 0
+        self.lookup_us = Histogram([20, 50, 100, 250, 500, 1000])
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def name_key(cls, name: str) -> str:
+        name = cls.NAME_TITLES.sub('', name.lower().strip())
+        return " ".join(re.sub(r'[^a-z ]', '', name).split())
+    
+    def match(self, query: str) -> Optional[Tuple[str, Dict]]:
+        """(intent, template values) when the question is one we answer verbatim"""
+        q = " ".join(query.lower().strip().rstrip('?!.।').split())
+        
+        greeting = self.GREETINGS.match(q)
+        if greeting:
+            if greeting.group("time"):
+                salutation = f"Good {greeting.group('time')}"
+            else:
+                salutation = "Namaste" if greeting.group("namaste") else "Hello"
+            return "greeting", {"salutation": salutation}
+        
+        for intent, pattern in self.INTENTS:
+            found = pattern.match(q)
+            if not found:
+                continue
+            if intent != "staff":
+                return intent, {}
+            # Only an exact full name counts: "who is ganesh" could be two people
+            member = self.facts["staff"].get(self.name_key(found.group("who")))
+            if member is None or member["notes"]:
+                return None
+            return "staff", {"member": member["name"], "role": member["role"]}
+        return None
+    
+    def answer(self, query: str, is_voice: bool) -> Optional[str]:
+        """The templated answer, or None to fall back to the LLM path"""
+        started = time.perf_counter()
+        matched = self.match(query)
+        language = LanguageDetector.get_language(query)
+        template = None
+        if matched is not None:
+            template = self.TEMPLATES.get((matched[0], language)) or self.TEMPLATES.get((matched[0], "english"))
+        
+        if template is None:
+            if QueryClassifier.match_patterns(query) in ("greeting", "simple"):
+                with self._lock:
+                    self.fallbacks += 1
+            return None
+        
+        text = template.format(**self.values, **matched[1])
+        answer = ResponseCleaner.clean_for_voice(text) if is_voice else ResponseCleaner.clean_for_text(text)
+        self.lookup_us.observe((time.perf_counter() - started) * 1e6)
+        with self._lock:
+            self.answers[matched[0]] = self.answers.get(matched[0], 0) + 1
+        return answer
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            answers = dict(self.answers)
+            fallbacks = self.fallbacks
+        return {
+            "enabled": FAST_PATH_ENABLED,
+            "facts": sum(1 for k, v in self.values.items() if v),
+            "staff": len(self.facts["staff"]),
+            "answers": answers,
+            "fallbacks": fallbacks,
+            "lookup_us": self.lookup_us.snapshot(),
+        }
+
+fast_path = FastPathResponder()
+
+# =============================================================================
+# IN-MEMORY EXACT SEARCH
+# =============================================================================
+class NumpySearchIndex:
+    """Exact cosine search over all chunk embeddings held in one float32 matrix"""
+    
+    def __init__(self):
+        self.matrix = None
+        self.documents = []
+    
+    @property
+    def size(self) -> int:
+        return len(self.documents)
+    
+    def load(self, collection) -> bool:
+        """Pull every embedding and document out of the collection once"""
+        data = collection.get(include=["embeddings", "documents"])
+        embeddings = data.get("embeddings")
+        documents = data.get("documents") or []
+        if embeddings is None or len(embeddings) == 0:
+            self.matrix = None
+            self.documents = []
+            return False
+        
+        matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = np.ascontiguousarray(matrix / norms)
+        self.documents = list(documents)
+        return True
+    
+    def search(self, embedding: "np.ndarray", top_k: int = 3) -> List[str]:
+        if self.matrix is None or not self.documents:
+            return []
+        
+        scores = self.matrix @ embedding
+        k = min(top_k, len(scores))
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        ranked = candidates[np.argsort(-scores[candidates])]
+        return [self.documents[i] for i in ranked]
+
 # =============================================================================
 # VECTOR STORE
 # =============================================================================
 class VectorStore:
-    """ChromaDB-based vector store"""
+    """ChromaDB-based vector store with optional in-memory exact search"""
     
     def __init__(self):
         self.db_path = VECTORDB_PATH
         self.collection_name = COLLECTION_NAME
         self.client = None
         self.collection = None
+        self.backend = SEARCH_BACKEND
+        self.numpy_index = None
+        self.version = ""
+        self._last_version_check = 0.0
+        self._version_lock = threading.Lock()
     
     def initialize(self) -> bool:
         try:
@@ -491,31 +1495,1161 @@ class VectorStore:
             except:
                 self.collection = self.client.create_collection(self.collection_name)
                 print("[VectorDB] ✅ Created new collection")
+            
+            self.version = self._fingerprint()
+            self._last_version_check = time.monotonic()
+            if self.backend == "numpy":
+                self._load_numpy_index()
             return True
         except Exception as e:
             print(f"[VectorStore] Error: {e}")
             return False
     
-    def search(self, query: str, top_k: int = 3) -> str:
+    def _fingerprint(self) -> str:
+        """Identify the collection contents cheaply: count plus the indexer's build stamp"""
+        count = self.collection.count() if self.collection else 0
+        created = ""
         try:
-            if not self.collection or self.collection.count() == 0:
-                return ""
-            
-            model = get_embedding_model()
-            embedding = model.encode(query.lower().strip()).tolist()
+            meta = self.collection.get(ids=["__metadata__"], include=["metadatas"])
+            if meta and meta.get("metadatas"):
+                created = str(meta["metadatas"][0].get("created", ""))
+        except Exception:
+            pass
+        knowledge = hashlib.md5(CORE_DIRECTIVE.encode("utf-8")).hexdigest()[:12]
+        return f"{self.collection_name}:{count}:{created}:{EMBEDDING_MODEL_NAME}:{knowledge}"
+    
+    def current_version(self) -> str:
+        """Return the collection fingerprint, re-reading it at most every COLLECTION_CHECK_INTERVAL"""
+        if not self.collection:
+            return self.version
+        with self._version_lock:
+            now = time.monotonic()
+            if now - self._last_version_check < COLLECTION_CHECK_INTERVAL:
+                return self.version
+            self._last_version_check = now
+            try:
+                version = self._fingerprint()
+            except Exception as e:
+                print(f"[VectorDB] Version check failed: {e}")
+                return self.version
+            if version != self.version:
+                print("[VectorDB] Collection changed - refreshing")
+                self.version = version
+                if self.backend == "numpy":
+                    self._load_numpy_index()
+            return self.version
+    
+    def _load_numpy_index(self):
+        try:
+            index = NumpySearchIndex()
+            if index.load(self.collection):
+                self.numpy_index = index
+                print(f"[VectorDB] ✅ In-memory search ready ({index.size} vectors)")
+            else:
+                print("[VectorDB] Collection empty - using Chroma search")
+        except Exception as e:
+            self.numpy_index = None
+            print(f"[VectorDB] In-memory index failed, using Chroma search: {e}")
+    
+    def search(self, query: str, top_k: int = 3, embedding: "np.ndarray" = None) -> str:
+        try:
+            if embedding is None:
+                embedding = embed_query(query)
             
-            results = self.collection.query(
-                query_embeddings=[embedding],
-                n_results=top_k,
-                include=["documents", "metadatas"]
-            )
+            if self.numpy_index is not None:
+                documents = self.numpy_index.search(embedding, top_k)
+            else:
+                documents = self._search_chroma(embedding, top_k)
             
-            if results and results.get('documents') and results['documents'][0]:
-                return "\n---\n".join(results['documents'][0][:top_k])
-            return ""
+            return "\n---\n".join(documents[:top_k]) if documents else ""
         except Exception as e:
             print(f"[Search Error] {e}")
             return ""
+    
+    def _search_chroma(self, embedding: "np.ndarray", top_k: int) -> List[str]:
+        if not self.collection or self.collection.count() == 0:
+            return []
+        
+        results = self.collection.query(
+            query_embeddings=[embedding.tolist()],
+            n_results=top_k,
+            include=["documents", "metadatas"]
+        )
+        
+        if results and results.get('documents') and results['documents'][0]:
+            return results['documents'][0]
+        return []
+
+# =============================================================================
+# KNOWLEDGE SECTION INDEX
+# =============================================================================
+class KnowledgeSectionIndex:
+    """Splits CORE_DIRECTIVE into its ### sections and picks the ones relevant to a query"""
+    
+    def __init__(self, directive: str = CORE_DIRECTIVE, token_budget: int = KNOWLEDGE_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.sections = self._split(directive)
+        self.token_counts = [count_tokens(text) for _, text in self.sections]
+        self.full_tokens = count_tokens(directive)
+        self.matrix = None
+        self._lock = threading.Lock()
+        self.selections = 0
+        self.selected_tokens = Histogram([100, 200, 400, 600, 900, 1200, 1800])
+    
+    @staticmethod
+    def _split(directive: str) -> List[Tuple[str, str]]:
+        sections = []
+        for part in re.split(r'(?m)^(?=### )', directive.strip()):
+            part = part.strip()
+            if not part.startswith("### "):
+                continue
+            title = part.split("\n", 1)[0][4:].strip()
+            sections.append((title, part))
+        return sections
+    
+    def prepare(self):
+        """Embed every section once; later calls are free"""
+        if self.matrix is not None or not self.sections:
+            return
+        with self._lock:
+            if self.matrix is None:
+                self.matrix = encode_stored([text for _, text in self.sections])
+                print(f"[Knowledge] ✅ Indexed {len(self.sections)} directive sections")
+    
+    def select(self, embedding: "np.ndarray") -> List[str]:
+        """Most relevant sections within the token budget, in document order"""
+        self.prepare()
+        scores = self.matrix @ embedding
+        chosen, used = [], 0
+        for i in np.argsort(-scores):
+            # The best match is always sent, even if it alone exceeds the budget
+            if chosen and used + self.token_counts[i] > self.token_budget:
+                continue
+            chosen.append(int(i))
+            used += self.token_counts[i]
+        chosen.sort()
+        self.selections += 1
+        self.selected_tokens.observe(used)
+        return [self.sections[i][1] for i in chosen]
+    
+    def render(self, embedding: "np.ndarray") -> str:
+        return "## SCHOOL DATABASE (sections relevant to this question)\n\n" + "\n\n".join(self.select(embedding))
+    
+    def stats(self) -> Dict:
+        return {
+            "mode": KNOWLEDGE_INJECTION,
+            "sections": len(self.sections),
+            "token_budget": self.token_budget,
+            "full_block_tokens": self.full_tokens,
+            "selections": self.selections,
+            "selected_tokens": self.selected_tokens.snapshot(),
+        }
+
+knowledge_index = KnowledgeSectionIndex()
+
+# =============================================================================
+# SEMANTIC RESPONSE CACHE
+# =============================================================================
+class ResponseCache:
+    """LRU cache of full answers looked up by query-embedding similarity"""
+    
+    SAVE_INTERVAL = 10.0
+    
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE,
+                 threshold: float = RESPONSE_CACHE_THRESHOLD, path: str = RESPONSE_CACHE_PATH):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.path = Path(path) if path else None
+        self.version = None
+        self._entries: "OrderedDict[Tuple[bool, str, str], Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+        if self.path:
+            self._load()
+            atexit.register(self.save)
+    
+    def set_version(self, version: str):
+        """Drop every entry when the knowledge collection has changed"""
+        with self._lock:
+            if version == self.version:
+                return
+            if self._entries:
+                self.invalidations += 1
+                print("[ResponseCache] Knowledge changed - cache cleared")
+            self._entries.clear()
+            self.version = version
+            self._dirty = True
+    
+    def lookup(self, embedding: "np.ndarray", is_voice: bool, language: str) -> Optional[str]:
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for key, entry in self._entries.items():
+                if key[0] != is_voice or key[1] != language:
+                    continue
+                score = float(entry["embedding"] @ embedding)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key]["answer"]
+    
+    def put(self, query: str, embedding: "np.ndarray", is_voice: bool, language: str, answer: str):
+        if not answer.strip() or self.max_size <= 0:
+            return
+        key = (is_voice, language, normalize_query(query))
+        with self._lock:
+            self._entries[key] = {"embedding": np.array(embedding, dtype=np.float32), "answer": answer}
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+            should_save = self.path and time.monotonic() - self._last_save > self.SAVE_INTERVAL
+        if should_save:
+            self.save()
+    
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            self.version = data.get("version")
+            for item in data.get("entries", [])[-self.max_size:]:
+                key = (bool(item["is_voice"]), item["language"], item["query"])
+                self._entries[key] = {
+                    "embedding": np.asarray(item["embedding"], dtype=np.float32),
+                    "answer": item["answer"],
+                }
+            print(f"[ResponseCache] ✅ Restored {len(self._entries)} cached answers")
+        except Exception as e:
+            print(f"[ResponseCache] Could not read {self.path}: {e}")
+    
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                "version": self.version,
+                "entries": [
+                    {
+                        "is_voice": key[0],
+                        "language": key[1],
+                        "query": key[2],
+                        "answer": entry["answer"],
+                        "embedding": [round(float(x), 6) for x in entry["embedding"]],
+                    }
+                    for key, entry in self._entries.items()
+                ],
+            }
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+            tmp_path.write_text(json.dumps(data), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[ResponseCache] Could not write {self.path}: {e}")
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": RESPONSE_CACHE_ENABLED,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "persistent": bool(self.path),
+            }
+
+def replay_answer(answer: str, pace_ms: float = RESPONSE_CACHE_REPLAY_MS) -> Generator[str, None, None]:
+    """Stream a stored answer word by word at a steady pace"""
+    delay = pace_ms / 1000.0
+    for token in re.findall(r'\s*\S+', answer):
+        yield token
+        if delay > 0:
+            time.sleep(delay)
+
+async def replay_answer_async(answer: str, pace_ms: float = RESPONSE_CACHE_REPLAY_MS) -> AsyncGenerator[str, None]:
+    """replay_answer for the event loop"""
+    delay = pace_ms / 1000.0
+    for token in re.findall(r'\s*\S+', answer):
+        yield token
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+# =============================================================================
+# API KEY SCHEDULER
+# =============================================================================
+def parse_reset_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse Groq reset hints such as '7.66s', '2m59.56s', '1h2m' or a bare number"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    match = re.fullmatch(r'(?:(\d+)h)?(?:(\d+)m(?!s))?(?:([\d.]+)s)?(?:([\d.]+)ms)?', value.strip())
+    if not match or not any(match.groups()):
+        return None
+    hours, minutes, seconds, millis = match.groups()
+    return (int(hours or 0) * 3600 + int(minutes or 0) * 60
+            + float(seconds or 0) + float(millis or 0) / 1000)
+
+class KeyState:
+    """Live load and rate-limit budget of one API key"""
+    
+    def __init__(self):
+        self.in_flight = 0
+        self.latency_ms = None
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.cooldown_until = 0.0
+        self.last_acquired = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+class KeyScheduler:
+    """Thread-safe least-loaded scheduling across the configured API keys"""
+    
+    LATENCY_ALPHA = 0.3
+    MIN_TOKEN_BUDGET = 1500
+    
+    def __init__(self, key_count: int):
+        self._states = [KeyState() for _ in range(key_count)]
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._states)
+    
+    def acquire(self, exclude: Tuple[int, ...] = ()) -> int:
+        """Reserve the healthiest, least busy key and return its index"""
+        if not self._states:
+            raise ValueError("No API keys configured")
+        with self._lock:
+            now = time.monotonic()
+            candidates = [i for i in range(len(self._states)) if i not in exclude] or list(range(len(self._states)))
+            healthy = [i for i in candidates if self._states[i].cooldown_until <= now]
+            if healthy:
+                fastest = min((self._states[i].latency_ms for i in healthy
+                               if self._states[i].latency_ms is not None), default=None)
+                index = min(healthy, key=lambda i: self._score(self._states[i], fastest))
+            else:
+                # Everything is cooling down: use the key that recovers first
+                index = min(candidates, key=lambda i: self._states[i].cooldown_until)
+            state = self._states[index]
+            state.in_flight += 1
+            state.requests += 1
+            state.last_acquired = now
+            return index
+    
+    def _score(self, state: KeyState, fastest: Optional[float]) -> Tuple:
+        low_budget = (
+            (state.remaining_requests is not None and state.remaining_requests <= 1)
+            or (state.remaining_tokens is not None and state.remaining_tokens < self.MIN_TOKEN_BUDGET)
+        )
+        slow = fastest is not None and state.latency_ms is not None and state.latency_ms > 2 * fastest
+        # A nearly exhausted key loses to any healthy one, however busy: routing to it
+        # only earns a 429 and a cooldown
+        return (low_budget, state.in_flight, slow, state.last_acquired)
+    
+    def release(self, index: int, latency_ms: Optional[float] = None, error: Exception = None):
+        with self._lock:
+            state = self._states[index]
+            state.in_flight = max(0, state.in_flight - 1)
+            if latency_ms is not None:
+                if state.latency_ms is None:
+                    state.latency_ms = latency_ms
+                else:
+                    state.latency_ms += self.LATENCY_ALPHA * (latency_ms - state.latency_ms)
+            if error is not None:
+                state.errors += 1
+                if getattr(error, "status_code", None) == 429:
+                    self._cool_down(state, getattr(getattr(error, "response", None), "headers", None))
+    
+    def observe_response(self, index: int, status_code: int, headers):
+        """Record rate-limit headers seen on any response for this key"""
+        with self._lock:
+            state = self._states[index]
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if remaining_requests is not None and remaining_requests.isdigit():
+                state.remaining_requests = int(remaining_requests)
+            if remaining_tokens is not None and remaining_tokens.isdigit():
+                state.remaining_tokens = int(remaining_tokens)
+            
+            if status_code == 429:
+                self._cool_down(state, headers)
+            elif state.remaining_requests == 0:
+                reset = parse_reset_seconds(headers.get("x-ratelimit-reset-requests"))
+                state.cooldown_until = max(state.cooldown_until, time.monotonic() + (reset or GROQ_KEY_COOLDOWN))
+    
+    def _cool_down(self, state: KeyState, headers):
+        retry_after = parse_reset_seconds(headers.get("retry-after")) if headers else None
+        until = time.monotonic() + (retry_after or GROQ_KEY_COOLDOWN)
+        if until > state.cooldown_until:
+            state.rate_limited += 1
+            state.cooldown_until = until
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                f"key_{i + 1}": {
+                    "in_flight": s.in_flight,
+                    "latency_ms": round(s.latency_ms, 1) if s.latency_ms is not None else None,
+                    "remaining_requests": s.remaining_requests,
+                    "remaining_tokens": s.remaining_tokens,
+                    "cooldown_seconds": round(max(0.0, s.cooldown_until - now), 1),
+                    "requests": s.requests,
+                    "errors": s.errors,
+                    "rate_limited": s.rate_limited,
+                }
+                for i, s in enumerate(self._states)
+            }
+
+# =============================================================================
+# GROQ CLIENT POOL
+# =============================================================================
+class GroqClientPool:
+    """One long-lived Groq client per API key with keep-alive HTTP connections"""
+    
+    def __init__(self, api_keys: List[str], on_response=None):
+        self.api_keys = list(api_keys)
+        self.on_response = on_response
+        self._clients: Dict[int, Groq] = {}
+        self._lock = threading.Lock()
+        self._stats = [
+            {"requests": 0, "new_connections": 0, "reused_connections": 0}
+            for _ in self.api_keys
+        ]
+        self._seen_connections = [OrderedDict() for _ in self.api_keys]
+        self._last_response = [0.0] * len(self.api_keys)
+        atexit.register(self.close)
+    
+    def __len__(self) -> int:
+        return len(self.api_keys)
+    
+    def get(self, index: int) -> Groq:
+        client = self._clients.get(index)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(index)
+            if client is None:
+                client = self._create(index)
+                self._clients[index] = client
+            return client
+    
+    def _create(self, index: int) -> Groq:
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=GROQ_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=GROQ_POOL_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(GROQ_TIMEOUT, connect=10.0),
+            event_hooks={"response": [lambda response: self._on_response(index, response)]},
+        )
+        return Groq(api_key=self.api_keys[index], base_url=GROQ_BASE_URL, http_client=http_client)
+    
+    def _on_response(self, index: int, response):
+        if self.on_response is not None:
+            self.on_response(index, response.status_code, response.headers)
+        
+        # The network stream object identifies the TCP connection a response came over
+        stream = response.extensions.get("network_stream")
+        with self._lock:
+            self._last_response[index] = time.monotonic()
+            stats = self._stats[index]
+            stats["requests"] += 1
+            if stream is None:
+                return
+            seen = self._seen_connections[index]
+            conn_id = id(stream)
+            if conn_id in seen:
+                stats["reused_connections"] += 1
+                seen.move_to_end(conn_id)
+            else:
+                stats["new_connections"] += 1
+                seen[conn_id] = True
+                while len(seen) > GROQ_POOL_MAX_CONNECTIONS * 4:
+                    seen.popitem(last=False)
+    
+    def prewarm(self):
+        """Open a connection per key ahead of the first visitor question"""
+        def warm(index: int):
+            try:
+                self.get(index).models.list()
+            except Exception as e:
+                print(f"[Groq] Pre-warm failed for key {index + 1}: {e}")
+        
+        threads = [threading.Thread(target=warm, args=(i,), daemon=True) for i in range(len(self.api_keys))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=GROQ_TIMEOUT)
+        print(f"[Groq] ✅ Pre-warmed {len(threads)} client(s)")
+    
+    def warm(self, index: int) -> bool:
+        """Reopen a key's connection if it has probably expired; True if a request was made"""
+        idle = time.monotonic() - self._last_response[index]
+        if idle < GROQ_POOL_KEEPALIVE_EXPIRY * 0.8:
+            return False
+        try:
+            self.get(index).models.list()
+        except Exception as e:
+            print(f"[Groq] Warm-up failed for key {index + 1}: {e}")
+        return True
+    
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                try:
+                    client.close()
+                except Exception:
+                    pass
+            self._clients.clear()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            per_key = {f"key_{i + 1}": dict(stats) for i, stats in enumerate(self._stats)}
+            requests = sum(s["requests"] for s in self._stats)
+            reused = sum(s["reused_connections"] for s in self._stats)
+            return {
+                "clients": len(self._clients),
+                "requests": requests,
+                "reused_connections": reused,
+                "reuse_ratio": round(reused / requests, 4) if requests else 0.0,
+                "keys": per_key,
+            }
+
+class AsyncGroqClientPool(GroqClientPool):
+    """AsyncGroq clients for the ASGI server; must be used from a single event loop"""
+    
+    def _create(self, index: int) -> AsyncGroq:
+        async def on_response(response):
+            self._on_response(index, response)
+        
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=GROQ_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=GROQ_POOL_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(GROQ_TIMEOUT, connect=10.0),
+            event_hooks={"response": [on_response]},
+        )
+        return AsyncGroq(api_key=self.api_keys[index], base_url=GROQ_BASE_URL, http_client=http_client)
+    
+    async def prewarm_async(self):
+        async def warm(index: int):
+            try:
+                await self.get(index).models.list()
+            except Exception as e:
+                print(f"[Groq] Async pre-warm failed for key {index + 1}: {e}")
+        
+        await asyncio.gather(*(warm(i) for i in range(len(self.api_keys))))
+        print(f"[Groq] ✅ Pre-warmed {len(self.api_keys)} async client(s)")
+    
+    def close(self):
+        # Closing needs the event loop; at interpreter exit just drop the clients
+        with self._lock:
+            self._clients.clear()
+    
+    async def aclose(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            try:
+                await client.close()
+            except Exception:
+                pass
+
+# =============================================================================
+# CANCELLATION
+# =============================================================================
+class CancellationToken:
+    """Lets another thread stop an in-flight generation and close its upstream stream"""
+    
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+    
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+    
+    def add_callback(self, callback):
+        """Run callback on cancel, immediately if already cancelled"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+    
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+# =============================================================================
+# SINGLE-FLIGHT COALESCING
+# =============================================================================
+class SharedGeneration:
+    """One generation fanned out to every subscriber; late joiners replay the buffered prefix"""
+    
+    def __init__(self, factory, on_finish):
+        self.factory = factory
+        self.on_finish = on_finish
+        self.cancel_token = CancellationToken()
+        self.tokens: List[str] = []
+        self.done = False
+        self.closing = False
+        self.subscribers = 0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._produce, name="shared-generation", daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def _produce(self):
+        try:
+            for token in self.factory(self.cancel_token):
+                with self._cond:
+                    self.tokens.append(token)
+                    self._cond.notify_all()
+        except Exception as e:
+            print(f"[Coalesce] Generation failed: {e}")
+        finally:
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+            self.on_finish(self)
+    
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+    
+    def iterate(self, cancel_token: CancellationToken = None) -> Generator[str, None, None]:
+        if cancel_token is not None:
+            cancel_token.add_callback(self._wake)
+        position = 0
+        try:
+            while True:
+                with self._cond:
+                    while position >= len(self.tokens) and not self.done:
+                        if cancel_token is not None and cancel_token.cancelled:
+                            return
+                        self._cond.wait()
+                    if cancel_token is not None and cancel_token.cancelled:
+                        return
+                    pending = self.tokens[position:]
+                    position = len(self.tokens)
+                    finished = self.done
+                for token in pending:
+                    yield token
+                if finished:
+                    return
+        finally:
+            if cancel_token is not None:
+                cancel_token.remove_callback(self._wake)
+
+class StreamCoalescer:
+    """Routes identical concurrent requests onto a single SharedGeneration"""
+    
+    def __init__(self):
+        self._inflight: Dict[Tuple, SharedGeneration] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.generations = 0
+        self.coalesced = 0
+    
+    def stream(self, key: Tuple, factory,
+               cancel_token: CancellationToken = None) -> Generator[str, None, None]:
+        """factory(cancel_token) must return the token generator for one upstream generation"""
+        with self._lock:
+            self.requests += 1
+            shared = self._inflight.get(key)
+            leader = shared is None
+            if leader:
+                shared = SharedGeneration(factory, lambda s: self._finish(key, s))
+                self._inflight[key] = shared
+                self.generations += 1
+            else:
+                self.coalesced += 1
+            shared.subscribers += 1
+        if leader:
+            shared.start()
+        
+        try:
+            yield from shared.iterate(cancel_token)
+        finally:
+            self._leave(key, shared)
+    
+    def _leave(self, key: Tuple, shared: SharedGeneration):
+        with self._lock:
+            shared.subscribers -= 1
+            abandon = shared.subscribers == 0 and not shared.done
+            if abandon:
+                # Nobody is listening any more: stop upstream and let new requests start fresh
+                shared.closing = True
+                if self._inflight.get(key) is shared:
+                    del self._inflight[key]
+        if abandon:
+            shared.cancel_token.cancel()
+    
+    def _finish(self, key: Tuple, shared: SharedGeneration):
+        with self._lock:
+            if self._inflight.get(key) is shared:
+                del self._inflight[key]
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": COALESCE_ENABLED,
+                "in_flight": len(self._inflight),
+                "requests": self.requests,
+                "upstream_generations": self.generations,
+                "coalesced": self.coalesced,
+                "coalescing_ratio": round(self.coalesced / self.requests, 4) if self.requests else 0.0,
+            }
+
+def history_digest(history: List[Dict]) -> str:
+    """Fingerprint of the history turns that are actually sent upstream"""
+    turns = json.dumps(history[-4:], sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(turns.encode("utf-8")).hexdigest()
+
+# =============================================================================
+# HEDGED STREAMING
+# =============================================================================
+def note_stream_end(chunk, finish: Dict):
+    """Keep the finish_reason and completion token count a stream reports on its last chunks"""
+    if chunk.choices and chunk.choices[0].finish_reason:
+        finish["reason"] = chunk.choices[0].finish_reason
+    # OpenAI-style usage chunk, or Groq's x_groq.usage on the final chunk
+    usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+    if usage is not None and getattr(usage, "completion_tokens", None) is not None:
+        finish["completion_tokens"] = usage.completion_tokens
+
+class StreamAttempt:
+    """One upstream completion stream pumped by a worker thread into a shared queue"""
+    
+    def __init__(self, attempt_id: int, key_index: int, client: Groq, create_kwargs: Dict,
+                 events: "queue.Queue", on_finish):
+        self.id = attempt_id
+        self.key_index = key_index
+        self.client = client
+        self.create_kwargs = create_kwargs
+        self.events = events
+        self.on_finish = on_finish
+        self.cancelled = threading.Event()
+        self.stream = None
+        self.finish: Dict = {}
+        self.thread = threading.Thread(target=self._run, name=f"llm-attempt-{attempt_id}", daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def _run(self):
+        started = time.perf_counter()
+        ttft_ms = None
+        error = None
+        try:
+            self.stream = self.client.chat.completions.create(**self.create_kwargs)
+            for chunk in self.stream:
+                if self.cancelled.is_set():
+                    break
+                note_stream_end(chunk, self.finish)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - started) * 1000
+                    self.events.put((self.id, "token", chunk.choices[0].delta.content))
+            self.events.put((self.id, "done", self.finish))
+        except Exception as e:
+            if not self.cancelled.is_set():
+                error = e
+                self.events.put((self.id, "error", e))
+        finally:
+            # Cancelled while the request was still being opened: close it now
+            if self.cancelled.is_set() and self.stream is not None:
+                try:
+                    self.stream.close()
+                except Exception:
+                    pass
+            self.on_finish(self.key_index, ttft_ms, error)
+    
+    def cancel(self):
+        self.cancelled.set()
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+class HedgePolicy:
+    """Decides when to hedge and keeps the hedge rate under GROQ_HEDGE_MAX_RATE"""
+    
+    def __init__(self):
+        self._ttft_ms: "deque[float]" = deque(maxlen=200)
+        # Sequence numbers of the last 100 requests, and which of them hedged
+        self._recent: "deque[int]" = deque(maxlen=100)
+        self._hedged: set = set()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        self.skipped_budget = 0
+    
+    def record_ttft(self, ttft_ms: float):
+        with self._lock:
+            self._ttft_ms.append(ttft_ms)
+    
+    def delay_seconds(self) -> float:
+        if GROQ_HEDGE_AFTER_MS > 0:
+            return GROQ_HEDGE_AFTER_MS / 1000.0
+        with self._lock:
+            samples = sorted(self._ttft_ms)
+        if len(samples) < 20:
+            return max(GROQ_HEDGE_MIN_MS, 1000.0) / 1000.0
+        p95 = samples[int(0.95 * (len(samples) - 1))]
+        return max(GROQ_HEDGE_MIN_MS, p95) / 1000.0
+    
+    def start_request(self) -> int:
+        """Register a request; the returned sequence number is passed to try_fire"""
+        with self._lock:
+            self.requests += 1
+            self._recent.append(self.requests)
+            oldest = self._recent[0]
+            self._hedged = {seq for seq in self._hedged if seq >= oldest}
+            return self.requests
+    
+    def try_fire(self, seq: int) -> bool:
+        """Claim a hedge for request seq if the recent hedge rate leaves room for one"""
+        with self._lock:
+            if seq in self._hedged:
+                # A request hedges at most once
+                return False
+            if len(self._hedged) + 1 > GROQ_HEDGE_MAX_RATE * max(len(self._recent), 1):
+                self.skipped_budget += 1
+                return False
+            self._hedged.add(seq)
+            self.fired += 1
+            return True
+    
+    def record_win(self):
+        with self._lock:
+            self.won += 1
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            samples = sorted(self._ttft_ms)
+            p95 = samples[int(0.95 * (len(samples) - 1))] if samples else None
+            return {
+                "enabled": GROQ_HEDGE_ENABLED,
+                "requests": self.requests,
+                "hedges_fired": self.fired,
+                "hedges_won": self.won,
+                "skipped_budget": self.skipped_budget,
+                "hedge_rate": round(self.fired / self.requests, 4) if self.requests else 0.0,
+                "ttft_p95_ms": round(p95, 1) if p95 is not None else None,
+            }
+
+# =============================================================================
+# TOKEN BUDGETS
+# =============================================================================
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class TokenBudgetController:
+    """Learns max_tokens per (query class, mode) from how long answers really run"""
+    
+    SAVE_INTERVAL = 10.0
+    
+    def __init__(self, path: str = TOKEN_BUDGET_PATH, target: float = TOKEN_BUDGET_PERCENTILE,
+                 headroom: float = TOKEN_BUDGET_HEADROOM, window: int = TOKEN_BUDGET_WINDOW):
+        self.path = Path(path) if path else None
+        self.target = target
+        self.headroom = headroom
+        self.window = window
+        # Per key: token counts of recent answers; a truncated answer counts as its
+        # budget, so frequent truncation pushes the percentile (and the budget) up
+        self._samples: Dict[str, deque] = {}
+        self._budgets: Dict[str, int] = {}
+        self.outcomes: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        if self.path:
+            self._load()
+            atexit.register(self.save)
+    
+    @staticmethod
+    def key(intent: str, is_voice: bool) -> str:
+        return f"{intent}:{'voice' if is_voice else 'text'}"
+    
+    @staticmethod
+    def default(intent: str, is_voice: bool) -> int:
+        """The fixed budget used before enough answers have been seen"""
+        max_tokens = QueryClassifier.CLASSES[intent]["max_tokens"]
+        if is_voice:
+            max_tokens = min(max_tokens + 200, 1200)
+        return max_tokens
+    
+    def budget(self, intent: str, is_voice: bool) -> int:
+        if not TOKEN_BUDGET_ENABLED:
+            return self.default(intent, is_voice)
+        return self._budgets.get(self.key(intent, is_voice)) or self.default(intent, is_voice)
+    
+    def record(self, intent: str, is_voice: bool, tokens: int, outcome: str):
+        """outcome: complete, truncated (hit max_tokens), interrupted (barge-in) or early_stop"""
+        key = self.key(intent, is_voice)
+        with self._lock:
+            samples = self._samples.setdefault(key, deque(maxlen=self.window))
+            samples.append(tokens)
+            counts = self.outcomes.setdefault(key, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+            self._recompute(key)
+            self._dirty = True
+            should_save = self.path and time.monotonic() - self._last_save > self.SAVE_INTERVAL
+        if should_save:
+            self.save()
+    
+    def _recompute(self, key: str):
+        samples = self._samples[key]
+        if len(samples) < TOKEN_BUDGET_MIN_SAMPLES:
+            self._budgets.pop(key, None)
+            return
+        learned = int(percentile(list(samples), self.target) * self.headroom + 0.5)
+        self._budgets[key] = max(TOKEN_BUDGET_MIN, min(TOKEN_BUDGET_MAX, learned))
+    
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            for key, samples in data.get("samples", {}).items():
+                self._samples[key] = deque((int(x) for x in samples), maxlen=self.window)
+                self._recompute(key)
+            self.outcomes = data.get("outcomes", {})
+            print(f"[Budgets] ✅ Restored token budgets for {len(self._samples)} query classes")
+        except Exception as e:
+            print(f"[Budgets] Could not read {self.path}: {e}")
+    
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                "samples": {key: list(samples) for key, samples in self._samples.items()},
+                "outcomes": self.outcomes,
+            }
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+            tmp_path.write_text(json.dumps(data), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[Budgets] Could not write {self.path}: {e}")
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            classes = {}
+            for intent in QueryClassifier.CLASSES:
+                for is_voice in (False, True):
+                    key = self.key(intent, is_voice)
+                    samples = self._samples.get(key, ())
+                    classes[key] = {
+                        "max_tokens": self.budget(intent, is_voice),
+                        "default": self.default(intent, is_voice),
+                        "learned": key in self._budgets,
+                        "samples": len(samples),
+                        "p50_tokens": percentile(list(samples), 50) if samples else None,
+                        "outcomes": dict(self.outcomes.get(key, {})),
+                    }
+        return {
+            "enabled": TOKEN_BUDGET_ENABLED,
+            "percentile": self.target,
+            "headroom": self.headroom,
+            "voice_max_sentences": VOICE_MAX_SENTENCES,
+            "persistent": bool(self.path),
+            "classes": classes,
+        }
+
+class SentenceLimit:
+    """Cuts a cleaned voice stream right after its first N sentences"""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.segmenter = SentenceSegmenter()
+        self.emitted = 0
+    
+    def feed(self, text: str) -> Tuple[str, bool]:
+        """The part of text to send on, and whether the stream should stop here"""
+        self.segmenter.feed(text)
+        if self.segmenter.count < self.limit:
+            self.emitted += len(text)
+            return text, False
+        # A boundary is only confirmed by the text that follows it, which is all in
+        # this token, so the cut always falls inside it
+        return text[:self.segmenter.ends[self.limit - 1] - self.emitted], True
+
+token_budgets = TokenBudgetController()
+
+# =============================================================================
+# STAGE TIMING
+# =============================================================================
+class StageTimer:
+    """Start and end of each stage of one request, in ms from the request start"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+    
+    def now(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+    
+    def record(self, name: str, start: float, end: float):
+        with self._lock:
+            self.stages[name] = (start, end)
+    
+    def run(self, name: str, fn, *args, **kwargs):
+        start = self.now()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.record(name, start, self.now())
+    
+    def critical_path(self) -> List[str]:
+        """Walk back from the last stage, each time to the input that finished last"""
+        with self._lock:
+            stages = dict(self.stages)
+        if not stages:
+            return []
+        name = max(stages, key=lambda n: stages[n][1])
+        path = [name]
+        while True:
+            start = stages[name][0]
+            # Small slack for the untimed work between one stage ending and the next starting
+            inputs = [n for n, (_, end) in stages.items() if n not in path and end <= start + 0.05]
+            if not inputs:
+                return path[::-1]
+            name = max(inputs, key=lambda n: stages[n][1])
+            path.append(name)
+
+class StageStats:
+    """Per-stage latency, time to first token and the most common critical paths"""
+    
+    BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2000]
+    
+    def __init__(self):
+        self.durations: Dict[str, Histogram] = {}
+        self.ttft_ms = Histogram(self.BUCKETS_MS)
+        # Sum of stage durations minus the actual time to first token
+        self.overlap_ms = Histogram(self.BUCKETS_MS)
+        self.paths: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, timer: StageTimer):
+        with timer._lock:
+            stages = dict(timer.stages)
+        if "upstream" not in stages:
+            return
+        for name, (start, end) in stages.items():
+            with self._lock:
+                histogram = self.durations.get(name)
+                if histogram is None:
+                    histogram = self.durations[name] = Histogram(self.BUCKETS_MS)
+            histogram.observe(end - start)
+        ttft = stages["upstream"][1]
+        self.ttft_ms.observe(ttft)
+        self.overlap_ms.observe(max(0.0, sum(end - start for start, end in stages.values()) - ttft))
+        path = " > ".join(timer.critical_path())
+        with self._lock:
+            self.paths[path] = self.paths.get(path, 0) + 1
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            durations = dict(self.durations)
+            paths = sorted(self.paths.items(), key=lambda item: -item[1])[:5]
+        return {
+            "enabled": STAGE_PARALLEL,
+            "ttft_ms": self.ttft_ms.snapshot(),
+            "overlap_saved_ms": self.overlap_ms.snapshot(),
+            "stages_ms": {name: histogram.snapshot() for name, histogram in durations.items()},
+            "critical_paths": dict(paths),
+        }
+
+class ClientReservation:
+    """A Groq key picked and warmed in the background; released unless a stream claims it"""
+    
+    def __init__(self, llm: "GroqLLM", executor: ThreadPoolExecutor, timer: StageTimer):
+        self._llm = llm
+        self._claimed = False
+        self._lock = threading.Lock()
+        self.future = executor.submit(timer.run, "client", llm.reserve_client)
+    
+    def claim(self) -> Optional[Tuple[int, Groq]]:
+        """The reserved key and client, or None if it failed or was already released"""
+        with self._lock:
+            if self._claimed:
+                return None
+            self._claimed = True
+        try:
+            return self.future.result()
+        except Exception as e:
+            print(f"[Groq] Client reservation failed: {e}")
+            return None
+    
+    def release(self):
+        with self._lock:
+            if self._claimed:
+                return
+            self._claimed = True
+        
+        def give_back(future: Future):
+            if future.exception() is None:
+                self._llm.scheduler.release(future.result()[0])
+        self.future.add_done_callback(give_back)
 
 # =============================================================================
 # GROQ LLM - OPTIMIZED FOR SPEED AND PROPER SPACING
@@ -525,45 +2659,55 @@ class GroqLLM:
     
     def __init__(self):
         self.api_keys = API_KEYS.copy()
-        self.current_key = 0
+        self.scheduler = KeyScheduler(len(self.api_keys))
+        self.pool = GroqClientPool(self.api_keys, on_response=self.scheduler.observe_response)
+        self.async_pool = AsyncGroqClientPool(self.api_keys, on_response=self.scheduler.observe_response)
         self.model = GROQ_MODEL
         self.cleaner = ResponseCleaner()
-        self.classifier = QueryClassifier()
+        self.classifier = query_classifier
+        self.hedging = HedgePolicy()
+        self._cancel_lock = threading.Lock()
+        self.cancellations = {"cancelled": 0, "tokens_received": 0, "tokens_saved_estimate": 0}
     
-    def _get_client(self) -> Groq:
-        if not self.api_keys:
-            raise ValueError("No API keys configured")
-        key = self.api_keys[self.current_key % len(self.api_keys)]
-        return Groq(api_key=key)
+    def _acquire_client(self, exclude: Tuple[int, ...] = ()) -> Tuple[int, Groq]:
+        """Reserve a key from the scheduler; callers must release it when done"""
+        index = self.scheduler.acquire(exclude)
+        return index, self.pool.get(index)
     
-    def _rotate_key(self):
-        self.current_key = (self.current_key + 1) % len(self.api_keys)
+    def reserve_client(self) -> Tuple[int, Groq]:
+        """_acquire_client plus a fresh connection if the key sat idle past keep-alive"""
+        index, client = self._acquire_client()
+        self.pool.warm(index)
+        return index, client
+    
+    def _select_knowledge(self, query: str, query_embedding: "np.ndarray" = None) -> Optional[str]:
+        """Relevant directive sections for this query, or None to send the full block"""
+        if KNOWLEDGE_INJECTION != "sections":
+            return None
+        try:
+            if query_embedding is None:
+                query_embedding = embed_query(query)
+            return knowledge_index.render(query_embedding)
+        except Exception as e:
+            print(f"[Knowledge] Section selection failed, sending full block: {e}")
+            return None
     
     def _build_messages(self, query: str, context: str, is_voice: bool, 
-                        history: List[Dict], language: str) -> List[Dict]:
+                        history: List[Dict], language: str,
+                        knowledge: Optional[str] = None) -> List[Dict]:
         """Build message list for API"""
         
-        # Build system message
-        system_msg = SYSTEM_PROMPT_BASE
-        
-        # Add voice mode instructions if applicable
-        if is_voice:
-            system_msg += VOICE_MODE_ADDITIONS
-        
-        # Add language instruction
-        if language == "nepali":
-            system_msg += "\n\n## LANGUAGE: Respond in NEPALI only."
+        # Precomputed per (mode, language); request-specific parts are appended after it
+        if knowledge is None:
+            messages = [get_system_prompt(is_voice, language).message]
         else:
-            system_msg += "\n\n## LANGUAGE: Respond in ENGLISH only. Ensure proper spacing between all words."
-        
-        # Add knowledge base
-        system_msg += f"\n\n## SCHOOL DATABASE\n{CORE_DIRECTIVE}"
-        
-        messages = [{"role": "system", "content": system_msg}]
+            messages = [
+                get_system_prompt(is_voice, language, full_knowledge=False).message,
+                {"role": "system", "content": knowledge},
+            ]
         
         # Add conversation history (last 4 messages for speed)
-        for msg in history[-4:]:
-            messages.append(msg)
+        messages.extend(history[-4:])
         
         # Build user message with context
         if is_voice:
@@ -583,60 +2727,343 @@ Additional context from database:
         
         return messages
     
+    def _stream_request(self, query: str, context, is_voice: bool, history: List[Dict],
+                        query_embedding: "np.ndarray" = None,
+                        timer: StageTimer = None) -> Tuple[Dict, int, str]:
+        """Keyword arguments for a streaming completion, plus its max_tokens and query class.
+        context may be a Future, so retrieval overlaps classification and knowledge selection"""
+        timer = timer or StageTimer()
+        language = LanguageDetector.get_language(query)
+        query_info = timer.run("classify", self.classifier.classify, query, query_embedding)
+        max_tokens = token_budgets.budget(query_info["type"], is_voice)
+        
+        knowledge = timer.run("knowledge", self._select_knowledge, query, query_embedding)
+        if isinstance(context, Future):
+            context = context.result()
+        messages = timer.run("prompt", self._build_messages, query, context, is_voice, history,
+                             language, knowledge)
+        
+        create_kwargs = dict(
+            model=self.model,
+            messages=messages,
+            temperature=query_info["temperature"],
+            max_tokens=max_tokens,
+            stream=True
+        )
+        return create_kwargs, max_tokens, query_info["type"]
+    
     def generate_stream(self, query: str, context: str, is_voice: bool, 
-                        perception_data: Dict, history: List[Dict]) -> Generator[str, None, None]:
+                        perception_data: Dict, history: List[Dict], status: Dict = None,
+                        query_embedding: "np.ndarray" = None,
+                        cancel_token: CancellationToken = None,
+                        timer: StageTimer = None,
+                        reservation: ClientReservation = None) -> Generator[str, None, None]:
         """Streaming generation with voice optimization - FIXED SPACING"""
         
-        language = LanguageDetector.get_language(query)
-        query_info = self.classifier.classify(query)
+        timer = timer or StageTimer()
+        create_kwargs, max_tokens, intent = self._stream_request(query, context, is_voice, history,
+                                                                 query_embedding, timer)
         
-        max_tokens = query_info["max_tokens"]
-        if is_voice:
-            max_tokens = min(max_tokens + 200, 1200)
+        contents = None
+        received = 0
+        finish = {}
+        failed = False
+        stopped = False
+        voice_cleaner = VoiceStreamCleaner() if is_voice else None
+        limit = SentenceLimit(VOICE_MAX_SENTENCES) if is_voice and VOICE_MAX_SENTENCES > 0 else None
+        try:
+            if GROQ_HEDGE_ENABLED and len(self.api_keys) > 1:
+                if reservation is not None:
+                    reservation.release()
+                contents = self._hedged_stream(create_kwargs, cancel_token, finish)
+            else:
+                reserved = reservation.claim() if reservation is not None else None
+                contents = self._direct_stream(create_kwargs, cancel_token, reserved, finish)
+            
+            upstream_start = timer.now()
+            for token in contents:
+                received += 1
+                if received == 1:
+                    timer.record("upstream", upstream_start, timer.now())
+                if voice_cleaner:
+                    # Same result as clean_for_voice on the full answer
+                    clean_token = voice_cleaner.feed(token)
+                    if limit and clean_token:
+                        clean_token, stopped = limit.feed(clean_token)
+                    if clean_token:
+                        yield clean_token
+                    if stopped:
+                        break
+                else:
+                    yield token
+            
+            if voice_cleaner and not stopped and (cancel_token is None or not cancel_token.cancelled):
+                tail = voice_cleaner.finish()
+                if limit and tail:
+                    tail, _ = limit.feed(tail)
+                if tail:
+                    yield tail
+                        
+        except Exception as e:
+            # A cancelled stream fails on purpose once its connection is closed
+            if cancel_token is None or not cancel_token.cancelled:
+                failed = True
+                print(f"[Stream Error] {e}")
+                if status is not None:
+                    status["error"] = True
+                yield "I apologize, I encountered an error. Please try again."
+        finally:
+            if contents is not None:
+                contents.close()
+            cancelled = cancel_token is not None and cancel_token.cancelled
+            if cancelled and status is not None:
+                status["cancelled"] = True
+            self._record_outcome(intent, is_voice, received, max_tokens, cancelled, failed, stopped, finish)
+    
+    async def generate_stream_async(self, query: str, context: str, is_voice: bool,
+                                    perception_data: Dict, history: List[Dict], status: Dict = None,
+                                    query_embedding: "np.ndarray" = None,
+                                    cancel_token: CancellationToken = None) -> AsyncGenerator[str, None]:
+        """generate_stream on the async client; cancelling the task also cancels the stream"""
         
-        messages = self._build_messages(query, context, is_voice, history, language)
+        create_kwargs, max_tokens, intent = self._stream_request(query, context, is_voice, history, query_embedding)
         
+        key_index = self.scheduler.acquire()
+        stream = None
+        ttft_ms = None
+        error = None
+        received = 0
+        finish = {}
+        cancelled = False
+        stopped = False
+        voice_cleaner = VoiceStreamCleaner() if is_voice else None
+        limit = SentenceLimit(VOICE_MAX_SENTENCES) if is_voice and VOICE_MAX_SENTENCES > 0 else None
+        started = time.perf_counter()
         try:
-            client = self._get_client()
-            stream = client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=query_info["temperature"],
-                max_tokens=max_tokens,
-                stream=True
-            )
+            client = self.async_pool.get(key_index)
+            stream = await client.chat.completions.create(**create_kwargs)
+            async for chunk in stream:
+                if cancel_token is not None and cancel_token.cancelled:
+                    break
+                note_stream_end(chunk, finish)
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if not content:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                    self.hedging.record_ttft(ttft_ms)
+                received += 1
+                if voice_cleaner:
+                    clean_token = voice_cleaner.feed(content)
+                    if limit and clean_token:
+                        clean_token, stopped = limit.feed(clean_token)
+                    if clean_token:
+                        yield clean_token
+                    if stopped:
+                        break
+                else:
+                    yield content
             
+            if voice_cleaner and not stopped and (cancel_token is None or not cancel_token.cancelled):
+                tail = voice_cleaner.finish()
+                if limit and tail:
+                    tail, _ = limit.feed(tail)
+                if tail:
+                    yield tail
+        
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception as e:
+            if cancel_token is None or not cancel_token.cancelled:
+                error = e
+                print(f"[Stream Error] {e}")
+                if status is not None:
+                    status["error"] = True
+                yield "I apologize, I encountered an error. Please try again."
+        finally:
+            if stream is not None:
+                try:
+                    await stream.close()
+                except Exception:
+                    pass
+            self.scheduler.release(key_index, ttft_ms, error)
+            cancelled = cancelled or (cancel_token is not None and cancel_token.cancelled)
+            if cancelled and status is not None:
+                status["cancelled"] = True
+            self._record_outcome(intent, is_voice, received, max_tokens, cancelled, error is not None,
+                                 stopped, finish)
+    
+    def _record_outcome(self, intent: str, is_voice: bool, received: int, max_tokens: int,
+                        cancelled: bool, failed: bool, stopped: bool, finish: Dict = None):
+        """Feed the answer's length to the budgets: the completion tokens the stream reported,
+        or its content chunk count (one or more tokens each) when it reported none"""
+        finish = finish or {}
+        tokens = finish.get("completion_tokens", received)
+        if failed:
+            return
+        if cancelled:
+            self._record_cancellation(received, max_tokens)
+            if not received:
+                return
+            outcome = "interrupted"
+        elif stopped:
+            outcome = "early_stop"
+        elif finish.get("reason") == "length":
+            outcome = "truncated"
+            # Hit the budget by definition, whatever the chunks added up to
+            tokens = max_tokens
+        else:
+            outcome = "complete"
+        token_budgets.record(intent, is_voice, tokens, outcome)
+    
+    def _record_cancellation(self, received: int, max_tokens: int):
+        with self._cancel_lock:
+            self.cancellations["cancelled"] += 1
+            self.cancellations["tokens_received"] += received
+            # Upper bound: the rest of the max_tokens budget was never generated
+            self.cancellations["tokens_saved_estimate"] += max(0, max_tokens - received)
+    
+    def cancellation_stats(self) -> Dict:
+        with self._cancel_lock:
+            return dict(self.cancellations)
+    
+    def _direct_stream(self, create_kwargs: Dict, cancel_token: CancellationToken = None,
+                       reserved: Optional[Tuple[int, Groq]] = None,
+                       finish: Dict = None) -> Generator[str, None, None]:
+        """Single upstream stream on the scheduler's chosen (or an already reserved) key"""
+        key_index, client = reserved or self._acquire_client()
+        stream = None
+        ttft_ms = None
+        error = None
+        started = time.perf_counter()
+        try:
+            stream = client.chat.completions.create(**create_kwargs)
+            if cancel_token is not None:
+                # Closing from the cancelling thread unblocks a read waiting on the network
+                cancel_token.add_callback(stream.close)
             for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    token = chunk.choices[0].delta.content
-                    
-                    if is_voice:
-                        # Minimal cleaning - preserve spaces
-                        clean_token = self.cleaner.clean_token_for_voice(token)
-                        if clean_token:
-                            yield clean_token
-                    else:
-                        yield token
-                        
+                if cancel_token is not None and cancel_token.cancelled:
+                    break
+                if finish is not None:
+                    note_stream_end(chunk, finish)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - started) * 1000
+                        self.hedging.record_ttft(ttft_ms)
+                    yield chunk.choices[0].delta.content
         except Exception as e:
-            print(f"[Stream Error] {e}")
-            self._rotate_key()
-            yield "I apologize, I encountered an error. Please try again."
+            if cancel_token is None or not cancel_token.cancelled:
+                error = e
+            raise
+        finally:
+            if cancel_token is not None and stream is not None:
+                cancel_token.remove_callback(stream.close)
+            self.scheduler.release(key_index, ttft_ms, error)
+    
+    def _finish_attempt(self, key_index: int, ttft_ms: Optional[float], error: Exception):
+        if ttft_ms is not None:
+            self.hedging.record_ttft(ttft_ms)
+        self.scheduler.release(key_index, ttft_ms, error)
+    
+    def _hedged_stream(self, create_kwargs: Dict, cancel_token: CancellationToken = None,
+                       finish: Dict = None) -> Generator[str, None, None]:
+        """Race a second stream on another key if the first token is late; keep the first to answer"""
+        events: "queue.Queue" = queue.Queue()
+        attempts: Dict[int, StreamAttempt] = {}
+        
+        def launch(exclude: Tuple[int, ...] = ()) -> StreamAttempt:
+            key_index, client = self._acquire_client(exclude)
+            attempt = StreamAttempt(len(attempts), key_index, client, create_kwargs,
+                                    events, self._finish_attempt)
+            attempts[attempt.id] = attempt
+            attempt.start()
+            return attempt
+        
+        def on_cancel():
+            events.put((-1, "cancel", None))
+        
+        if cancel_token is not None:
+            cancel_token.add_callback(on_cancel)
+        
+        hedge_seq = self.hedging.start_request()
+        primary = launch()
+        deadline = time.monotonic() + self.hedging.delay_seconds()
+        hedge_pending = True
+        winner = None
+        failed = set()
+        try:
+            while winner is None:
+                timeout = max(0.0, deadline - time.monotonic()) if hedge_pending else None
+                try:
+                    attempt_id, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_pending = False
+                    if self.hedging.try_fire(hedge_seq):
+                        launch(exclude=(primary.key_index,))
+                    continue
+                
+                if kind == "cancel":
+                    return
+                if kind == "token":
+                    winner = attempt_id
+                    if attempt_id != primary.id:
+                        self.hedging.record_win()
+                    for other in attempts.values():
+                        if other.id != winner:
+                            other.cancel()
+                    yield payload
+                elif kind == "error":
+                    failed.add(attempt_id)
+                    if len(failed) == len(attempts) and len(attempts) > 1:
+                        raise payload
+                    if len(attempts) == 1:
+                        # Primary failed before answering: hedge right away if allowed
+                        hedge_pending = False
+                        if not self.hedging.try_fire(hedge_seq):
+                            raise payload
+                        launch(exclude=(primary.key_index,))
+                else:
+                    # Finished without producing any content
+                    failed.add(attempt_id)
+                    if len(failed) == len(attempts):
+                        return
+            
+            while True:
+                attempt_id, kind, payload = events.get()
+                if kind == "cancel":
+                    return
+                if attempt_id != winner:
+                    continue
+                if kind == "token":
+                    yield payload
+                elif kind == "error":
+                    raise payload
+                else:
+                    if finish is not None:
+                        finish.update(payload)
+                    return
+        finally:
+            if cancel_token is not None:
+                cancel_token.remove_callback(on_cancel)
+            for attempt in attempts.values():
+                attempt.cancel()
     
     def generate(self, query: str, context: str, is_voice: bool, 
-                 perception_data: Dict, history: List[Dict]) -> Dict:
+                 perception_data: Dict, history: List[Dict],
+                 query_embedding: "np.ndarray" = None) -> Dict:
         """Non-streaming generation"""
         
         language = LanguageDetector.get_language(query)
-        query_info = self.classifier.classify(query)
-        messages = self._build_messages(query, context, is_voice, history, language)
-        
-        max_tokens = query_info["max_tokens"]
-        if is_voice:
-            max_tokens = min(max_tokens + 200, 1200)
+        query_info = self.classifier.classify(query, query_embedding)
+        knowledge = self._select_knowledge(query, query_embedding)
+        messages = self._build_messages(query, context, is_voice, history, language, knowledge)
+        max_tokens = token_budgets.budget(query_info["type"], is_voice)
         
+        key_index = None
+        started = time.perf_counter()
         try:
-            client = self._get_client()
+            key_index, client = self._acquire_client()
             completion = client.chat.completions.create(
                 model=self.model,
                 messages=messages,
@@ -645,6 +3072,12 @@ Additional context from database:
             )
             
             answer = completion.choices[0].message.content
+            self.scheduler.release(key_index, (time.perf_counter() - started) * 1000)
+            key_index = None
+            if completion.usage is not None:
+                truncated = completion.choices[0].finish_reason == "length"
+                token_budgets.record(query_info["type"], is_voice, completion.usage.completion_tokens,
+                                     "truncated" if truncated else "complete")
             
             if is_voice:
                 answer = self.cleaner.clean_for_voice(answer)
@@ -655,7 +3088,8 @@ Additional context from database:
             
         except Exception as e:
             print(f"[LLM Error] {e}")
-            self._rotate_key()
+            if key_index is not None:
+                self.scheduler.release(key_index, error=e)
             return {'success': False, 'answer': "I apologize, please try again."}
 
 # =============================================================================
@@ -667,47 +3101,246 @@ class AdarshaChatbot:
     def __init__(self):
         self.vector_store = VectorStore()
         self.llm = GroqLLM()
+        self.response_cache = ResponseCache()
+        self.coalescer = StreamCoalescer()
+        self.stage_stats = StageStats()
+        self._executor = None
+        self._stage_executor = None
         self.initialized = False
         self.history = []
     
     def initialize(self) -> bool:
         if self.vector_store.initialize():
+            open_embedding_store()
+            if KNOWLEDGE_INJECTION == "sections":
+                try:
+                    knowledge_index.prepare()
+                except Exception as e:
+                    print(f"[Knowledge] Section index unavailable: {e}")
+            if INTENT_CLASSIFIER == "embedding":
+                try:
+                    query_classifier.prepare()
+                except Exception as e:
+                    print(f"[Classifier] Centroids unavailable: {e}")
+            try:
+                canonical_queries.load()
+            except Exception as e:
+                print(f"[Embeddings] Canonical queries unavailable: {e}")
+            # Fixed texts may all have come from the store; live questions still need the encoder
+            get_embedding_model()
+            if GROQ_PREWARM and self.llm.api_keys:
+                self.llm.pool.prewarm()
             self.initialized = True
             print("[Adarsha AI] ✅ System ready!")
             return True
         return False
     
+    def get_metrics(self) -> Dict:
+        return {
+            "embedding_cache": embedding_cache.stats(),
+            "embedding_batching": embedding_dispatcher.stats(),
+            "canonical_queries": canonical_queries.stats(),
+            "response_cache": self.response_cache.stats(),
+            "system_prompts": system_prompt_stats(),
+            "knowledge_sections": knowledge_index.stats(),
+            "groq_pool": self.llm.pool.stats(),
+            "groq_async_pool": self.llm.async_pool.stats(),
+            "groq_keys": self.llm.scheduler.stats(),
+            "hedging": self.llm.hedging.stats(),
+            "cancellation": self.llm.cancellation_stats(),
+            "coalescing": self.coalescer.stats(),
+            "fast_path": fast_path.stats(),
+            "classifier": query_classifier.stats(),
+            "token_budgets": token_budgets.stats(),
+            "stages": self.stage_stats.stats(),
+        }
+    
+    def _cache_enabled(self, history: List[Dict]) -> bool:
+        # Follow-up questions depend on the conversation, so only fresh ones are cached
+        if not RESPONSE_CACHE_ENABLED or history:
+            return False
+        self.response_cache.set_version(self.vector_store.current_version())
+        return True
+    
     def chat(self, user_input: str, is_voice: bool = False, 
              perception_data: Dict = None) -> Dict:
         if not self.initialized:
             self.initialize()
         
+        if FAST_PATH_ENABLED:
+            answer = fast_path.answer(user_input, is_voice)
+            if answer is not None:
+                return {'success': True, 'answer': answer, 'fast_path': True}
+        
         history = perception_data.get('history', self.history) if perception_data else self.history
-        context = self.vector_store.search(user_input, top_k=3)
+        embedding = embed_query(user_input)
+        language = LanguageDetector.get_language(user_input)
+        use_cache = self._cache_enabled(history)
+        
+        if use_cache:
+            cached = self.response_cache.lookup(embedding, is_voice, language)
+            if cached is not None:
+                return {'success': True, 'answer': cached, 'cached': True}
         
-        return self.llm.generate(
+        context = self.vector_store.search(user_input, top_k=3, embedding=embedding)
+        
+        result = self.llm.generate(
             query=user_input,
             context=context,
             is_voice=is_voice,
             perception_data=perception_data or {},
-            history=history
+            history=history,
+            query_embedding=embedding
         )
+        if use_cache and result.get('success'):
+            self.response_cache.put(user_input, embedding, is_voice, language, result['answer'])
+        return result
     
     def chat_stream(self, user_input: str, is_voice: bool = False, 
-                    perception_data: Dict = None) -> Generator[str, None, None]:
+                    perception_data: Dict = None,
+                    cancel_token: CancellationToken = None) -> Generator[str, None, None]:
         if not self.initialized:
             self.initialize()
         
+        if FAST_PATH_ENABLED:
+            answer = fast_path.answer(user_input, is_voice)
+            if answer is not None:
+                yield answer
+                return
+        
         history = perception_data.get('history', self.history) if perception_data else self.history
-        context = self.vector_store.search(user_input, top_k=3)
+        timer = StageTimer()
         
-        yield from self.llm.generate_stream(
+        def reserve() -> Optional[ClientReservation]:
+            # The Groq key (and a fresh connection if it went idle) is ready by the time the prompt is
+            if STAGE_PARALLEL and self.llm.api_keys and not (GROQ_HEDGE_ENABLED and len(self.llm.api_keys) > 1):
+                return ClientReservation(self.llm, self._stages(), timer)
+            return None
+        
+        reservation = None
+        try:
+            use_cache = self._cache_enabled(history)
+            if not use_cache and not COALESCE_ENABLED:
+                # Nothing can answer this without Groq, so reserve the key while embedding
+                reservation = reserve()
+            embedding = timer.run("embed", embed_query, user_input)
+            language = LanguageDetector.get_language(user_input)
+            
+            if use_cache:
+                cached = timer.run("cache", self.response_cache.lookup, embedding, is_voice, language)
+                if cached is not None:
+                    yield from replay_answer(cached)
+                    return
+            
+            def generate(generation_token: CancellationToken) -> Generator[str, None, None]:
+                # Only the generation that runs holds a key; cache hits and coalesced
+                # followers never reserve one
+                owned = reservation or reserve()
+                try:
+                    if STAGE_PARALLEL:
+                        context = self._stages().submit(timer.run, "search", self.vector_store.search,
+                                                        user_input, 3, embedding)
+                    else:
+                        context = timer.run("search", self.vector_store.search, user_input, 3, embedding)
+                    if generation_token.cancelled:
+                        return
+                    
+                    status = {}
+                    tokens = []
+                    for token in self.llm.generate_stream(
+                        query=user_input,
+                        context=context,
+                        is_voice=is_voice,
+                        perception_data=perception_data or {},
+                        history=history,
+                        status=status,
+                        query_embedding=embedding,
+                        cancel_token=generation_token,
+                        timer=timer,
+                        reservation=owned
+                    ):
+                        tokens.append(token)
+                        yield token
+                finally:
+                    if owned is not None:
+                        owned.release()
+                
+                self.stage_stats.observe(timer)
+                if use_cache and not status.get("error") and not status.get("cancelled"):
+                    self.response_cache.put(user_input, embedding, is_voice, language, "".join(tokens))
+            
+            if not COALESCE_ENABLED:
+                yield from generate(cancel_token or CancellationToken())
+                return
+            
+            key = (normalize_query(user_input), is_voice, language, history_digest(history))
+            yield from self.coalescer.stream(key, generate, cancel_token)
+        finally:
+            if reservation is not None:
+                reservation.release()
+    
+    def _stages(self) -> ThreadPoolExecutor:
+        if self._stage_executor is None:
+            self._stage_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS,
+                                                      thread_name_prefix="adarsha-stage")
+        return self._stage_executor
+
+    def _async_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS,
+                                                thread_name_prefix="adarsha-async")
+        return self._executor
+    
+    async def chat_stream_async(self, user_input: str, is_voice: bool = False,
+                                perception_data: Dict = None,
+                                cancel_token: CancellationToken = None) -> AsyncGenerator[str, None]:
+        """chat_stream for the ASGI server: embedding and retrieval run in the executor,
+        the Groq stream on the event loop"""
+        loop = asyncio.get_running_loop()
+        executor = self._async_executor()
+        if not self.initialized:
+            await loop.run_in_executor(executor, self.initialize)
+        
+        if FAST_PATH_ENABLED:
+            answer = fast_path.answer(user_input, is_voice)
+            if answer is not None:
+                yield answer
+                return
+        
+        history = perception_data.get('history', self.history) if perception_data else self.history
+        embedding = await loop.run_in_executor(executor, embed_query, user_input)
+        language = LanguageDetector.get_language(user_input)
+        use_cache = await loop.run_in_executor(executor, self._cache_enabled, history)
+        
+        if use_cache:
+            cached = self.response_cache.lookup(embedding, is_voice, language)
+            if cached is not None:
+                async for token in replay_answer_async(cached):
+                    yield token
+                return
+        
+        context = await loop.run_in_executor(
+            executor, lambda: self.vector_store.search(user_input, top_k=3, embedding=embedding))
+        if cancel_token is not None and cancel_token.cancelled:
+            return
+        
+        status = {}
+        tokens = []
+        async for token in self.llm.generate_stream_async(
             query=user_input,
             context=context,
             is_voice=is_voice,
             perception_data=perception_data or {},
-            history=history
-        )
+            history=history,
+            status=status,
+            query_embedding=embedding,
+            cancel_token=cancel_token
+        ):
+            tokens.append(token)
+            yield token
+        
+        if use_cache and not status.get("error") and not status.get("cancelled"):
+            self.response_cache.put(user_input, embedding, is_voice, language, "".join(tokens))
 
 # =============================================================================
 # SINGLETON